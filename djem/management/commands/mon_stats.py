@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from djem.utils.mon import get_aggregate_stats
+from djem.utils.mon_store import SQLiteStore
+from djem.utils.table import Table
+
+
+class Command(BaseCommand):
+    
+    help = (
+        'Print the aggregated Mon statistics exported by all processes, e.g.'
+        ' by MonitorMiddleware with DJEM_MON_EXPORT_PATH set.'
+    )
+    
+    def add_arguments(self, parser):
+        
+        parser.add_argument(
+            '--path',
+            help='The path of the SQLite database to read. Defaults to DJEM_MON_EXPORT_PATH.'
+        )
+        
+        parser.add_argument(
+            '--format',
+            default='text',
+            choices=list(Table.FORMATS),
+            help='The output format. Defaults to "text".'
+        )
+        
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Clear the exported statistics after printing them.'
+        )
+    
+    def handle(self, *args, **options):
+        
+        path = options['path'] or getattr(settings, 'DJEM_MON_EXPORT_PATH', None)
+        if not path:
+            raise CommandError('No path given and DJEM_MON_EXPORT_PATH is not set.')
+        
+        store = SQLiteStore(path)
+        monitors = store.read()
+        
+        if not monitors:
+            self.stdout.write('No statistics have been exported.')
+        else:
+            self.stdout.write(get_aggregate_stats(monitors.values(), options['format']))
+        
+        if options['clear']:
+            store.clear()
@@ -1,7 +1,16 @@
+import logging
+
 from django.conf import settings
 from django.contrib.messages.storage import default_storage
 from django.contrib.messages.storage.base import BaseStorage
 
+from djem.utils.mon import Mon
+
+DEFAULT_MON_MAX_ENDPOINTS = 200
+DEFAULT_MON_EXPORT_INTERVAL = 60
+
+logger = logging.getLogger('djem.mon')
+
 
 class MemoryStorage(BaseStorage):
     """
@@ -52,3 +61,109 @@ class MessageMiddleware:
                 raise ValueError('Not all temporary messages could be stored.')
         
         return response
+
+
+class MonitorMiddleware:
+    """
+    Middleware that monitors each request with ``Mon``, using a top-level
+    monitor named after the URL pattern the request resolved to. Monitors
+    started while handling the request, e.g. by the ``mon`` decorator, are
+    nested within it. The trees of all requests to each endpoint are
+    aggregated in process memory, in ``Mon.aggregate``, up to a maximum of
+    ``DJEM_MON_MAX_ENDPOINTS`` endpoints.
+    
+    If ``DJEM_MON_EXPORT_PATH`` is set, the aggregated trees are exported to
+    a SQLite database at that path every ``DJEM_MON_EXPORT_INTERVAL``
+    seconds, to be combined with those of other processes.
+    
+    Request monitors, and the monitors nested within them, measure the CPU
+    time of the current thread only, so the CPU time of each request does not
+    include that of other requests handled concurrently by threaded workers.
+    
+    Monitoring never causes a request to fail. Errors starting or stopping
+    the request monitor are logged to the "djem.mon" logger, and any nested
+    monitors left running when the request is complete are stopped (and
+    counted as errors).
+    """
+    
+    monitor_name = 'request'
+    unresolved_name = '(unresolved)'
+    cpu_clock = 'thread'
+    
+    def __init__(self, get_response):
+        
+        self.get_response = get_response
+        
+        Mon.max_aggregates = getattr(settings, 'DJEM_MON_MAX_ENDPOINTS', DEFAULT_MON_MAX_ENDPOINTS)
+        
+        export_path = getattr(settings, 'DJEM_MON_EXPORT_PATH', None)
+        if export_path:
+            # Only import the store (and sqlite3) when exporting
+            from djem.utils.mon_store import Exporter, SQLiteStore
+            
+            interval = getattr(settings, 'DJEM_MON_EXPORT_INTERVAL', DEFAULT_MON_EXPORT_INTERVAL)
+            self.exporter = Exporter(SQLiteStore(export_path), interval)
+            self.exporter.start()
+        else:
+            self.exporter = None
+    
+    def get_endpoint_name(self, request):
+        
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return self.unresolved_name
+        
+        # The full route is only available in Django 2.2+
+        return getattr(match, 'route', None) or match.view_name
+    
+    def _stop_monitor(self, request, m, error):
+        
+        # Stop any monitors started while handling the request but never
+        # stopped, so the request monitor can be stopped
+        last_m = Mon.get_last()
+        while last_m is not None and last_m is not m:
+            logger.warning('Monitor "%s" was not stopped before the end of the request.', last_m.name)
+            Mon.stop(last_m.name, error=True)
+            last_m = Mon.get_last()
+        
+        # The URL is only resolved while handling the request, so the
+        # monitor can only be named after the endpoint once it is done.
+        # Do so before stopping it, so it is aggregated by endpoint.
+        m.name = self.get_endpoint_name(request)
+        Mon.stop(self.monitor_name, error=error)
+    
+    def __call__(self, request):
+        
+        if self.exporter is not None:
+            # Restart the export thread if the process has been forked since
+            # the middleware was created, where that cannot be done when
+            # forking (prior to Python 3.7)
+            self.exporter.start()
+        
+        # Restore the monitors running before the request once it is complete,
+        # regardless of the monitors started and stopped while handling it
+        running = Mon._running.get()
+        
+        try:
+            Mon.start(self.monitor_name, cpu_clock=self.cpu_clock)
+            m = Mon.get_last()
+        except Exception:
+            logger.exception('Error starting the request monitor.')
+            Mon._running.set(running)
+            
+            return self.get_response(request)
+        
+        error = True
+        
+        try:
+            response = self.get_response(request)
+            error = False
+        finally:
+            try:
+                self._stop_monitor(request, m, error)
+            except Exception:
+                logger.exception('Error stopping the request monitor.')
+            
+            Mon._running.set(running)
+        
+        return response
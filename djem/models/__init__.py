@@ -1,2 +1,3 @@
 from djem.models.fields import *  # noqa
+from djem.models.functions import *  # noqa
 from djem.models.models import *  # noqa
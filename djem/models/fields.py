@@ -1,6 +1,6 @@
 from django.db import models
 
-from djem.utils.dt import PYTZ_AVAILABLE, TIMEZONE_CHOICES, get_tz_helper
+from djem.utils.dt import PYTZ_AVAILABLE, TIMEZONE_CHOICES, ZONEINFO_AVAILABLE, get_tz_helper
 
 __all__ = ('TimeZoneField', )
 
@@ -13,26 +13,29 @@ class TimeZoneField(models.Field):
     functionality for that timezone.
     
     Valid inputs:
-     - A timezone string (accepted by pytz.timezone())
+     - A timezone string (accepted by pytz.timezone() or zoneinfo.ZoneInfo())
      - An instance of pytz.tzinfo.BaseTzInfo
      - The pytz.UTC singleton
+     - An instance of zoneinfo.ZoneInfo
      - An instance of djem.utils.dt.TimeZoneHelper
      - None and the empty string (both representing a null value)
     
     When the value of the field is not null, accessing the value of the field
     will output an instance of djem.utils.dt.TimeZoneHelper,
-    instantiated with the stored timezone.
+    instantiated with the stored timezone. The timezone name is stored, so
+    values are the same regardless of the timezone backend in use (see
+    djem.utils.dt.get_tz_backend()).
     """
     
-    description = "A pytz timezone"
+    description = "A timezone"
     
     CHOICES = TIMEZONE_CHOICES
     MAX_LENGTH = 63
     
     def __init__(self, verbose_name=None, **kwargs):
         
-        if not PYTZ_AVAILABLE:  # pragma: no cover
-            raise RuntimeError('TimeZoneField requires pytz to be installed.')
+        if not PYTZ_AVAILABLE and not ZONEINFO_AVAILABLE:  # pragma: no cover
+            raise RuntimeError('TimeZoneField requires pytz or zoneinfo to be installed.')
         
         kwargs.setdefault('choices', self.CHOICES)
         kwargs.setdefault('max_length', self.MAX_LENGTH)
@@ -47,8 +50,10 @@ class TimeZoneField(models.Field):
         
         name, path, args, kwargs = super(TimeZoneField, self).deconstruct()
         
-        # Only include choices and max_length kwargs if not the default
-        if kwargs['choices'] == self.CHOICES:
+        # Only include choices and max_length kwargs if not the default. The
+        # default choices are compared by identity, rather than element by
+        # element.
+        if self.choices is self.CHOICES:
             del kwargs['choices']
         
         if kwargs['max_length'] == self.MAX_LENGTH:
@@ -83,7 +88,7 @@ class TimeZoneField(models.Field):
             else:
                 return ''
         
-        return helper.tz.zone
+        return helper.name
     
     def validate(self, value, model_instance):
         
@@ -92,4 +97,4 @@ class TimeZoneField(models.Field):
         
         # Only pass the helper's timezone name into the super call - it will
         # be checked for its presence in self.choices
-        super(TimeZoneField, self).validate(value.tz.zone, model_instance)
+        super(TimeZoneField, self).validate(value.name, model_instance)
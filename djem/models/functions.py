@@ -0,0 +1,82 @@
+from django.core.exceptions import ValidationError
+from django.db import NotSupportedError, models
+from django.utils.dateparse import parse_datetime
+
+from djem.utils.dt import get_tz_helper
+
+__all__ = ('LocalDate', )
+
+
+def _sqlite_local_date(value, tz_name):
+    
+    if value is None or not tz_name:
+        return None
+    
+    try:
+        helper = get_tz_helper(tz_name)
+    except ValidationError:
+        return None
+    
+    return helper.get_dates([parse_datetime(value)])[0].isoformat()
+
+
+class LocalDate(models.Func):
+    """
+    The date of a ``DateTimeField`` in the local timezone given by a
+    ``TimeZoneField``, converted within the database. Both are given as field
+    names or expressions, and the ``TimeZoneField`` can be that of a related
+    model, e.g.:
+        
+        Event.objects.annotate(day=LocalDate('date_created', tz_field='owner__timezone'))
+    
+    The result is None if the timezone is null or empty. Requires
+    ``USE_TZ = True``, so datetimes are stored in UTC.
+    
+    Supported on PostgreSQL (via ``AT TIME ZONE``), MySQL (via
+    ``CONVERT_TZ()``, which requires the MySQL timezone tables to be loaded)
+    and SQLite (via a Python function registered on the connection, using
+    TimeZoneHelper).
+    """
+    
+    def __init__(self, expression, tz_field, **extra):
+        
+        extra.setdefault('output_field', models.DateField())
+        
+        super(LocalDate, self).__init__(expression, tz_field, **extra)
+    
+    def _compile_arguments(self, compiler, connection):
+        
+        connection.ops.check_expression_support(self)
+        
+        datetime_sql, datetime_params = compiler.compile(self.source_expressions[0])
+        tz_sql, tz_params = compiler.compile(self.source_expressions[1])
+        
+        return datetime_sql, tz_sql, list(datetime_params) + list(tz_params)
+    
+    def as_sql(self, compiler, connection, **extra_context):
+        
+        raise NotSupportedError('LocalDate is not supported on {0}.'.format(connection.vendor))
+    
+    def as_postgresql(self, compiler, connection, **extra_context):
+        
+        datetime_sql, tz_sql, params = self._compile_arguments(compiler, connection)
+        
+        return "(({0}) AT TIME ZONE NULLIF({1}, ''))::date".format(datetime_sql, tz_sql), params
+    
+    def as_mysql(self, compiler, connection, **extra_context):
+        
+        datetime_sql, tz_sql, params = self._compile_arguments(compiler, connection)
+        
+        return "DATE(CONVERT_TZ({0}, 'UTC', {1}))".format(datetime_sql, tz_sql), params
+    
+    def as_sqlite(self, compiler, connection, **extra_context):
+        
+        datetime_sql, tz_sql, params = self._compile_arguments(compiler, connection)
+        
+        # Register the function on every use, rather than when connecting, in
+        # case the connection was created before this module was imported.
+        # Re-registering a function is cheap.
+        connection.ensure_connection()
+        connection.connection.create_function('djem_local_date', 2, _sqlite_local_date)
+        
+        return 'djem_local_date({0}, {1})'.format(datetime_sql, tz_sql), params
@@ -0,0 +1,202 @@
+"""
+Benchmarks for the performance-sensitive developer utilities. These are not
+run as part of the test suite, as their results are only meaningful relative
+to previous runs on the same machine. Run them from the Django shell:
+
+    python manage.py shell -c "from djem.tests.benchmarks import run; run()"
+"""
+
+from __future__ import division, print_function
+
+import datetime
+import random
+import timeit
+
+from django.utils import timezone
+
+from djem.utils.dt import get_tz_helper
+from djem.utils.mon import M, Mon, _get_stat_table, mon
+from djem.utils.table import Table
+
+
+def _get_table_rows(num_rows, num_cols):
+    
+    rows = [['{0}-{1}'.format(r, c) for c in range(num_cols)] for r in range(num_rows)]
+    headings = ['Column {0}'.format(c) for c in range(num_cols)]
+    
+    return headings, rows
+
+
+def bench_table_build(num_rows=10000, num_cols=10, table_class=Table):
+    """
+    Return the time, in seconds, to populate and render a table of
+    ``num_rows`` rows of ``num_cols`` columns.
+    """
+    
+    headings, rows = _get_table_rows(num_rows, num_cols)
+    
+    def build():
+        
+        t = table_class(headings, title='Benchmark', max_width=500)
+        t.add_rows(rows)
+        t.build_table()
+    
+    return min(timeit.repeat(build, number=1, repeat=3))
+
+
+def bench_table_render(num_rows=10000, num_cols=10, table_class=Table):
+    """
+    Return the time, in seconds, to render an already populated table of
+    ``num_rows`` rows of ``num_cols`` columns.
+    """
+    
+    headings, rows = _get_table_rows(num_rows, num_cols)
+    
+    t = table_class(headings, title='Benchmark', max_width=500)
+    t.add_rows(rows)
+    t.build_table()  # format any buffered rows before timing
+    
+    return min(timeit.repeat(t.build_table, number=1, repeat=3))
+
+
+def bench_m(num_runs=10000):
+    """
+    Return the time, in seconds, to start and stop a nested ``M`` monitor
+    ``num_runs`` times.
+    """
+    
+    parent = M('parent')
+    m = M('child', parent)
+    
+    def run():
+        
+        parent.start()
+        
+        for i in range(num_runs):
+            m.reset()
+            m.start()
+            m.stop()
+        
+        parent.stop()
+    
+    return min(timeit.repeat(run, number=1, repeat=3))
+
+
+def bench_mon_decorator(num_calls=10000, **kwargs):
+    """
+    Return the time, in seconds, of ``num_calls`` calls of an empty function
+    decorated with ``mon``, nested within a running monitor, less the time of
+    calling the function undecorated. Keyword arguments are passed to
+    ``mon``.
+    """
+    
+    def fn():
+        
+        pass
+    
+    decorated = mon('benchmark', **kwargs)(fn)
+    
+    def run(f):
+        
+        with Mon('parent'):
+            for i in range(num_calls):
+                f()
+    
+    baseline = min(timeit.repeat(lambda: run(fn), number=1, repeat=3))
+    result = min(timeit.repeat(lambda: run(decorated), number=1, repeat=3))
+    
+    Mon.reset()
+    
+    return result - baseline
+
+
+def bench_stat_table(num_children=100):
+    """
+    Return the time, in seconds, to render the statistics table of a monitor
+    with ``num_children`` children, each with a child of its own.
+    """
+    
+    root = M('root')
+    root.start()
+    
+    for i in range(num_children):
+        child = M('child {0}'.format(i), root)
+        grandchild = M('grandchild', child)
+        
+        child.start()
+        grandchild.start()
+        grandchild.stop()
+        child.stop()
+    
+    root.stop()
+    
+    stats = root._get_all_stats()
+    
+    def render():
+        
+        _get_stat_table(root, 'Benchmark', stats)
+    
+    return min(timeit.repeat(render, number=1, repeat=3))
+
+
+def bench_calibrate():
+    """
+    Return the fixed overhead, in seconds, of each nested monitor started via
+    ``Mon``, as measured by ``Mon.calibrate()``.
+    """
+    
+    overhead_ns = Mon.calibrate()[0]
+    
+    # Do not affect subsequent benchmarks
+    M.overhead_ns = M.overhead_cpu_ns = 0
+    
+    return overhead_ns / 1e9
+
+
+def bench_tz_dates(num_values=100000, batch=True):
+    """
+    Return the time, in seconds, to convert ``num_values`` random UTC
+    datetimes within a five year period to local dates, either in a batch
+    using ``TimeZoneHelper.get_dates()``, or individually.
+    """
+    
+    helper = get_tz_helper('Australia/Sydney')
+    tz = helper.tz
+    localize = helper._backend.localize  # handles both pytz and zoneinfo
+    
+    start = datetime.datetime(2015, 1, 1, tzinfo=timezone.utc)
+    values = [start + datetime.timedelta(seconds=random.randint(0, 86400 * 365 * 5)) for i in range(num_values)]
+    
+    if batch:
+        def convert():
+            
+            helper.get_dates(values)
+    else:
+        def convert():
+            
+            [localize(value, tz).date() for value in values]
+    
+    return min(timeit.repeat(convert, number=1, repeat=3))
+
+
+BENCHMARKS = (
+    ('Table: populate and render 10k x 10', bench_table_build),
+    ('Table: render 10k x 10', bench_table_render),
+    ('M: start/stop 10k nested runs', bench_m),
+    ('mon: 10k nested calls', bench_mon_decorator),
+    ('mon: 10k calls, 1 in 100 sampled', lambda: bench_mon_decorator(sample_rate=100)),
+    ('M: render stats table (200 monitors)', bench_stat_table),
+    ('Mon: calibrated overhead per monitor', bench_calibrate),
+    ('TimeZoneHelper: 100k local dates, individually', lambda: bench_tz_dates(batch=False)),
+    ('TimeZoneHelper: 100k local dates, batched', bench_tz_dates),
+)
+
+
+def run():
+    
+    t = Table(['Benchmark', 'Best of 3 (seconds)'], title='Benchmarks')
+    
+    for name, bench in BENCHMARKS:
+        t.add_row((name, '{0:.6f}'.format(bench())))
+    
+    print(t.build_table())
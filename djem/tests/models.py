@@ -1,4 +1,6 @@
 from django.contrib.auth.models import AbstractUser, Group, Permission
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import PermissionDenied
 from django.db import models
 
@@ -79,6 +81,33 @@ class TimeZoneTest(models.Model):
         app_label = 'djemtest'
 
 
+class TimeZoneEventTest(models.Model):
+    """
+    This model provides a DateTimeField, and TimeZoneFields both local and on a
+    related model, for testing LocalDate.
+    """
+    
+    owner = models.ForeignKey(TimeZoneTest, on_delete=models.CASCADE)
+    timezone = TimeZoneField(null=True)
+    date_created = models.DateTimeField()
+    
+    class Meta:
+        app_label = 'djemtest'
+
+
+class GenericRelationTest(models.Model):
+    """
+    This model provides a GenericForeignKey for testing object inspection.
+    """
+    
+    content_type = models.ForeignKey(ContentType, null=True, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField(null=True)
+    content_object = GenericForeignKey()
+    
+    class Meta:
+        app_label = 'djemtest'
+
+
 class LogTest(LogMixin, models.Model):
     """
     This model provides a concrete model with the LogMixin for testing.
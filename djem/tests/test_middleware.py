@@ -2,11 +2,15 @@ from __future__ import unicode_literals
 
 from django.conf.urls import url
 from django.contrib import messages
+from django.contrib.auth.models import User
 from django.contrib.messages import constants
+from django.core.exceptions import PermissionDenied
 from django.http import HttpRequest, HttpResponse
-from django.test import Client, TestCase, override_settings
+from django.test import Client, RequestFactory, TestCase, override_settings
 
 from djem.middleware import MemoryStorage
+from djem.utils.mon import Mon, mon
+from djem.views import monitor_stats
 
 
 def add_message_view(request):
@@ -37,9 +41,31 @@ def add_read_message_view(request):
     return HttpResponse('{0}: {1}'.format(prefix, content))
 
 
+@mon('inner')
+def monitored_inner():
+    
+    return User.objects.count()
+
+
+def monitored_view(request, pk):
+    
+    return HttpResponse('count: {0}'.format(monitored_inner()))
+
+
+def leaky_view(request):
+    
+    # Start a monitor without stopping it
+    Mon.start('forgotten')
+    
+    return HttpResponse('leaked')
+
+
 urlpatterns = [
     url(r'^messages/add/$', add_message_view),
     url(r'^messages/add/read/$', add_read_message_view),
+    url(r'^monitored/(?P<pk>\d+)/$', monitored_view, name='monitored'),
+    url(r'^monitored/other/$', monitored_view, {'pk': 0}, name='monitored_other'),
+    url(r'^leaky/$', leaky_view, name='leaky'),
 ]
 
 
@@ -51,6 +77,14 @@ djem_middleware_settings = override_settings(
     ]
 )
 
+monitor_middleware_settings = override_settings(
+    ROOT_URLCONF='djem.tests.test_middleware',
+    MIDDLEWARE=[
+        'djem.middleware.MonitorMiddleware'
+    ],
+    DJEM_MON_MAX_ENDPOINTS=2
+)
+
 django_middleware_settings = override_settings(
     ROOT_URLCONF='djem.tests.test_middleware',
     MIDDLEWARE=[
@@ -206,3 +240,94 @@ class MessageMiddlewareTestCase(TestCase):
         )
         
         self.assertEqual(response.content, b'STANDARD: second standard message')
+
+
+@monitor_middleware_settings
+class MonitorMiddlewareTestCase(TestCase):
+    
+    def setUp(self):
+        
+        Mon.reset()
+        self.addCleanup(Mon.reset)
+        self.addCleanup(setattr, Mon, 'max_aggregates', None)
+    
+    def test_aggregate_by_endpoint(self):
+        
+        self.client.get('/monitored/1/')
+        self.client.get('/monitored/2/')
+        
+        # Both requests were aggregated under the same endpoint, along with
+        # the nested monitor
+        self.assertEqual(len(Mon.aggregate), 1)
+        
+        name, m = Mon.aggregate.popitem()
+        
+        self.assertIn('monitored', name)
+        self.assertEqual(m.stats['count'], 2)
+        self.assertEqual(m.children['inner'].stats['count'], 2)
+        self.assertEqual(m.children['inner'].stats['total_queries'], 2)
+        
+        # CPU time is measured per thread, including for nested monitors
+        self.assertEqual(m.cpu_clock, 'thread')
+        self.assertEqual(m.children['inner'].cpu_clock, 'thread')
+    
+    def test_leaked_monitor(self):
+        
+        # A view leaving a monitor running does not fail the request, or
+        # affect subsequent requests
+        with self.assertLogs('djem.mon', 'WARNING') as logs:
+            response = self.client.get('/leaky/')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Monitor "forgotten" was not stopped', logs.output[0])
+        self.assertEqual(Mon.get_monitors(), {})
+        
+        self.client.get('/monitored/1/')
+        self.assertEqual(Mon.get_monitors(), {})
+        
+        self.assertEqual(len(Mon.aggregate), 2)
+        
+        m = [m for name, m in Mon.aggregate.items() if 'leaky' in name][0]
+        self.assertEqual(m.stats['count'], 1)
+        self.assertEqual(m.children['forgotten'].errors, 1)
+    
+    def test_max_endpoints(self):
+        
+        self.client.get('/monitored/1/')
+        self.client.get('/unknown/')
+        self.client.get('/monitored/other/')
+        
+        self.assertEqual(len(Mon.aggregate), 3)
+        self.assertIn('(unresolved)', Mon.aggregate)
+        self.assertEqual(Mon.aggregate['(other)'].stats['count'], 1)
+    
+    def test_stats_view(self):
+        
+        user = User.objects.create_user('test')
+        factory = RequestFactory()
+        
+        def get(data=None):
+            
+            request = factory.get('/monitor/stats/', data)
+            request.user = user
+            
+            return monitor_stats(request)
+        
+        with self.assertRaises(PermissionDenied):
+            get()
+        
+        user.is_staff = True
+        
+        self.client.get('/monitored/1/')
+        
+        response = get()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Aggregated Results', response.content)
+        self.assertIn(b'inner', response.content)
+        
+        response = get({'format': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertTrue(response.content.startswith(b'Statistic,Name,'))
+        
+        response = get({'format': 'unknown'})
+        self.assertEqual(response.status_code, 400)
@@ -1,20 +1,27 @@
 import datetime
 import pytz
+from unittest import skipUnless
 
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.db import IntegrityError
+from django.db.models import Count
 from django.test import TestCase, override_settings
 from django.utils import timezone
 
-from djem.models import TimeZoneField
+from djem.models import LocalDate, TimeZoneField
 from djem.utils.dt import TimeZoneHelper
 
 from .models import (
-    ArchivableTest, CommonInfoTest, LogTest, StaticTest, TimeZoneTest,
-    VersioningTest
+    ArchivableTest, CommonInfoTest, LogTest, StaticTest, TimeZoneEventTest,
+    TimeZoneTest, VersioningTest
 )
 
+try:
+    import zoneinfo
+except ImportError:  # pragma: no cover
+    zoneinfo = None
+
 
 def make_user(username):
     
@@ -1205,6 +1212,18 @@ class TimeZoneFieldTestCase(TestCase):
         f = TimeZoneField('timezone')
         self.assertEqual(f.verbose_name, 'timezone')
     
+    def test_deconstruct(self):
+        
+        name, path, args, kwargs = TimeZoneField().deconstruct()
+        
+        self.assertEqual(path, 'djem.models.fields.TimeZoneField')
+        self.assertEqual(kwargs, {})
+        
+        choices = [('Australia/Sydney', 'Australia/Sydney')]
+        name, path, args, kwargs = TimeZoneField(choices=choices, max_length=32).deconstruct()
+        
+        self.assertEqual(kwargs, {'choices': choices, 'max_length': 32})
+    
     def test_default(self):
         
         o = TimeZoneTest()
@@ -1423,3 +1442,94 @@ class TimeZoneFieldTestCase(TestCase):
         
         queryset = queryset.filter(timezone='Australia/Sydney')
         self.assertEqual(queryset.count(), 1)
+    
+    def test_load__shared_helpers(self):
+        
+        TimeZoneTest(timezone='Australia/Sydney').save()
+        TimeZoneTest(timezone='Australia/Sydney').save()
+        
+        o1, o2 = TimeZoneTest.objects.all()
+        
+        self.assertIs(o1.timezone, o2.timezone)
+        self.assertIs(o1.timezone2, o1.timezone)
+    
+    @skipUnless(zoneinfo, 'zoneinfo is not available')
+    def test_zoneinfo_backend(self):
+        
+        # Values stored using the pytz backend are readable using the zoneinfo
+        # backend, and vice versa
+        TimeZoneTest(timezone=pytz.timezone('Australia/Sydney')).save()
+        
+        with self.settings(DJEM_TZ_BACKEND='zoneinfo'):
+            o = TimeZoneTest.objects.get()
+            self.assertIsInstance(o.timezone.tz, zoneinfo.ZoneInfo)
+            self.assertEqual(o.timezone.name, 'Australia/Sydney')
+            
+            o.timezone = zoneinfo.ZoneInfo('US/Eastern')
+            o.save()
+        
+        o.refresh_from_db()
+        self.assertIs(o.timezone.tz, pytz.timezone('US/Eastern'))
+
+
+class LocalDateTestCase(TestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        
+        sydney = TimeZoneTest.objects.create(timezone='Australia/Sydney')
+        perth = TimeZoneTest.objects.create(timezone='Australia/Perth')
+        
+        # 11pm in Perth, 2am the next day in Sydney
+        created = datetime.datetime(2020, 1, 1, 15, tzinfo=pytz.UTC)
+        
+        TimeZoneEventTest.objects.create(owner=sydney, date_created=created)
+        TimeZoneEventTest.objects.create(owner=sydney, date_created=created, timezone='Australia/Perth')
+        TimeZoneEventTest.objects.create(owner=perth, date_created=created)
+        TimeZoneEventTest.objects.create(owner=perth, date_created=created - datetime.timedelta(days=1))
+    
+    def test_related_tz_field(self):
+        
+        queryset = TimeZoneEventTest.objects.annotate(
+            day=LocalDate('date_created', tz_field='owner__timezone')
+        ).order_by('pk')
+        
+        self.assertEqual(list(queryset.values_list('day', flat=True)), [
+            datetime.date(2020, 1, 2),
+            datetime.date(2020, 1, 2),
+            datetime.date(2020, 1, 1),
+            datetime.date(2019, 12, 31),
+        ])
+    
+    def test_local_tz_field(self):
+        
+        queryset = TimeZoneEventTest.objects.annotate(
+            day=LocalDate('date_created', tz_field='timezone')
+        ).order_by('pk')
+        
+        # Null timezones give a null date
+        self.assertEqual(list(queryset.values_list('day', flat=True)), [
+            None,
+            datetime.date(2020, 1, 1),
+            None,
+            None,
+        ])
+    
+    def test_aggregate(self):
+        
+        queryset = TimeZoneEventTest.objects.annotate(
+            day=LocalDate('date_created', tz_field='owner__timezone')
+        ).values('day').annotate(count=Count('pk')).order_by('day')
+        
+        self.assertEqual([(row['day'], row['count']) for row in queryset], [
+            (datetime.date(2019, 12, 31), 1),
+            (datetime.date(2020, 1, 1), 1),
+            (datetime.date(2020, 1, 2), 2),
+        ])
+        
+        # Filtering
+        queryset = TimeZoneEventTest.objects.annotate(
+            day=LocalDate('date_created', tz_field='owner__timezone')
+        ).filter(day=datetime.date(2020, 1, 1))
+        
+        self.assertEqual(queryset.count(), 1)
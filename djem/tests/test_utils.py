@@ -1,12 +1,54 @@
+import calendar
+import datetime
+import json
+import math
+import os
+import pickle
+import pstats
 import pytz
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+from unittest import skipUnless
 
 from django.apps import apps
-from django.test import SimpleTestCase
+from django.contrib.auth.models import Group, User
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import captured_stdout
 from django.utils import timezone
+from django.utils.six import StringIO
 
 from djem import UNDEFINED
-from djem.utils.dt import TimeZoneHelper
-from djem.utils.tests import setup_test_app
+from djem.utils.dt import (
+    TIMEZONE_CHOICES, PytzBackend, TimeZoneChoices, TimeZoneHelper,
+    ZoneInfoBackend, get_dates, get_tz_backend, get_tz_helper, get_wall_times
+)
+from djem.utils.inspect import ModelTable, ObjectTable, get_class_index, get_defined_by, pp
+from djem.utils.mon import (
+    Histogram, M, MaxRSSProbe, Mon, calibrate, get_memory_probe,
+    get_sql_fingerprint, mon, tracemalloc
+)
+from djem.utils.mon_store import Exporter, SQLiteStore
+from djem.utils.table import Table, clear_terminal_width, get_terminal_width
+from djem.utils.tests import QueryAssertionsMixin, setup_test_app
+
+from .models import ArchivableTest, GenericRelationTest, OLPTest, StaticTest
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+try:
+    import zoneinfo
+except ImportError:  # pragma: no cover
+    zoneinfo = None
 
 
 class UndefinedTestCase(SimpleTestCase):
@@ -153,6 +195,378 @@ class TimeZoneHelperTestCase(SimpleTestCase):
         self.assertEqual(str(TimeZoneHelper(pytz.UTC)), 'UTC')
         self.assertEqual(str(TimeZoneHelper('Australia/Sydney')), 'Australia/Sydney')
         self.assertEqual(str(TimeZoneHelper('US/Eastern')), 'US/Eastern')
+    
+    def test_immutable(self):
+        """
+        Test TimeZoneHelper attributes cannot be set or deleted.
+        """
+        
+        helper = TimeZoneHelper('Australia/Sydney')
+        
+        with self.assertRaises(AttributeError):
+            helper.tz = pytz.UTC
+        
+        with self.assertRaises(AttributeError):
+            helper.other = 'value'
+        
+        with self.assertRaises(AttributeError):
+            del helper.tz
+        
+        self.assertEqual(helper.name, 'Australia/Sydney')
+    
+    def test_equality(self):
+        """
+        Test TimeZoneHelper instances for the same timezone compare equal and
+        hash the same.
+        """
+        
+        helper1 = TimeZoneHelper('Australia/Sydney')
+        helper2 = TimeZoneHelper(pytz.timezone('Australia/Sydney'))
+        
+        self.assertEqual(helper1, helper2)
+        self.assertFalse(helper1 != helper2)
+        self.assertEqual(hash(helper1), hash(helper2))
+        self.assertNotEqual(helper1, TimeZoneHelper('UTC'))
+        self.assertNotEqual(helper1, 'Australia/Sydney')
+    
+    def test_pickle(self):
+        """
+        Test unpickling a TimeZoneHelper returns the shared instance, or an
+        equal instance for timezones without a name.
+        """
+        
+        helper = TimeZoneHelper('Australia/Sydney')
+        unpickled = pickle.loads(pickle.dumps(helper))
+        
+        self.assertIs(unpickled, get_tz_helper('Australia/Sydney'))
+        
+        helper = TimeZoneHelper(pytz.FixedOffset(60))
+        unpickled = pickle.loads(pickle.dumps(helper))
+        
+        self.assertIsNone(helper.name)
+        self.assertIsInstance(unpickled, TimeZoneHelper)
+        self.assertEqual(unpickled.tz.utcoffset(None), datetime.timedelta(minutes=60))
+        self.assertEqual(unpickled, helper)
+        self.assertNotEqual(unpickled, TimeZoneHelper(pytz.FixedOffset(120)))
+    
+    def test_get_wall_times(self):
+        """
+        Test converting multiple UTC datetimes to local wall times, either
+        side of a daylight saving transition.
+        """
+        
+        helper = TimeZoneHelper('Australia/Sydney')
+        
+        # Daylight saving ended at 3am local time on 5 April 2020
+        values = [
+            datetime.datetime(2020, 4, 4, 15, 59, 59, 500, tzinfo=pytz.UTC),
+            None,
+            datetime.datetime(2020, 4, 4, 16),  # naive, taken to be UTC
+            pytz.timezone('US/Eastern').localize(datetime.datetime(2020, 1, 1)),
+            datetime.datetime(2020, 4, 4, 14, tzinfo=pytz.UTC),
+        ]
+        
+        self.assertEqual(helper.get_wall_times(iter(values)), [
+            datetime.datetime(2020, 4, 5, 2, 59, 59, 500),
+            None,
+            datetime.datetime(2020, 4, 5, 2),
+            datetime.datetime(2020, 1, 1, 16),
+            datetime.datetime(2020, 4, 5, 1),
+        ])
+        
+        self.assertEqual(helper.get_dates(values), [
+            datetime.date(2020, 4, 5),
+            None,
+            datetime.date(2020, 4, 5),
+            datetime.date(2020, 1, 1),
+            datetime.date(2020, 4, 5),
+        ])
+        
+        self.assertEqual(helper.get_wall_times([]), [])
+        self.assertEqual(helper.get_dates([None]), [None])
+    
+    @skipUnless(numpy, 'NumPy is not available')
+    def test_get_wall_times__numpy(self):
+        
+        helper = TimeZoneHelper('Australia/Sydney')
+        
+        values = numpy.array(
+            ['2020-04-04T15:59:59.5', 'NaT', '2020-04-04T16:00', '2020-04-04T14:00'],
+            dtype='datetime64[ms]'
+        )
+        
+        wall_times = helper.get_wall_times(values)
+        self.assertEqual(wall_times.dtype, numpy.dtype('datetime64[ms]'))
+        self.assertEqual(
+            [str(v) for v in wall_times],
+            ['2020-04-05T02:59:59.500', 'NaT', '2020-04-05T02:00:00.000', '2020-04-05T01:00:00.000']
+        )
+        
+        dates = helper.get_dates(values)
+        self.assertEqual(dates.dtype, numpy.dtype('datetime64[D]'))
+        self.assertEqual([str(v) for v in dates], ['2020-04-05', 'NaT', '2020-04-05', '2020-04-05'])
+        
+        with self.assertRaises(TypeError):
+            helper.get_dates(numpy.array([1, 2]))
+    
+    def test_get_transitions(self):
+        
+        helper = TimeZoneHelper('Australia/Sydney')
+        
+        start = calendar.timegm((2020, 1, 1, 0, 0, 0))
+        end = calendar.timegm((2020, 12, 31, 0, 0, 0))
+        transitions = helper.get_transitions(start, end)
+        
+        # The transitions are cached
+        self.assertIs(helper.get_transitions(start, end), transitions)
+        
+        i = transitions.instants.index(calendar.timegm((2020, 4, 4, 16, 0, 0)))
+        self.assertEqual(transitions.offsets[i - 1], 11 * 3600)
+        self.assertEqual(transitions.offsets[i], 10 * 3600)
+
+
+class GetTzHelperTestCase(SimpleTestCase):
+    
+    def test_null(self):
+        
+        self.assertIsNone(get_tz_helper(None))
+        self.assertIsNone(get_tz_helper(''))
+    
+    def test_shared(self):
+        """
+        Test the same instance is returned for all values representing the
+        same timezone.
+        """
+        
+        helper = get_tz_helper('Australia/Sydney')
+        
+        self.assertIsInstance(helper, TimeZoneHelper)
+        self.assertIs(get_tz_helper('Australia/Sydney'), helper)
+        self.assertIs(get_tz_helper(pytz.timezone('Australia/Sydney')), helper)
+        self.assertIs(get_tz_helper(helper), helper)
+        
+        self.assertIs(get_tz_helper(pytz.UTC), get_tz_helper('UTC'))
+    
+    def test_unnamed(self):
+        """
+        Test a timezone without a name is not shared.
+        """
+        
+        tz = pytz.FixedOffset(60)
+        helper = get_tz_helper(tz)
+        
+        self.assertIs(helper.tz, tz)
+        self.assertIsNot(get_tz_helper(tz), helper)
+    
+    def test_invalid(self):
+        
+        with self.assertRaises(ValidationError):
+            get_tz_helper('fail')
+
+
+@skipUnless(zoneinfo, 'zoneinfo is not available')
+@override_settings(DJEM_TZ_BACKEND='zoneinfo')
+class ZoneInfoBackendTestCase(SimpleTestCase):
+    
+    def test_backend(self):
+        
+        self.assertIsInstance(get_tz_backend(), ZoneInfoBackend)
+        
+        with self.settings(DJEM_TZ_BACKEND='pytz'):
+            self.assertIsInstance(get_tz_backend(), PytzBackend)
+        
+        with self.settings(DJEM_TZ_BACKEND='fail'):
+            with self.assertRaises(TypeError):
+                get_tz_backend()
+    
+    def test_init__string(self):
+        
+        helper = TimeZoneHelper('Australia/Sydney')
+        
+        self.assertIsInstance(helper.tz, zoneinfo.ZoneInfo)
+        self.assertEqual(helper.name, 'Australia/Sydney')
+    
+    def test_init__pytz(self):
+        """
+        Test named pytz timezones are converted to their zoneinfo equivalents.
+        """
+        
+        helper = TimeZoneHelper(pytz.timezone('Australia/Sydney'))
+        self.assertEqual(helper.tz, zoneinfo.ZoneInfo('Australia/Sydney'))
+        
+        helper = TimeZoneHelper(pytz.UTC)
+        self.assertEqual(helper.tz, zoneinfo.ZoneInfo('UTC'))
+    
+    def test_now(self):
+        
+        fmt = '%Y-%m-%d %H:%M'
+        
+        now = timezone.now()
+        helper_now = TimeZoneHelper('Australia/Sydney').now()
+        
+        local = pytz.timezone('Australia/Sydney')
+        local_now = local.normalize(now.astimezone(local))
+        
+        self.assertEqual(helper_now.strftime(fmt), local_now.strftime(fmt))
+        self.assertEqual(helper_now.utcoffset(), local_now.utcoffset())
+    
+    def test_get_tz_helper(self):
+        
+        helper = get_tz_helper('Australia/Sydney')
+        
+        self.assertIsInstance(helper.tz, zoneinfo.ZoneInfo)
+        self.assertIs(get_tz_helper(pytz.timezone('Australia/Sydney')), helper)
+        self.assertIs(get_tz_helper(zoneinfo.ZoneInfo('Australia/Sydney')), helper)
+        
+        with self.settings(DJEM_TZ_BACKEND='pytz'):
+            pytz_helper = get_tz_helper('Australia/Sydney')
+        
+        # Helpers from another backend are converted
+        self.assertIs(get_tz_helper(pytz_helper), helper)
+        
+        with self.assertRaises(ValidationError):
+            get_tz_helper('fail')
+        
+        with self.assertRaises(ValidationError):
+            get_tz_helper('/etc/passwd')
+    
+    def test_get_wall_times(self):
+        
+        helper = TimeZoneHelper('Australia/Sydney')
+        
+        values = [
+            datetime.datetime(2020, 4, 4, 15, 59, 59, tzinfo=pytz.UTC),
+            None,
+            datetime.datetime(2020, 4, 4, 16),
+        ]
+        
+        self.assertEqual(helper.get_wall_times(values), [
+            datetime.datetime(2020, 4, 5, 2, 59, 59),
+            None,
+            datetime.datetime(2020, 4, 5, 2),
+        ])
+        
+        self.assertEqual(helper.get_dates(values), [datetime.date(2020, 4, 5), None, datetime.date(2020, 4, 5)])
+    
+    def test_get_transitions(self):
+        """
+        Test transitions are found by searching, to the second.
+        """
+        
+        helper = TimeZoneHelper('Australia/Sydney')
+        get_tz_backend().transitions.clear()
+        
+        start = calendar.timegm((2020, 3, 1, 0, 0, 0))
+        end = calendar.timegm((2021, 3, 1, 0, 0, 0))
+        transitions = helper.get_transitions(start, end)
+        
+        # Whole years are covered
+        self.assertEqual(transitions.start, calendar.timegm((2020, 1, 1, 0, 0, 0)))
+        self.assertEqual(transitions.end, calendar.timegm((2022, 1, 1, 0, 0, 0)))
+        
+        self.assertEqual(transitions.instants, [
+            transitions.start,
+            calendar.timegm((2020, 4, 4, 16, 0, 0)),
+            calendar.timegm((2020, 10, 3, 16, 0, 0)),
+            calendar.timegm((2021, 4, 3, 16, 0, 0)),
+            calendar.timegm((2021, 10, 2, 16, 0, 0)),
+        ])
+        self.assertEqual(transitions.offsets, [39600, 36000, 39600, 36000, 39600])
+        
+        # Extending the period recalculates the transitions
+        extended = helper.get_transitions(start, calendar.timegm((2022, 6, 1, 0, 0, 0)))
+        self.assertEqual(extended.start, transitions.start)
+        self.assertEqual(extended.end, calendar.timegm((2023, 1, 1, 0, 0, 0)))
+        self.assertEqual(extended.instants[:5], transitions.instants)
+    
+    def test_common_timezones(self):
+        
+        names = get_tz_backend().get_common_timezones()
+        
+        self.assertIn('UTC', names)
+        self.assertIn('Australia/Sydney', names)
+        self.assertNotIn('localtime', names)
+        self.assertFalse([name for name in names if name.startswith('posix/')])
+        
+        # Names stored using the pytz backend remain valid
+        for name in ('US/Eastern', 'GMT', 'Australia/Sydney'):
+            self.assertIsInstance(get_tz_helper(name).tz, zoneinfo.ZoneInfo)
+
+
+class ConvertPairsTestCase(SimpleTestCase):
+    
+    def test_get_wall_times(self):
+        
+        utc = datetime.datetime(2020, 1, 1, tzinfo=pytz.UTC)
+        sydney = get_tz_helper('Australia/Sydney')
+        perth = get_tz_helper('Australia/Perth')
+        
+        pairs = [(sydney, utc), (perth, utc), (None, utc), (sydney, None), (perth, utc)]
+        
+        self.assertEqual(get_wall_times(pairs), [
+            datetime.datetime(2020, 1, 1, 11),
+            datetime.datetime(2020, 1, 1, 8),
+            None,
+            None,
+            datetime.datetime(2020, 1, 1, 8),
+        ])
+        
+        self.assertEqual(get_dates(iter(pairs)), [
+            datetime.date(2020, 1, 1),
+            datetime.date(2020, 1, 1),
+            None,
+            None,
+            datetime.date(2020, 1, 1),
+        ])
+
+
+class TimeZoneChoicesTestCase(SimpleTestCase):
+    
+    def test_lazy(self):
+        
+        choices = TimeZoneChoices()
+        self.assertIsNone(choices._choices)
+        
+        # Truthiness does not build the choices
+        self.assertTrue(choices)
+        self.assertIsNone(choices._choices)
+        
+        self.assertEqual(len(choices), len(pytz.common_timezones))
+        self.assertIsNotNone(choices._choices)
+        
+        self.assertIn(('Australia/Sydney', 'Australia/Sydney'), choices)
+        self.assertEqual(choices[0], (pytz.common_timezones[0], pytz.common_timezones[0]))
+    
+    def test_immutable(self):
+        
+        choices = TimeZoneChoices()
+        
+        with self.assertRaises(TypeError):
+            choices[0] = ('fail', 'fail')
+        
+        self.assertFalse(hasattr(choices, 'append'))
+    
+    def test_equality(self):
+        
+        choices = TimeZoneChoices()
+        expected = [(tz, tz) for tz in pytz.common_timezones]
+        
+        self.assertEqual(choices, choices)
+        self.assertEqual(choices, TimeZoneChoices())
+        self.assertEqual(choices, expected)
+        self.assertNotEqual(choices, expected[1:])
+        self.assertNotEqual(choices, None)
+    
+    @skipUnless(zoneinfo, 'zoneinfo is not available')
+    def test_backend_change(self):
+        
+        len(TIMEZONE_CHOICES)  # build
+        
+        with self.settings(DJEM_TZ_BACKEND='zoneinfo'):
+            self.assertIsNone(TIMEZONE_CHOICES._choices)
+            self.assertEqual(list(TIMEZONE_CHOICES), [(tz, tz) for tz in ZoneInfoBackend().get_common_timezones()])
+        
+        self.assertEqual(list(TIMEZONE_CHOICES), [(tz, tz) for tz in pytz.common_timezones])
 
 
 class SetupTestAppTestCase(SimpleTestCase):
@@ -220,3 +634,1562 @@ class SetupTestAppTestCase(SimpleTestCase):
         
         # Uninstall the app again to avoid polluting other tests
         apps.app_configs.pop('djem_tests')
+
+
+class PpIterableTestCase(TestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        
+        ArchivableTest.objects.bulk_create([ArchivableTest() for i in range(5)])
+    
+    def test_queryset__under_limit(self):
+        """
+        Test a QuerySet with fewer rows than the limit. All rows should be
+        printed, with no summary.
+        """
+        
+        with captured_stdout() as stdout:
+            with self.assertNumQueries(1):
+                pp(ArchivableTest.objects.all())
+        
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertNotIn('more row', stdout.getvalue())
+    
+    def test_queryset__over_limit(self):
+        """
+        Test a QuerySet with more rows than the limit. Only the limited number
+        of rows should be printed, followed by a summary of the remainder.
+        """
+        
+        with captured_stdout() as stdout:
+            # One query for the limited rows, one for the count
+            with self.assertNumQueries(2):
+                pp(ArchivableTest.objects.all(), limit=2)
+        
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[-1], '... 3 more rows (limit: 2)')
+    
+    def test_queryset__evaluated(self):
+        """
+        Test a QuerySet that has already been evaluated. No further queries
+        should be executed.
+        """
+        
+        qs = ArchivableTest.objects.all()
+        list(qs)
+        
+        with captured_stdout() as stdout:
+            with self.assertNumQueries(0):
+                pp(qs, limit=4)
+        
+        self.assertEqual(stdout.getvalue().splitlines()[-1], '... 1 more row (limit: 4)')
+    
+    def test_queryset__empty(self):
+        """
+        Test an empty QuerySet.
+        """
+        
+        with captured_stdout() as stdout:
+            pp(ArchivableTest.objects.none())
+        
+        self.assertEqual(stdout.getvalue(), 'No results.\n')
+    
+    def test_generator(self):
+        """
+        Test an infinite generator. It should be limited without being
+        exhausted.
+        """
+        
+        def infinite():
+            
+            i = 0
+            while True:
+                yield i
+                i += 1
+        
+        with captured_stdout() as stdout:
+            pp(infinite(), limit=3)
+        
+        self.assertEqual(stdout.getvalue().splitlines(), ['0', '1', '2', '... more items not shown (limit: 3)'])
+
+
+class ObjectTableTestCase(TestCase):
+    
+    def setUp(self):
+        
+        user = User.objects.create_user('test')
+        OLPTest.objects.create(user=user)
+        OLPTest.objects.create(user=user)
+        
+        self.user = User.objects.get(pk=user.pk)
+        self.olp = OLPTest.objects.get(pk=OLPTest.objects.first().pk)
+    
+    def get_values(self, table):
+        
+        values = {}
+        for group in table.data_groups:
+            for defined_by, attr, t, v in group:
+                values[attr] = (t, v)
+        
+        return values
+    
+    def test_eager(self):
+        """
+        Test the default, non-lazy mode. Related managers should be counted
+        individually.
+        """
+        
+        with self.assertNumQueries(2):
+            values = self.get_values(ObjectTable(self.user, ignore_methods=True))
+        
+        self.assertEqual(values['olptest_set'][1], 'Manager on User model')
+        self.assertEqual(values['groups'][1], 'Referencing 0 Group records')
+        self.assertEqual(values['is_authenticated'], ('bool', 'True'))
+    
+    def test_lazy(self):
+        """
+        Test lazy mode. Properties and relations should not be evaluated, and
+        no queries should be executed.
+        """
+        
+        with self.assertNumQueries(0):
+            values = self.get_values(ObjectTable(self.user, ignore_methods=True, lazy=True))
+        
+        self.assertEqual(values['olptest_set'], ('RelatedManager', 'Referencing OLPTest records (not counted)'))
+        self.assertEqual(values['groups'], ('ManyRelatedManager', 'Referencing Group records (not counted)'))
+        self.assertEqual(values['is_authenticated'], ('property', '<not evaluated>'))
+        self.assertEqual(values['username'], ('str', 'test'))
+    
+    def test_lazy__forward_relation(self):
+        """
+        Test lazy mode with a forward ForeignKey. It should only be evaluated
+        if the related object is already cached.
+        """
+        
+        with self.assertNumQueries(0):
+            values = self.get_values(ObjectTable(self.olp, ignore_methods=True, lazy=True))
+        
+        self.assertEqual(values['user'], ('User', 'User (pk={0}, not fetched)'.format(self.user.pk)))
+        
+        self.olp.user  # populate the cache
+        
+        with self.assertNumQueries(0):
+            values = self.get_values(ObjectTable(self.olp, ignore_methods=True, lazy=True))
+        
+        self.assertEqual(values['user'], ('User', 'test'))
+    
+    def test_lazy__count_relations(self):
+        """
+        Test lazy mode with relation counts requested. All counts should be
+        retrieved in a single query.
+        """
+        
+        with self.assertNumQueries(1):
+            table = ObjectTable(self.user, ignore_methods=True, lazy=True, count_relations=True)
+        
+        values = self.get_values(table)
+        
+        self.assertEqual(values['olptest_set'][1], 'Referencing 2 OLPTest records')
+        self.assertEqual(values['groups'][1], 'Referencing 0 Group records')
+        self.assertEqual(values['user_permissions'][1], 'Referencing 0 Permission records')
+    
+    def test_lazy__generic_relation(self):
+        """
+        Test lazy mode with a GenericForeignKey. It should be described
+        without being evaluated, and should not be counted.
+        """
+        
+        obj = GenericRelationTest.objects.create(content_object=self.user)
+        obj = GenericRelationTest.objects.get(pk=obj.pk)
+        
+        with self.assertNumQueries(0):
+            values = self.get_values(ObjectTable(obj, ignore_methods=True, lazy=True))
+        
+        self.assertEqual(values['content_object'], (
+            'GenericForeignKey',
+            'Generic relation (content_type_id={0}, object_id={1}, not fetched)'.format(
+                obj.content_type_id,
+                self.user.pk
+            )
+        ))
+        
+        with self.assertNumQueries(0):
+            self.get_values(ObjectTable(obj, ignore_methods=True, lazy=True, count_relations=True))
+
+
+class ClassIndexTestCase(SimpleTestCase):
+    
+    class Parent(object):
+        
+        a = 1
+        b = 1
+    
+    class Child(Parent):
+        
+        b = 2
+        c = 2
+    
+    def test_get_defined_by(self):
+        """
+        Test get_defined_by() returns the class that originally defined an
+        attribute, even when it is overridden.
+        """
+        
+        Parent, Child = self.Parent, self.Child
+        
+        self.assertIs(get_defined_by(Child, 'a'), Parent)
+        self.assertIs(get_defined_by(Child, 'b'), Parent)
+        self.assertIs(get_defined_by(Child(), 'c'), Child)
+        self.assertIs(get_defined_by(Child(), 'unknown'), Child)
+    
+    def test_get_definers(self):
+        
+        index = get_class_index(self.Child)
+        
+        self.assertEqual(index.get_definers('b'), (self.Parent, self.Child))
+        self.assertEqual(index.get_definers('unknown'), ())
+    
+    def test_get_static(self):
+        """
+        Test get_static() returns the overriding value, without invoking
+        descriptors.
+        """
+        
+        class WithProperty(self.Child):
+            
+            @property
+            def d(self):
+                
+                raise AssertionError('Property evaluated')
+        
+        index = get_class_index(WithProperty)
+        
+        self.assertEqual(index.get_static('b'), 2)
+        self.assertIsInstance(index.get_static('d'), property)
+        
+        with self.assertRaises(AttributeError):
+            index.get_static('unknown')
+    
+    def test_cached(self):
+        
+        self.assertIs(get_class_index(self.Child), get_class_index(self.Child))
+
+
+class ModelTableTestCase(SimpleTestCase):
+    
+    def setUp(self):
+        
+        ModelTable.clear_cache()
+    
+    def test_fields(self):
+        
+        table = ModelTable(StaticTest)
+        
+        self.assertEqual(
+            [c['display_name'] for c in table.hierarchy],
+            [
+                'VersioningMixin [Abstract]',
+                'ArchivableMixin [Abstract]',
+                'CommonInfoMixin [Abstract]',
+                'StaticAbstract [Abstract]',
+                'StaticTest'
+            ]
+        )
+        
+        self.assertEqual(
+            [row[0] for row in table.hierarchy[-1]['matching_fields']],
+            ['field1', 'field2']
+        )
+        
+        self.assertEqual(table.total_discovered_fields, 9)
+        self.assertEqual(table.total_matching_fields, 8)
+    
+    def test_filters(self):
+        
+        table = ModelTable(StaticTest, 'FIELD', 'user_c')
+        
+        matching_fields = []
+        for config in table.hierarchy:
+            matching_fields.extend(row[0] for row in config['matching_fields'])
+        
+        self.assertEqual(matching_fields, ['user_created', 'field1', 'field2'])
+        self.assertEqual(table.total_discovered_fields, 9)
+        self.assertEqual(table.total_matching_fields, 3)
+    
+    def test_cached(self):
+        """
+        Test metadata is cached per model and concrete_only value, and that
+        filtering a table does not affect the cached data.
+        """
+        
+        filtered_table = ModelTable(StaticTest, 'field1')
+        table = ModelTable(StaticTest)
+        
+        self.assertIs(filtered_table.hierarchy[0]['class'], table.hierarchy[0]['class'])
+        self.assertEqual(len(ModelTable._metadata_cache[StaticTest]), 1)
+        self.assertEqual(table.total_matching_fields, 8)
+        
+        ModelTable(StaticTest, concrete_only=False)
+        
+        self.assertEqual(len(ModelTable._metadata_cache[StaticTest]), 2)
+
+
+class TerminalWidthTestCase(SimpleTestCase):
+    
+    def setUp(self):
+        
+        self.original_columns = os.environ.get('COLUMNS')
+        os.environ['COLUMNS'] = '100'
+        clear_terminal_width()
+    
+    def tearDown(self):
+        
+        if self.original_columns is None:
+            del os.environ['COLUMNS']
+        else:
+            os.environ['COLUMNS'] = self.original_columns
+        
+        clear_terminal_width()
+    
+    def test_detect(self):
+        
+        self.assertEqual(get_terminal_width(), 100)
+    
+    def test_cached(self):
+        
+        self.assertEqual(get_terminal_width(), 100)
+        
+        os.environ['COLUMNS'] = '120'
+        self.assertEqual(get_terminal_width(), 100)
+        
+        clear_terminal_width()
+        self.assertEqual(get_terminal_width(), 120)
+    
+    @skipUnless(hasattr(signal, 'SIGWINCH'), 'SIGWINCH not supported')
+    def test_resize(self):
+        """
+        Test the cached width is cleared when the terminal is resized.
+        """
+        
+        self.assertEqual(get_terminal_width(), 100)
+        
+        os.environ['COLUMNS'] = '120'
+        os.kill(os.getpid(), signal.SIGWINCH)
+        
+        self.assertEqual(get_terminal_width(), 120)
+    
+    def test_full_width_table(self):
+        
+        t = Table(['A', 'B'])
+        t.add_row(['x' * 100, 'y' * 100])
+        
+        lines = t.build_table().splitlines()
+        
+        self.assertEqual(len(lines[0]), 100)
+
+
+class TableTestCase(SimpleTestCase):
+    
+    def test_build_table(self):
+        
+        t = Table(['A', 'B'], title='Title', max_width=40)
+        t.add_row(['a', 'line\nbreak'])
+        t.add_row(Table.HR)
+        t.add_full_width_row('Full width', 'right')
+        t.add_row([None, 1])
+        
+        self.assertEqual(t.build_table().splitlines(), [
+            '+--------------------+',
+            '|       Title        |',
+            '+--------------------+',
+            '| A    | B           |',
+            '+--------------------+',
+            '| a    | line\\nbreak |',
+            '+--------------------+',
+            '|         Full width |',
+            '| None | 1           |',
+            '+--------------------+',
+        ])
+    
+    def test_build_table__truncated(self):
+        """
+        Test values are truncated when the table exceeds its maximum width,
+        including rows added after the row buffer has been flushed.
+        """
+        
+        t = Table(max_width=20)
+        t.add_rows([i, i] for i in range(Table.ROW_BUFFER_SIZE))
+        t.add_row(['x' * 20, 'y'])
+        
+        lines = t.build_table().splitlines()
+        
+        self.assertEqual(len(lines), Table.ROW_BUFFER_SIZE + 3)
+        self.assertEqual(lines[1], '| 0          | 0   |')
+        self.assertEqual(lines[-2], '| xxxxxxx... | y   |')
+    
+    def test_add_row__copied(self):
+        """
+        Test rows are copied when added, as they are formatted later.
+        """
+        
+        t = Table()
+        row = ['a', 'b\nc']
+        t.add_row(row)
+        row[0] = 'changed'
+        
+        self.assertEqual(t.build_table().splitlines()[1], '| a | b\\nc |')
+    
+    def test_add_row__mismatch(self):
+        
+        t = Table()
+        t.add_row(['a', 'b'])
+        
+        with self.assertRaises(Exception):
+            t.add_row(['a'])
+    
+    def test_get_rows(self):
+        
+        t = Table(['A'])
+        t.add_row([1])
+        t.add_row(Table.BR)
+        t.add_row([2])
+        
+        self.assertEqual(t.get_rows(), [Table.HR, ['A'], Table.HR, ['1'], Table.BR, ['2'], Table.HR])
+
+
+class TableStreamTestCase(SimpleTestCase):
+    
+    def test_iter_table(self):
+        """
+        Test rows from the iterable are rendered after rows already added to
+        the table, and before the footer.
+        """
+        
+        t = Table(['A', 'B'], footer='End', max_width=40)
+        t.add_row(['a', 'b'])
+        
+        lines = list(t.iter_table(([i, i * 2] for i in range(3))))
+        
+        self.assertEqual(lines, [
+            '+-------+',
+            '| A | B |',
+            '+-------+',
+            '| a | b |',
+            '| 0 | 0 |',
+            '| 1 | 2 |',
+            '| 2 | 4 |',
+            '+-------+',
+            '|   End |',
+            '+-------+',
+        ])
+    
+    def test_iter_table__sample(self):
+        """
+        Test column widths are determined from the sampled rows only, with
+        values in later rows truncated.
+        """
+        
+        t = Table(max_width=40)
+        rows = [['a'], ['bbbb'], ['cccccc']]
+        
+        lines = list(t.iter_table(rows, sample_size=2))
+        
+        self.assertEqual(lines[1:4], ['| a    |', '| bbbb |', '| c... |'])
+    
+    def test_iter_table__widths(self):
+        """
+        Test fixed column widths are used instead of sampling rows.
+        """
+        
+        t = Table(max_width=40)
+        rows = [['a', 'bbbbbbbb']]
+        
+        lines = list(t.iter_table(rows, widths=[2, 5]))
+        
+        self.assertEqual(lines[1], '| a  | bb... |')
+    
+    def test_write_table(self):
+        
+        t = Table(max_width=40)
+        out = StringIO()
+        
+        t.write_table(out, ([i] for i in range(1000)), widths=[3])
+        
+        lines = out.getvalue().splitlines()
+        
+        self.assertEqual(len(lines), 1002)
+        self.assertEqual(lines[-2], '| 999 |')
+        
+        # Rows should not be retained
+        self.assertEqual(t.get_rows(), [Table.HR, Table.HR])
+    
+    def test_write_table__narrow(self):
+        """
+        Test values are truncated without an ellipsis when the column is too
+        narrow to include one.
+        """
+        
+        t = Table(max_width=40)
+        out = StringIO()
+        
+        t.write_table(out, [[1], [1000]], sample_size=1)
+        
+        self.assertEqual(out.getvalue().splitlines()[1:3], ['| 1 |', '| 1 |'])
+
+
+class TableFormatTestCase(SimpleTestCase):
+    
+    def get_table(self):
+        
+        t = Table(['A', 'B'], title='Title', footer='Footer')
+        t.add_row(['a', 'b, "c"'])
+        t.add_row(Table.HR)
+        t.add_full_width_row('Section')
+        t.add_row([1, 'x|y'])
+        
+        return t
+    
+    def test_csv(self):
+        
+        lines = list(self.get_table().iter_format('csv'))
+        
+        self.assertEqual(lines, ['A,B', 'a,"b, ""c"""', 'Section', '1,x|y'])
+    
+    def test_json(self):
+        
+        lines = list(self.get_table().iter_format('json'))
+        
+        self.assertEqual(lines, [
+            '{"A": "a", "B": "b, \\"c\\""}',
+            '{"section": "Section"}',
+            '{"A": 1, "B": "x|y"}',
+        ])
+    
+    def test_json__no_headings(self):
+        
+        t = Table()
+        t.add_row(['a', 1])
+        
+        self.assertEqual(list(t.iter_format('json')), ['["a", 1]'])
+    
+    def test_raw_values(self):
+        """
+        Test the machine-readable formats output the original values, not
+        those escaped for display.
+        """
+        
+        t = Table(['A', 'B', 'C'])
+        t.add_row(['x\ny', None, 1.5])
+        
+        self.assertEqual(list(t.iter_format('csv')), ['A,B,C', '"x\ny",,1.5'])
+        self.assertEqual(list(t.iter_format('json')), ['{"A": "x\\ny", "B": null, "C": 1.5}'])
+        self.assertEqual(list(t.iter_format('text'))[3], '| x\\ny | None | 1.5 |')
+        
+        # Streamed rows are not escaped either
+        lines = list(t.iter_format('json', rows=[[True, 2, 'z']]))
+        self.assertEqual(lines[-1], '{"A": true, "B": 2, "C": "z"}')
+    
+    def test_markdown(self):
+        
+        lines = list(self.get_table().iter_format('markdown'))
+        
+        self.assertEqual(lines, [
+            '**Title**',
+            '',
+            '| A | B |',
+            '| --- | --- |',
+            '| a | b, "c" |',
+            '| **Section** |  |',
+            '| 1 | x\\|y |',
+            '',
+            'Footer',
+        ])
+    
+    def test_streamed_rows(self):
+        
+        out = StringIO()
+        
+        self.get_table().write_table(out, rows=([i, i] for i in range(2)), format='csv')
+        
+        self.assertEqual(out.getvalue().splitlines()[-2:], ['0,0', '1,1'])
+    
+    def test_unknown(self):
+        
+        with self.assertRaises(TypeError):
+            self.get_table().iter_format('xml')
+
+
+class MTestCase(SimpleTestCase):
+    
+    def test_timing(self):
+        
+        m = M('test')
+        m.start()
+        sum(range(10000))
+        m.stop()
+        
+        self.assertGreater(m.get_nanoseconds(), 0)
+        self.assertGreater(m.get_cpu_nanoseconds(), 0)
+        self.assertEqual(m.get_seconds(), m.get_nanoseconds() / 1e9)
+        self.assertEqual(m.stats['total_time'], m.get_seconds())
+        self.assertEqual(m.stats['total_cpu'], m.get_cpu_seconds())
+    
+    def test_timing__no_cpu(self):
+        
+        m = M('test', cpu_clock=None)
+        m.start()
+        m.stop()
+        
+        self.assertEqual(m.get_cpu_nanoseconds(), 0)
+        self.assertEqual(m.stats['total_cpu'], 0)
+    
+    def test_timing__unknown_cpu_clock(self):
+        
+        with self.assertRaises(TypeError):
+            M('test', cpu_clock='unknown')
+    
+    def test_stats(self):
+        
+        m = M('test')
+        
+        for i in range(3):
+            m.reset()
+            m.start()
+            m.stop()
+        
+        stats = m.stats
+        
+        self.assertEqual(stats['count'], 3)
+        self.assertLessEqual(stats['min_time'], stats['avg_time'])
+        self.assertLessEqual(stats['avg_time'], stats['max_time'])
+        self.assertAlmostEqual(stats['avg_time'] * 3, stats['total_time'])
+    
+    def test_mem_probe(self):
+        
+        m = M('test')
+        self.assertIs(m.mem_probe, get_memory_probe('rss'))
+        self.assertFalse(m.mem_probe.has_peak)
+        
+        m.start()
+        m.stop()
+        
+        self.assertEqual(m.stats['total_peak_mem'], m.stats['total_mem'])
+        
+        probe = MaxRSSProbe()
+        self.assertIs(M('test', mem_probe=probe).mem_probe, probe)
+    
+    def test_mem_probe__unknown(self):
+        
+        with self.assertRaises(TypeError):
+            M('test', mem_probe='unknown')
+    
+    @skipUnless(sys.version_info >= (3, 4), 'tracemalloc is not available')
+    def test_mem_probe__tracemalloc(self):
+        
+        self.addCleanup(tracemalloc.stop)
+        
+        outer = M('outer', mem_probe='tracemalloc')
+        inner = M('inner', outer, mem_probe='tracemalloc', trace_allocations=5)
+        
+        outer.start()
+        inner.start()
+        data = [bytearray(1000) for i in range(1000)]
+        del data
+        inner.stop()
+        outer.stop()
+        
+        # The memory was freed again, but the peak within each block records it
+        self.assertLess(inner.get_mem_usage(), 0.5)
+        if outer.mem_probe.has_peak:
+            self.assertGreater(inner.get_peak_mem_usage(), 1)
+            self.assertGreater(outer.get_peak_mem_usage(), 1)
+        
+        self.assertEqual(outer.get_top_allocations(), [])
+    
+    @skipUnless(sys.version_info >= (3, 4), 'tracemalloc is not available')
+    def test_trace_allocations(self):
+        
+        self.addCleanup(tracemalloc.stop)
+        
+        m = M('test', mem_probe='tracemalloc', trace_allocations=3)
+        
+        for i in range(2):
+            m.start()
+            data = [bytearray(1000) for i in range(1000)]
+            m.stop()
+            del data
+        
+        top = m.get_top_allocations()
+        
+        self.assertLessEqual(len(top), 3)
+        site, size, count = top[0]
+        self.assertIn('bytearray(1000)', site)
+        self.assertGreater(size, 2000000)
+    
+    def test_percentiles(self):
+        
+        m = M('test')
+        
+        for i in range(10):
+            m.reset()
+            m.start()
+            m.stop()
+        
+        p50 = m.get_percentile('time', 50)
+        p999 = m.get_percentile('time', 99.9)
+        
+        self.assertGreater(p50, 0)
+        self.assertLessEqual(p50, p999)
+        self.assertLessEqual(p999, m.stats['max_time'] * 1.02)
+        self.assertEqual(m.get_percentile('queries', 99), 0)
+    
+    def test_percentiles__table(self):
+        
+        m = M('test')
+        m.start()
+        m.stop()
+        
+        with captured_stdout() as output:
+            m.print_stats(format='csv')
+        
+        lines = output.getvalue().splitlines()
+        
+        self.assertEqual(
+            lines[0],
+            'Statistic,Name,Minimum,Maximum,Average,p50,p90,p99,p99.9,Total,Count,%'
+        )
+        self.assertTrue(lines[1].startswith('time,test,'))
+        self.assertNotIn(',-,', lines[1])
+        self.assertTrue(lines[2].startswith('cpu,test,'))
+        self.assertIn(',-,-,-,-,', lines[2])
+    
+    def test_overhead(self):
+        
+        self.addCleanup(setattr, M, 'overhead_ns', 0)
+        self.addCleanup(setattr, M, 'overhead_cpu_ns', 0)
+        
+        parent = M('parent')
+        child = M('child', parent)
+        grandchild = M('grandchild', child)
+        
+        parent.start()
+        child.start()
+        grandchild.start()
+        sum(range(10000))
+        grandchild.stop()
+        child.stop()
+        parent.stop()
+        
+        self.assertEqual(parent.nested_runs, 2)
+        self.assertEqual(child.nested_runs, 1)
+        self.assertEqual(grandchild.nested_runs, 0)
+        
+        # An overhead larger than the measured times excludes them entirely
+        # from monitors with nested monitors only
+        M.overhead_ns = M.overhead_cpu_ns = 10 ** 12
+        
+        self.assertEqual(parent.get_nanoseconds(), 0)
+        self.assertEqual(child.get_cpu_nanoseconds(), 0)
+        self.assertGreater(grandchild.get_nanoseconds(), 0)
+        self.assertGreater(grandchild.get_cpu_nanoseconds(), 0)
+    
+    def test_calibrate(self):
+        
+        self.addCleanup(setattr, M, 'overhead_ns', 0)
+        self.addCleanup(setattr, M, 'overhead_cpu_ns', 0)
+        
+        overhead_ns, overhead_cpu_ns = calibrate(iterations=10, repeat=2)
+        
+        self.assertGreater(overhead_ns, 0)
+        self.assertEqual(M.overhead_ns, overhead_ns)
+        self.assertEqual(M.overhead_cpu_ns, overhead_cpu_ns)
+    
+    def test_sql_fingerprint(self):
+        
+        self.assertEqual(
+            get_sql_fingerprint('SELECT "a" FROM "t1" WHERE "id" IN (%s, %s, %s)  AND "b" = %s'),
+            'SELECT "a" FROM "t1" WHERE "id" IN (?, ...) AND "b" = ?'
+        )
+        self.assertEqual(
+            get_sql_fingerprint("SELECT * FROM t WHERE name = 'it''s' AND x > 1.5 LIMIT 21"),
+            'SELECT * FROM t WHERE name = ? AND x > ? LIMIT ?'
+        )
+    
+    def test_serialisation(self):
+        
+        parent = M('parent', mem_probe='maxrss')
+        child = M('child', parent)
+        
+        for i in range(3):
+            parent.reset()
+            child.reset()
+            parent.start()
+            child.start()
+            child.stop(error=True)
+            parent.stop()
+        
+        data = json.loads(json.dumps(parent.to_dict()))
+        m = M.from_dict(data)
+        
+        self.assertEqual(m.name, 'parent')
+        self.assertEqual(m.stats, parent.stats)
+        self.assertEqual(m.mem_probe.name, 'maxrss')
+        self.assertEqual(m.get_percentile('time', 90), parent.get_percentile('time', 90))
+        self.assertEqual(m.children['child'].errors, 3)
+        self.assertIs(m.children['child'].parent, m)
+
+
+class MonStoreTestCase(SimpleTestCase):
+    
+    def setUp(self):
+        
+        Mon.reset()
+        self.addCleanup(Mon.reset)
+        
+        fd, self.path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+    
+    def run_monitors(self, count):
+        
+        for i in range(count):
+            with Mon('root'):
+                with Mon('child'):
+                    pass
+    
+    def test_store(self):
+        
+        store = SQLiteStore(self.path)
+        
+        # Simulate two processes exporting their trees
+        self.run_monitors(2)
+        store.write('process1', Mon.export_aggregates())
+        
+        Mon.reset()
+        self.run_monitors(3)
+        store.write('process2', Mon.export_aggregates())
+        
+        # Rewriting a process' trees replaces them
+        store.write('process2', Mon.export_aggregates())
+        
+        monitors = store.read()
+        
+        self.assertEqual(list(monitors), ['root'])
+        self.assertEqual(monitors['root'].stats['count'], 5)
+        self.assertEqual(monitors['root'].children['child'].stats['count'], 5)
+        self.assertEqual(monitors['root'].histograms['time'].count, 5)
+        
+        store.clear()
+        self.assertEqual(store.read(), {})
+    
+    def test_exporter(self):
+        
+        store = SQLiteStore(self.path)
+        exporter = Exporter(store, interval=3600)
+        
+        exporter.export()
+        self.assertEqual(store.read(), {})
+        
+        self.run_monitors(2)
+        exporter.export()
+        self.run_monitors(1)
+        exporter.export()
+        
+        self.assertEqual(store.read()['root'].stats['count'], 3)
+        
+        exporter.start()
+        exporter.stop()
+        
+        self.assertEqual(store.read()['root'].stats['count'], 3)
+    
+    @skipUnless(hasattr(os, 'fork'), 'os.fork() is not available.')
+    def test_exporter_fork(self):
+        
+        exporter = Exporter(SQLiteStore(self.path), interval=3600)
+        exporter.start()
+        self.addCleanup(exporter.stop)
+        
+        # The parent's statistics are not inherited by the child
+        self.run_monitors(2)
+        
+        parent_id = exporter.process_id
+        read_fd, write_fd = os.pipe()
+        
+        pid = os.fork()
+        if not pid:  # pragma: no cover
+            # Child process: report the state of the exporter and exit
+            # without running any further test code
+            try:
+                os.close(read_fd)
+                
+                if not hasattr(os, 'register_at_fork'):
+                    exporter.start()
+                
+                result = [
+                    exporter._thread.is_alive(),
+                    exporter._thread is not threading.main_thread() and exporter._thread in threading.enumerate(),
+                    exporter.process_id != parent_id,
+                    Mon.export_aggregates()
+                ]
+                
+                os.write(write_fd, json.dumps(result).encode())
+            finally:
+                os._exit(0)
+        
+        os.close(write_fd)
+        
+        with os.fdopen(read_fd) as f:
+            result = json.loads(f.read())
+        
+        os.waitpid(pid, 0)
+        
+        self.assertEqual(result, [True, True, True, []])
+        
+        # The parent's thread and statistics are unaffected
+        self.assertTrue(exporter._thread.is_alive())
+        self.assertEqual(exporter.process_id, parent_id)
+        self.assertEqual(Mon.aggregate['root'].stats['count'], 2)
+    
+    def test_command(self):
+        
+        self.run_monitors(2)
+        SQLiteStore(self.path).write('process', Mon.export_aggregates())
+        
+        out = StringIO()
+        call_command('mon_stats', path=self.path, format='csv', clear=True, stdout=out)
+        
+        self.assertTrue(out.getvalue().startswith('Statistic,Name,'))
+        self.assertIn('root/child', out.getvalue())
+        
+        out = StringIO()
+        call_command('mon_stats', path=self.path, stdout=out)
+        
+        self.assertEqual(out.getvalue(), 'No statistics have been exported.\n')
+
+
+class HistogramTestCase(SimpleTestCase):
+    
+    def test_small_values(self):
+        
+        h = Histogram()
+        
+        for i in range(1, 11):
+            h.add(i)
+        
+        self.assertEqual(h.count, 10)
+        self.assertEqual(h.get_percentile(50), 5)
+        self.assertEqual(h.get_percentile(90), 9)
+        self.assertEqual(h.get_percentile(100), 10)
+        self.assertEqual(h.get_percentile(0), 1)
+    
+    def test_large_values(self):
+        
+        h = Histogram(precision=6)
+        values = [int(1.5 ** i) for i in range(20, 80)]
+        
+        for value in values:
+            h.add(value)
+        
+        # Bounded number of buckets and relative error
+        self.assertLessEqual(len(h.buckets), len(values))
+        
+        for percentile in (10, 50, 90, 99):
+            expected = values[int(math.ceil(percentile / 100.0 * len(values))) - 1]
+            self.assertAlmostEqual(h.get_percentile(percentile) / expected, 1, delta=2 ** -6)
+    
+    def test_empty(self):
+        
+        self.assertIsNone(Histogram().get_percentile(50))
+    
+    def test_merge(self):
+        
+        h1 = Histogram()
+        h2 = Histogram()
+        
+        for i in range(100):
+            h1.add(i)
+            h2.add(i + 100)
+        
+        h1.merge(h2)
+        
+        self.assertEqual(h1.count, 200)
+        self.assertAlmostEqual(h1.get_percentile(75), 150, delta=150 * 2 ** -6)
+        
+        with self.assertRaises(ValueError):
+            h1.merge(Histogram(precision=3))
+
+
+@skipUnless(hasattr(connection, 'execute_wrappers'), 'execute wrappers are not available')
+class MQueryTestCase(TestCase):
+    
+    def test_query_capture(self):
+        
+        outer = M('outer')
+        inner = M('inner', outer)
+        
+        with self.settings(DEBUG=False):
+            outer.start()
+            User.objects.count()
+            
+            inner.start()
+            for i in range(3):
+                list(User.objects.filter(pk=1))
+            inner.stop()
+            
+            outer.stop()
+        
+        self.assertEqual(outer.get_query_count(), 4)
+        self.assertEqual(inner.get_query_count(), 3)
+        self.assertGreater(outer.get_query_seconds(), inner.get_query_seconds())
+        self.assertEqual(outer.stats['total_query_time'], outer.get_query_seconds())
+        
+        repeated = outer.get_repeated_queries()
+        self.assertEqual(len(repeated), 2)
+        self.assertEqual(repeated[0][1], 3)
+        self.assertEqual(repeated[1][1], 1)
+        self.assertIn('COUNT', repeated[1][0])
+        
+        self.assertEqual(len(inner.get_slowest_queries(limit=1)), 1)
+    
+    def test_query_capture__uninstalled(self):
+        
+        m = M('test')
+        m.start()
+        m.stop()
+        
+        User.objects.count()
+        
+        self.assertEqual(m.get_query_count(), 0)
+        
+        for conn in connections.all():
+            self.assertEqual(conn.execute_wrappers, [])
+    
+    @skipUnless(sys.version_info >= (3, 7), 'contextvars is not available')
+    def test_query_capture__async(self):
+        
+        import asyncio
+        
+        # Defined via exec() to keep this module importable on Python 2
+        namespace = {'asyncio': asyncio, 'Mon': Mon, 'User': User}
+        exec('\n'.join((
+            'async def task(name, num):',
+            '    async with Mon(name) as m:',
+            '        for i in range(num):',
+            '            list(User.objects.filter(pk=i))',
+            '            await asyncio.sleep(0)',
+            '    return m',
+            '',
+            'async def main():',
+            '    async with Mon("outer") as outer:',
+            '        User.objects.count()',
+            '        a, b = await asyncio.gather(task("a", 2), task("b", 3))',
+            '    return outer, a, b',
+        )), namespace)
+        
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        outer, a, b = loop.run_until_complete(namespace['main']())
+        
+        # The interleaved tasks only record their own queries, and the outer
+        # monitor records those of both
+        self.assertEqual(a.get_query_count(), 2)
+        self.assertEqual(b.get_query_count(), 3)
+        self.assertEqual(outer.get_query_count(), 6)
+        self.assertEqual(a.get_repeated_queries()[0][1], 2)
+        self.assertEqual(b.get_repeated_queries()[0][1], 3)
+    
+    def test_query_capture__bounded(self):
+        
+        m = M('test')
+        m.MAX_SQL_STATEMENTS = 2
+        
+        m.start()
+        
+        # Individual queries are not retained, only a limited number of
+        # distinct statements and fingerprints
+        for i in range(5):
+            list(User.objects.filter(pk=i))
+            list(User.objects.filter(username=str(i)))
+            list(Group.objects.filter(pk=i))
+        
+        self.assertFalse(hasattr(m._query_log, 'entries'))
+        self.assertEqual(len(m._run_fingerprints), 2)
+        
+        m.stop()
+        
+        self.assertEqual(m.get_query_count(), 15)
+        self.assertEqual(len(m.sql_stats), 2)
+        self.assertEqual(sorted(count for f, count, l in m.get_repeated_fingerprints(threshold=1)), [5, 5])
+    
+    def create_static_objects(self, num):
+        
+        user = User.objects.create_user('test')
+        
+        for i in range(num):
+            StaticTest().save(user)
+    
+    def test_fingerprints(self):
+        
+        self.create_static_objects(3)
+        
+        m = M('test')
+        m.start()
+        for obj in StaticTest.objects.all():
+            obj.user_created
+        m.stop()
+        
+        m.start()
+        for obj in StaticTest.objects.all()[:2]:
+            obj.user_created
+        m.stop()
+        
+        # The user of each object is queried separately, with a different
+        # parameter, but they share a fingerprint. The maximum per run is
+        # recorded.
+        repeated = m.get_repeated_fingerprints(threshold=1)
+        self.assertEqual(len(repeated), 1)
+        
+        fingerprint, count, location = repeated[0]
+        self.assertEqual(count, 3)
+        self.assertIn('FROM "auth_user" WHERE "auth_user"."id" = ?', fingerprint)
+        self.assertIn('test_utils.py', location)
+        self.assertIn('(test_fingerprints)', location)
+        
+        self.assertEqual(m.get_repeated_fingerprints(), [])
+        
+        merged = M.from_dict(json.loads(json.dumps(m.to_dict())))
+        merged.merge(m)
+        self.assertEqual(merged.get_repeated_fingerprints(threshold=1), repeated)
+    
+    def test_fingerprints__warning(self):
+        
+        self.create_static_objects(3)
+        
+        outer = M('outer')
+        inner = M('inner', outer)
+        outer.REPEATED_QUERY_THRESHOLD = inner.REPEATED_QUERY_THRESHOLD = 2
+        
+        with self.assertLogs('djem.mon', 'WARNING') as logs:
+            outer.start()
+            inner.start()
+            for obj in StaticTest.objects.all():
+                obj.user_created
+            inner.stop()
+            outer.stop()
+        
+        # Only the top-level monitor warns
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('Query executed 3 times in a single run of "outer"', logs.output[0])
+
+
+@skipUnless(hasattr(connection, 'execute_wrappers'), 'execute wrappers are not available')
+class QueryAssertionsTestCase(QueryAssertionsMixin, TestCase):
+    
+    def setUp(self):
+        
+        user = User.objects.create_user('test')
+        
+        for i in range(3):
+            StaticTest().save(user)
+    
+    def get_users(self, queryset):
+        
+        return [obj.user_created for obj in queryset]
+    
+    def test_pass(self):
+        
+        queryset = StaticTest.objects.select_related('user_created')
+        self.assertMaxQueriesPerFingerprint(1, self.get_users, queryset)
+        
+        with self.assertMaxQueriesPerFingerprint(3):
+            self.get_users(StaticTest.objects.all())
+    
+    def test_fail(self):
+        
+        with self.assertRaises(AssertionError) as cm:
+            with self.assertMaxQueriesPerFingerprint(2):
+                self.get_users(StaticTest.objects.all())
+        
+        message = str(cm.exception)
+        self.assertIn('SQL fingerprints executed more than 2 times', message)
+        self.assertIn('3 times, issued by {0}:'.format(__file__.rstrip('co')), message)
+
+
+class MonTestCase(SimpleTestCase):
+    
+    def setUp(self):
+        
+        Mon.reset()
+        self.addCleanup(Mon.reset)
+    
+    def test_nesting(self):
+        
+        Mon.start('outer')
+        Mon.start('inner')
+        
+        self.assertEqual(sorted(Mon.get_monitors()), ['inner', 'outer'])
+        
+        inner = Mon.stop('inner')
+        outer = Mon.stop('outer')
+        
+        self.assertIs(inner.parent, outer)
+        self.assertIsNone(Mon.get_last())
+        self.assertEqual(Mon.get_monitors(), {})
+    
+    def test_threads(self):
+        
+        started = threading.Event()
+        release = threading.Event()
+        monitors = []
+        
+        def run(wait=False):
+            
+            Mon.start('root')
+            
+            if wait:
+                started.set()
+                release.wait()
+            
+            Mon.start('child')
+            Mon.stop('child')
+            monitors.append(Mon.stop('root'))
+        
+        # Run the second thread to completion while the first has its root
+        # monitor running
+        first = threading.Thread(target=run, kwargs={'wait': True})
+        first.start()
+        started.wait()
+        
+        second = threading.Thread(target=run)
+        second.start()
+        second.join()
+        
+        release.set()
+        first.join()
+        
+        # Each thread built its own tree
+        self.assertEqual(len(monitors), 2)
+        for m in monitors:
+            self.assertIsNone(m.parent)
+            self.assertEqual(list(m.children), ['child'])
+        
+        aggregate = Mon.aggregate['root']
+        self.assertEqual(aggregate.stats['count'], 2)
+        self.assertEqual(aggregate.children['child'].stats['count'], 2)
+        self.assertEqual(
+            aggregate.stats['total_time'],
+            monitors[0].stats['total_time'] + monitors[1].stats['total_time']
+        )
+        
+        with captured_stdout() as output:
+            Mon.print_aggregate_stats('root')
+        
+        self.assertIn('Aggregated Results', output.getvalue())
+    
+    def test_context_manager(self):
+        
+        with Mon('outer') as outer:
+            with Mon('inner') as inner:
+                pass
+        
+        self.assertIs(inner.parent, outer)
+        self.assertEqual(outer.stats['count'], 1)
+        self.assertEqual(outer.errors, 0)
+        self.assertEqual(Mon.get_monitors(), {})
+    
+    def test_context_manager__error(self):
+        
+        with self.assertRaises(ValueError):
+            with Mon('test') as m:
+                raise ValueError()
+        
+        self.assertEqual(m.stats['count'], 1)
+        self.assertEqual(m.errors, 1)
+        self.assertEqual(Mon.get_monitors(), {})
+    
+    def test_decorator(self):
+        
+        @mon('test')
+        def fn(fail=False):
+            """Docstring"""
+            
+            if fail:
+                raise ValueError()
+            
+            return 'result'
+        
+        self.assertEqual(fn.__name__, 'fn')
+        self.assertEqual(fn.__doc__, 'Docstring')
+        
+        with Mon('outer') as outer:
+            self.assertEqual(fn(), 'result')
+            
+            with self.assertRaises(ValueError):
+                fn(fail=True)
+        
+        m = outer.children['test']
+        self.assertEqual(m.stats['count'], 2)
+        self.assertEqual(m.errors, 1)
+        self.assertEqual(Mon.get_monitors(), {})
+    
+    def test_decorator__generator(self):
+        
+        @mon('test')
+        def gen():
+            
+            for i in range(3):
+                self.assertIn('test', Mon.get_monitors())
+                yield i
+        
+        with Mon('outer') as outer:
+            self.assertEqual(list(gen()), [0, 1, 2])
+            
+            g = gen()
+            next(g)
+            g.close()
+        
+        m = outer.children['test']
+        self.assertEqual(m.stats['count'], 2)
+        self.assertEqual(m.errors, 0)
+    
+    @skipUnless(sys.version_info >= (3, 5), 'Generators are only delegated to on Python 3.5+.')
+    def test_decorator__generator_send_throw(self):
+        
+        received = []
+        
+        @mon('test')
+        def gen():
+            
+            while len(received) < 3:
+                try:
+                    value = yield len(received)
+                except ValueError:
+                    value = 'thrown'
+                
+                received.append(value)
+            
+            raise TypeError()
+        
+        # Defined via exec() to keep this module importable on Python 2
+        namespace = {'mon': mon}
+        exec('\n'.join((
+            '@mon("test")',
+            'def gen_return():',
+            '    yield',
+            '    return "result"',
+        )), namespace)
+        
+        with Mon('outer') as outer:
+            g = gen()
+            
+            self.assertEqual(next(g), 0)
+            self.assertEqual(g.send('sent'), 1)
+            self.assertEqual(g.throw(ValueError), 2)
+            
+            # An exception raised by the generator propagates from it
+            with self.assertRaises(TypeError):
+                g.send('last')
+            
+            g = namespace['gen_return']()
+            next(g)
+            
+            with self.assertRaises(StopIteration) as cm:
+                next(g)
+        
+        self.assertEqual(received, ['sent', 'thrown', 'last'])
+        self.assertEqual(cm.exception.value, 'result')
+        
+        m = outer.children['test']
+        self.assertEqual(m.stats['count'], 2)
+        self.assertEqual(m.errors, 1)
+    
+    def test_calibrate(self):
+        
+        self.addCleanup(setattr, M, 'overhead_ns', 0)
+        self.addCleanup(setattr, M, 'overhead_cpu_ns', 0)
+        
+        overhead_ns, overhead_cpu_ns = Mon.calibrate(iterations=10, repeat=2)
+        
+        self.assertGreater(overhead_ns, 0)
+        self.assertEqual(M.overhead_ns, overhead_ns)
+        
+        # The calibration monitors are not left behind
+        self.assertEqual(Mon.get_monitors(), {})
+        self.assertEqual(Mon.aggregate, {})
+    
+    def test_profile(self):
+        
+        profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profile_dir)
+        self.addCleanup(setattr, M, 'profile_dir', M.profile_dir)
+        self.addCleanup(M._profiles.clear)
+        M.profile_dir = profile_dir
+        
+        @mon('inner', profile=True)
+        def inner():
+            
+            return sorted(range(1000), reverse=True)
+        
+        for i in range(2):
+            with Mon('outer', profile=True) as outer:
+                inner()
+        
+        # Nothing is saved until requested
+        self.assertEqual(os.listdir(profile_dir), [])
+        self.assertEqual(M.save_profiles(), [outer.get_profile_path('pstats')])
+        self.assertEqual(M.save_profiles(), [])
+        
+        # The nested monitor was included in the profile of its parent, not
+        # profiled separately
+        pid = os.getpid()
+        self.assertEqual(outer.get_path(), 'outer')
+        self.assertEqual(outer.children['inner'].get_path(), 'outer/inner')
+        self.assertEqual(sorted(os.listdir(profile_dir)), [
+            'outer.{0}.collapsed'.format(pid),
+            'outer.{0}.pstats'.format(pid)
+        ])
+        
+        # Runs are combined
+        stats = pstats.Stats(outer.get_profile_path('pstats'))
+        sorted_calls = [v[1] for k, v in stats.stats.items() if k[2] == '<built-in method builtins.sorted>']
+        self.assertEqual(sorted_calls, [2])
+        
+        with open(outer.get_profile_path('collapsed')) as f:
+            stacks = f.read().splitlines()
+        
+        self.assertTrue(any('(inner);' in stack and 'builtins.sorted' in stack for stack in stacks))
+        
+        for stack in stacks:
+            self.assertRegex(stack, r'^\S.* \d+$')
+        
+        # Without a profiled parent, the decorated function is profiled itself
+        with captured_stdout():
+            inner()
+        
+        M.save_profiles()
+        self.assertTrue(os.path.exists(os.path.join(profile_dir, 'inner.{0}.pstats'.format(pid))))
+    
+    def test_decorator__sample_rate(self):
+        
+        reported = []
+        
+        @mon('test', sample_rate=3, flush_interval=3600, reporter=reported.append)
+        def fn():
+            
+            return Mon.get_last()
+        
+        monitors = [fn() for i in range(9)]
+        
+        # Only every third call was monitored, and nothing was printed
+        self.assertEqual([m is not None for m in monitors], [False, False, True] * 3)
+        self.assertEqual(Mon.aggregate['test'].stats['count'], 3)
+        self.assertEqual(reported, [])
+        
+        fn.sampler.flush()
+        
+        self.assertEqual(len(reported), 1)
+        self.assertEqual(reported[0].stats['count'], 3)
+        self.assertNotIn('test', Mon.aggregate)
+    
+    def test_decorator__sample_rate__exit(self):
+        """
+        Test statistics not yet reported are flushed when the process exits.
+        """
+        
+        script = '\n'.join((
+            'import sys',
+            'from django.conf import settings',
+            'settings.configure()',
+            'import django',
+            'django.setup()',
+            'from djem.utils.mon import mon',
+            'def report(m):',
+            '    sys.stdout.write("reported {0}\\n".format(m.stats["count"]))',
+            '@mon("test", sample_rate=1, flush_interval=3600, reporter=report)',
+            'def fn():',
+            '    pass',
+            'fn()',
+            'fn()',
+        ))
+        
+        root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        output = subprocess.check_output([sys.executable, '-c', script], cwd=root_dir)
+        
+        self.assertEqual(output.decode().splitlines(), ['reported 2'])
+    
+    def test_decorator__sample_interval(self):
+        
+        @mon('test', sample_interval=3600, flush_interval=0)
+        def fn():
+            
+            return Mon.get_last()
+        
+        with self.assertLogs('djem.mon', 'INFO') as logs:
+            monitors = [fn() for i in range(3)]
+        
+        self.assertEqual([m is not None for m in monitors], [True, False, False])
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('Monitor Results', logs.output[0])
+    
+    @skipUnless(sys.version_info >= (3, 5), 'async syntax is not available')
+    def test_async(self):
+        
+        import asyncio
+        
+        # Defined via exec() to keep this module importable on Python 2
+        namespace = {'asyncio': asyncio, 'mon': mon, 'Mon': Mon}
+        exec('\n'.join((
+            '@mon("test")',
+            'async def coro(fail=False):',
+            '    await asyncio.sleep(0)',
+            '    if fail:',
+            '        raise ValueError()',
+            '    return "result"',
+            '',
+            'async def main():',
+            '    async with Mon("outer") as outer:',
+            '        result = await coro()',
+            '        try:',
+            '            await coro(fail=True)',
+            '        except ValueError:',
+            '            pass',
+            '    return outer, result',
+        )), namespace)
+        
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        outer, result = loop.run_until_complete(namespace['main']())
+        
+        self.assertEqual(result, 'result')
+        self.assertEqual(namespace['coro'].__name__, 'coro')
+        
+        m = outer.children['test']
+        self.assertEqual(m.stats['count'], 2)
+        self.assertEqual(m.errors, 1)
+    
+    @skipUnless(sys.version_info >= (3, 7), 'contextvars is not available')
+    def test_contexts(self):
+        
+        import contextvars
+        
+        Mon.start('main')
+        
+        # Simulate two asyncio tasks, each running in a copy of the context
+        # they were created in, with interleaved monitors
+        context_a = contextvars.copy_context()
+        context_b = contextvars.copy_context()
+        
+        context_a.run(Mon.start, 'a')
+        context_b.run(Mon.start, 'b')
+        context_a.run(Mon.stop, 'a')
+        context_b.run(Mon.stop, 'b')
+        
+        m = Mon.stop('main')
+        
+        # Both were children of the monitor running when they were created,
+        # not of each other
+        self.assertEqual(sorted(m.children), ['a', 'b'])
+        self.assertEqual(m.children['a'].children, {})
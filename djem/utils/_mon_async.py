@@ -0,0 +1,83 @@
+"""
+Support for monitoring asynchronous code and generators. This module uses
+syntax only available on Python 3.5+, and is only imported on supported
+versions.
+"""
+
+import functools
+from inspect import iscoroutinefunction  # NOQA
+
+
+class AsyncMonMixin(object):
+    """
+    Allow Mon instances to be used as asynchronous context managers.
+    """
+    
+    async def __aenter__(self):
+        
+        return self.__enter__()
+    
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        
+        return self.__exit__(exc_type, exc_value, traceback)
+
+
+def wrap_coroutine_function(fn, start, stop, sample=None):
+    """
+    Wrap the given coroutine function to call ``start()`` before awaiting it
+    and ``stop(name, error)`` after it completes, where ``name`` is the value
+    returned by ``start()`` and ``error`` indicates whether it raised an
+    exception. If given, ``sample()`` is called first, and the function is
+    awaited without being monitored if it returns False.
+    """
+    
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        
+        if sample is not None and not sample():
+            return await fn(*args, **kwargs)
+        
+        name = start()
+        error = True
+        
+        try:
+            result = await fn(*args, **kwargs)
+            error = False
+            return result
+        finally:
+            stop(name, error)
+    
+    return wrapper
+
+
+def wrap_generator_function(fn, start, stop, sample=None):
+    """
+    Wrap the given generator function to call ``start()`` before the
+    generator is first resumed and ``stop(name, error)`` after it is
+    exhausted or closed, as per ``wrap_coroutine_function()``. The wrapped
+    generator is delegated to with ``yield from``, so values passed to
+    ``send()``, exceptions passed to ``throw()`` and its return value are all
+    passed through.
+    """
+    
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        
+        if sample is not None and not sample():
+            return (yield from fn(*args, **kwargs))
+        
+        name = start()
+        error = True
+        
+        try:
+            result = yield from fn(*args, **kwargs)
+            error = False
+            return result
+        except GeneratorExit:
+            # Closed before being exhausted, not an error
+            error = False
+            raise
+        finally:
+            stop(name, error)
+    
+    return wrapper
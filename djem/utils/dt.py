@@ -1,45 +1,577 @@
 # Date, time and timezone utils
 
+import bisect
+import datetime
+import importlib
+import sys
+
+from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.core.signals import setting_changed
 from django.utils import six, timezone
 
-# Allow the file to be imported without pytz installed, though it is required
-# to use TimeZoneHelper and other timezone-related functionality
 try:
-    import pytz
+    from collections.abc import Sequence
 except ImportError:  # pragma: no cover
-    pytz = None
-    PYTZ_AVAILABLE = False
-    TIMEZONE_CHOICES = []
+    # Python 2
+    from collections import Sequence
+
+try:
+    from importlib.util import find_spec
+except ImportError:  # pragma: no cover
+    # Python 2
+    import imp
+    
+    def _is_available(name):
+        
+        try:
+            imp.find_module(name)
+        except ImportError:
+            return False
+        
+        return True
 else:
-    PYTZ_AVAILABLE = True
-    TIMEZONE_CHOICES = [(tz, tz) for tz in pytz.common_timezones]
+    def _is_available(name):
+        
+        try:
+            return find_spec(name) is not None
+        except ImportError:
+            # The parent package is not available
+            return False
+
+# Allow the file to be imported without pytz or zoneinfo installed, though one
+# of them is required to use TimeZoneHelper and other timezone-related
+# functionality. They are only imported when first used.
+PYTZ_AVAILABLE = _is_available('pytz')
+
+# zoneinfo is available as backports.zoneinfo on Python < 3.9
+ZONEINFO_MODULE = 'zoneinfo' if _is_available('zoneinfo') else 'backports.zoneinfo'
+ZONEINFO_AVAILABLE = _is_available(ZONEINFO_MODULE)
+
+
+def _get_tz_name(tz):
+    """
+    Return the name of the given pytz or zoneinfo timezone, or None if it
+    does not have one.
+    """
+    
+    # pytz timezones use "zone", zoneinfo timezones use "key"
+    name = getattr(tz, 'zone', None)
+    if name is None:
+        name = getattr(tz, 'key', None)
+    
+    return name
+
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _get_seconds(utc):
+    """
+    Return the whole number of seconds between the epoch and the given naive
+    UTC datetime.
+    """
+    
+    delta = utc - EPOCH
+    
+    return delta.days * 86400 + delta.seconds
+
+
+def _get_year_start(seconds):
+    """
+    Return the seconds since the epoch of the start of the year containing
+    the instant the given number of seconds after the epoch.
+    """
+    
+    year = (EPOCH + datetime.timedelta(seconds=seconds)).year
+    
+    return _get_seconds(datetime.datetime(year, 1, 1))
+
+
+def _get_year_end(seconds):
+    """
+    Return the seconds since the epoch of the start of the year after the one
+    containing the instant the given number of seconds after the epoch.
+    """
+    
+    year = (EPOCH + datetime.timedelta(seconds=seconds)).year
+    
+    if year == datetime.MAXYEAR:
+        return _get_seconds(datetime.datetime.max)
+    
+    return _get_seconds(datetime.datetime(year + 1, 1, 1))
+
+
+class Transitions(object):
+    """
+    The UTC offsets of a timezone between the ``start`` and ``end`` instants,
+    in seconds since the epoch (None for unbounded). ``instants`` is a sorted
+    list of the instants at which the offset changes, and ``offsets`` the
+    offset, in seconds, from each of those instants onwards. The first
+    instant is the start of the covered period.
+    """
+    
+    __slots__ = ('start', 'end', 'instants', 'offsets', 'deltas', '_arrays')
+    
+    def __init__(self, start, end, instants, offsets):
+        
+        self.start = start
+        self.end = end
+        self.instants = instants
+        self.offsets = offsets
+        self.deltas = [datetime.timedelta(seconds=offset) for offset in offsets]
+        self._arrays = None
+    
+    def covers(self, start, end):
+        
+        return (self.start is None or self.start <= start) and (self.end is None or end <= self.end)
+    
+    def get_arrays(self, np):
+        """
+        Return ``instants`` and ``offsets`` as NumPy int64 arrays.
+        """
+        
+        arrays = self._arrays
+        if arrays is None:
+            arrays = self._arrays = (
+                np.array(self.instants, dtype='int64'),
+                np.array(self.offsets, dtype='int64')
+            )
+        
+        return arrays
+
+
+class TimeZoneBackend(object):
+    """
+    The base class for the libraries used to look up timezones by name and
+    convert datetimes into them. Subclasses are registered in TZ_BACKENDS,
+    and the backend in use is selected with the ``DJEM_TZ_BACKEND`` setting.
+    """
+    
+    # The exceptions raised by get_timezone() for an unknown timezone name
+    unknown_timezone_errors = ()
+    
+    # True if converting individual datetimes with astimezone() is faster
+    # than looking up their offsets in cached Transitions in Python
+    fast_astimezone = False
+    
+    def __init__(self):
+        
+        # A registry of shared TimeZoneHelper instances, keyed by timezone
+        # name. Entries are only ever added, never replaced or removed, so
+        # lookups need no locking.
+        self.helpers = {}
+        
+        # Cached Transitions, keyed by timezone. Entries are only ever
+        # replaced by ones covering a longer period.
+        self.transitions = {}
+    
+    def get_timezone(self, name):
+        """
+        Return the timezone with the given name.
+        """
+        
+        raise NotImplementedError()
+    
+    def is_timezone(self, tz):
+        """
+        Return True if the given object is a timezone of this backend.
+        """
+        
+        raise NotImplementedError()
+    
+    def get_common_timezones(self):
+        """
+        Return a sorted list of the names of commonly used timezones.
+        """
+        
+        raise NotImplementedError()
+    
+    def localize(self, dt, tz):
+        """
+        Convert the given aware datetime into the given timezone.
+        """
+        
+        return dt.astimezone(tz)
+    
+    def get_transitions(self, tz, start, end):
+        """
+        Return the Transitions of the given timezone, covering at least the
+        period between the ``start`` and ``end`` instants, in seconds since
+        the epoch. Transitions are cached, and calculated for whole years.
+        """
+        
+        transitions = self.transitions.get(tz)
+        if transitions is not None:
+            if transitions.covers(start, end):
+                return transitions
+            
+            # Calculate the transitions of the combined period
+            start = min(start, transitions.start)
+            end = max(end, transitions.end)
+        
+        transitions = self.calculate_transitions(tz, _get_year_start(start), _get_year_end(end))
+        self.transitions[tz] = transitions
+        
+        return transitions
+    
+    def calculate_transitions(self, tz, start, end):
+        """
+        Calculate the Transitions of the given timezone between the ``start``
+        and ``end`` instants, in seconds since the epoch.
+        
+        The offset is sampled daily, and each change found is located to the
+        second by bisection. Changes that are reverted within a day of being
+        made are not detected, though no timezone has ever had such a change.
+        """
+        
+        def get_offset(seconds):
+            
+            utc = EPOCH + datetime.timedelta(seconds=seconds)
+            delta = tz.fromutc(utc.replace(tzinfo=tz)).utcoffset()
+            
+            return delta.days * 86400 + delta.seconds
+        
+        step = 86400
+        offset = get_offset(start)
+        instants = [start]
+        offsets = [offset]
+        
+        t = start
+        while t < end:
+            next_t = min(t + step, end)
+            
+            if get_offset(next_t) == offset:
+                t = next_t
+                continue
+            
+            # Bisect to find the first second with the new offset
+            low, high = t, next_t
+            while high - low > 1:
+                middle = (low + high) // 2
+                if get_offset(middle) == offset:
+                    low = middle
+                else:
+                    high = middle
+            
+            offset = get_offset(high)
+            instants.append(high)
+            offsets.append(offset)
+            t = high
+        
+        return Transitions(start, end, instants, offsets)
+
+
+class PytzBackend(TimeZoneBackend):
+    
+    name = 'pytz'
+    
+    def __init__(self):
+        
+        if not PYTZ_AVAILABLE:  # pragma: no cover
+            raise RuntimeError('The pytz timezone backend requires pytz to be installed.')
+        
+        super(PytzBackend, self).__init__()
+        
+        self.pytz = pytz = importlib.import_module('pytz')
+        self.unknown_timezone_errors = (pytz.UnknownTimeZoneError, )
+    
+    def get_timezone(self, name):
+        
+        return self.pytz.timezone(name)
+    
+    def is_timezone(self, tz):
+        
+        return isinstance(tz, self.pytz.BaseTzInfo)
+    
+    def get_common_timezones(self):
+        
+        return list(self.pytz.common_timezones)
+    
+    def localize(self, dt, tz):
+        
+        return tz.normalize(dt.astimezone(tz))
+    
+    def calculate_transitions(self, tz, start, end):
+        
+        # Use pytz's own transition table, where available, rather than
+        # searching for them. It covers all time.
+        utc_transition_times = getattr(tz, '_utc_transition_times', None)
+        if utc_transition_times is None:
+            if isinstance(tz, self.pytz.tzinfo.DstTzInfo):  # pragma: no cover
+                return super(PytzBackend, self).calculate_transitions(tz, start, end)
+            
+            # A timezone with a fixed offset
+            delta = tz.utcoffset(EPOCH)
+            return Transitions(None, None, [_get_seconds(datetime.datetime.min)], [delta.days * 86400 + delta.seconds])
+        
+        instants = [_get_seconds(t) for t in utc_transition_times]
+        offsets = [delta.days * 86400 + delta.seconds for delta, dst, name in tz._transition_info]
+        
+        return Transitions(None, None, instants, offsets)
+
+
+class ZoneInfoBackend(TimeZoneBackend):
+    
+    name = 'zoneinfo'
+    
+    # zoneinfo caches the transitions of each timezone itself, and looks up
+    # offsets in C
+    fast_astimezone = True
+    
+    # Entries of the system timezone database that are not timezones in their
+    # own right
+    EXCLUDED_PREFIXES = ('posix/', 'right/', 'Etc/')
+    EXCLUDED_NAMES = ('Factory', 'localtime', 'posixrules')
+    
+    def __init__(self):
+        
+        if not ZONEINFO_AVAILABLE:  # pragma: no cover
+            raise RuntimeError(
+                'The zoneinfo timezone backend requires Python 3.9+ or backports.zoneinfo to be installed.'
+            )
+        
+        super(ZoneInfoBackend, self).__init__()
+        
+        self.zoneinfo = zoneinfo = importlib.import_module(ZONEINFO_MODULE)
+        
+        # ValueError is raised for malformed names, e.g. absolute paths
+        self.unknown_timezone_errors = (zoneinfo.ZoneInfoNotFoundError, ValueError)
+    
+    def get_timezone(self, name):
+        
+        return self.zoneinfo.ZoneInfo(name)
+    
+    def is_timezone(self, tz):
+        
+        return isinstance(tz, self.zoneinfo.ZoneInfo)
+    
+    def get_common_timezones(self):
+        
+        names = [
+            name for name in self.zoneinfo.available_timezones()
+            if not name.startswith(self.EXCLUDED_PREFIXES) and name not in self.EXCLUDED_NAMES
+        ]
+        
+        # Include UTC, excluded with the rest of Etc/ (as per pytz)
+        names.append('UTC')
+        
+        return sorted(set(names))
+
+
+TZ_BACKENDS = {
+    'pytz': PytzBackend,
+    'zoneinfo': ZoneInfoBackend
+}
+
+_tz_backend = None
+_tz_backend_instances = {}
+
+
+def get_tz_backend():
+    """
+    Return the TimeZoneBackend in use, as per the ``DJEM_TZ_BACKEND`` setting.
+    This defaults to "pytz" if pytz is installed, otherwise "zoneinfo".
+    """
+    
+    global _tz_backend
+    
+    backend = _tz_backend
+    if backend is None:
+        name = getattr(settings, 'DJEM_TZ_BACKEND', 'pytz' if PYTZ_AVAILABLE else 'zoneinfo')
+        
+        # Backends are only created once, so helpers remain shared if the
+        # setting changes
+        try:
+            backend = _tz_backend_instances[name]
+        except KeyError:
+            try:
+                backend_class = TZ_BACKENDS[name]
+            except KeyError:
+                raise TypeError('Unknown timezone backend "{0}".'.format(name))
+            
+            backend = _tz_backend_instances[name] = backend_class()
+        
+        _tz_backend = backend
+    
+    return backend
+
+
+class TimeZoneChoices(Sequence):
+    """
+    An immutable sequence of (name, name) choices for the common timezones of
+    the timezone backend in use (see get_tz_backend()). The choices are only
+    built when first accessed, then cached, so defining fields using them does
+    not import the timezone library.
+    """
+    
+    def __init__(self):
+        
+        self._choices = None
+    
+    def _get_choices(self):
+        
+        choices = self._choices
+        if choices is None:
+            if PYTZ_AVAILABLE or ZONEINFO_AVAILABLE:
+                names = get_tz_backend().get_common_timezones()
+            else:  # pragma: no cover
+                names = ()
+            
+            choices = self._choices = tuple((name, name) for name in names)
+        
+        return choices
+    
+    def clear(self):
+        """
+        Discard the cached choices, so they are rebuilt on next access.
+        """
+        
+        self._choices = None
+    
+    def __getitem__(self, index):
+        
+        return self._get_choices()[index]
+    
+    def __len__(self):
+        
+        return len(self._get_choices())
+    
+    def __iter__(self):
+        
+        return iter(self._get_choices())
+    
+    def __contains__(self, item):
+        
+        return item in self._get_choices()
+    
+    def __bool__(self):
+        
+        # Always truthy, without building the choices, as Field.__init__()
+        # tests the truthiness of its ``choices`` argument
+        return True
+    
+    # Python 2 compat.
+    __nonzero__ = __bool__
+    
+    def __eq__(self, other):
+        
+        if other is self:
+            return True
+        
+        if not isinstance(other, (Sequence, list, tuple)):
+            return NotImplemented
+        
+        return self._get_choices() == tuple(other)
+    
+    def __ne__(self, other):
+        
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        
+        return not result
+    
+    __hash__ = None
+    
+    def __repr__(self):
+        
+        if self._choices is None:
+            return '<{0}: not built>'.format(self.__class__.__name__)
+        
+        return '<{0}: {1} timezones>'.format(self.__class__.__name__, len(self._choices))
+
+
+TIMEZONE_CHOICES = TimeZoneChoices()
+
+
+def _reset_tz_backend(**kwargs):
+    
+    global _tz_backend
+    
+    if kwargs['setting'] == 'DJEM_TZ_BACKEND':
+        _tz_backend = None
+        TIMEZONE_CHOICES.clear()
+
+
+setting_changed.connect(_reset_tz_backend)
 
 
 class TimeZoneHelper(object):
+    """
+    An immutable helper for a timezone. Helpers for the same timezone compare
+    equal, and get_tz_helper() returns a shared instance per timezone name.
+    """
+    
+    __slots__ = ('tz', 'name', '_backend')
     
     def __init__(self, tz):
         
-        if not PYTZ_AVAILABLE:  # pragma: no cover
-            raise RuntimeError('TimeZoneHelper requires pytz to be installed.')
+        if not PYTZ_AVAILABLE and not ZONEINFO_AVAILABLE:  # pragma: no cover
+            raise RuntimeError('TimeZoneHelper requires pytz or zoneinfo to be installed.')
+        
+        backend = get_tz_backend()
         
         if isinstance(tz, six.string_types):
-            tz = pytz.timezone(tz)
+            tz = backend.get_timezone(tz)
+        elif not backend.is_timezone(tz):
+            # A timezone of another library, e.g. a pytz timezone when using
+            # the zoneinfo backend. Convert it if possible.
+            name = _get_tz_name(tz)
+            if name is not None:
+                tz = backend.get_timezone(name)
+        
+        object.__setattr__(self, 'tz', tz)
+        object.__setattr__(self, 'name', _get_tz_name(tz))
+        object.__setattr__(self, '_backend', backend)
+    
+    def __setattr__(self, name, value):
+        
+        raise AttributeError('TimeZoneHelper instances are immutable.')
+    
+    def __delattr__(self, name):
+        
+        raise AttributeError('TimeZoneHelper instances are immutable.')
+    
+    def __reduce__(self):
+        
+        if self.name is None:
+            # Timezones without a name, e.g. fixed offsets, have no shared
+            # instance
+            return (TimeZoneHelper, (self.tz, ))
         
-        self.tz = tz
+        # Restore the shared instance when unpickling
+        return (get_tz_helper, (self.name, ))
     
-    @property
-    def name(self):
+    def _get_key(self):
         
-        return self.tz.zone
+        # Compare by name, or by timezone for those without a name
+        return self.tz if self.name is None else self.name
+    
+    def __eq__(self, other):
+        
+        if not isinstance(other, TimeZoneHelper):
+            return NotImplemented
+        
+        return self._get_key() == other._get_key()
+    
+    def __ne__(self, other):
+        
+        if not isinstance(other, TimeZoneHelper):
+            return NotImplemented
+        
+        return self._get_key() != other._get_key()
+    
+    def __hash__(self):
+        
+        return hash(self._get_key())
     
     def now(self):
         """
         Return the current datetime in the local timezone.
         """
         
-        utc_now = timezone.now()
-        return self.tz.normalize(utc_now.astimezone(self.tz))
+        return self._backend.localize(timezone.now(), self.tz)
     
     def today(self):
         """
@@ -48,6 +580,146 @@ class TimeZoneHelper(object):
         
         return self.now().date()
     
+    def get_transitions(self, start, end):
+        """
+        Return the Transitions of the timezone, covering at least the period
+        between the ``start`` and ``end`` instants, in seconds since the
+        epoch. They are calculated once per timezone and cached.
+        """
+        
+        return self._backend.get_transitions(self.tz, start, end)
+    
+    def _convert_list_astimezone(self, values, dates):
+        
+        tz = self.tz
+        utc = datetime.timezone.utc
+        
+        results = []
+        for value in values:
+            if value is None:
+                results.append(None)
+                continue
+            
+            if value.tzinfo is None:
+                value = value.replace(tzinfo=utc)
+            
+            local = value.astimezone(tz)
+            results.append(local.date() if dates else local.replace(tzinfo=None))
+        
+        return results
+    
+    def _convert_list(self, values, dates):
+        
+        if self._backend.fast_astimezone:
+            return self._convert_list_astimezone(values, dates)
+        
+        # Convert to naive UTC datetimes and seconds since the epoch
+        utc_values = []
+        seconds = []
+        for value in values:
+            if value is None:
+                utc_values.append(None)
+                seconds.append(None)
+                continue
+            
+            if value.tzinfo is not None:
+                value = value.replace(tzinfo=None) - value.utcoffset()
+            
+            delta = value - EPOCH
+            utc_values.append(value)
+            seconds.append(delta.days * 86400 + delta.seconds)
+        
+        valid_seconds = [t for t in seconds if t is not None]
+        if not valid_seconds:
+            return utc_values
+        
+        transitions = self.get_transitions(min(valid_seconds), max(valid_seconds))
+        instants = transitions.instants
+        deltas = transitions.deltas
+        last = len(instants) - 1
+        bisect_right = bisect.bisect_right
+        
+        # The bounds of the period with the most recently used offset, which
+        # is checked before searching all transitions, as values are often
+        # sorted or clustered
+        low = high = delta = None
+        
+        results = []
+        for utc, t in zip(utc_values, seconds):
+            if utc is None:
+                results.append(None)
+                continue
+            
+            if low is None or not low <= t < high:
+                i = bisect_right(instants, t) - 1
+                low = instants[i]
+                high = instants[i + 1] if i < last else float('inf')
+                delta = deltas[i]
+            
+            local = utc + delta
+            results.append(local.date() if dates else local)
+        
+        return results
+    
+    def _convert_array(self, np, values, dates):
+        
+        if values.dtype.kind != 'M':
+            raise TypeError('Expected an array of datetime64 values.')
+        
+        valid = ~np.isnat(values)
+        seconds = values.astype('datetime64[s]').astype('int64')
+        
+        if valid.any():
+            valid_seconds = seconds[valid]
+            transitions = self.get_transitions(int(valid_seconds.min()), int(valid_seconds.max()))
+            instants, offsets = transitions.get_arrays(np)
+            
+            # NaT values give an index of -1, but remain NaT
+            indices = np.searchsorted(instants, seconds, side='right') - 1
+            values = values + offsets[indices].astype('timedelta64[s]')
+        
+        if dates:
+            return values.astype('datetime64[D]')
+        
+        return values
+    
+    def _convert(self, values, dates):
+        
+        # Only check for NumPy arrays if NumPy has been imported, otherwise
+        # the values cannot be one
+        np = sys.modules.get('numpy')
+        if np is not None and isinstance(values, np.ndarray):
+            return self._convert_array(np, values, dates)
+        
+        return self._convert_list(values, dates)
+    
+    def get_wall_times(self, values):
+        """
+        Return the local wall times (naive datetimes) of the given UTC
+        instants, using offsets from the timezone's cached transitions rather
+        than converting each value individually.
+        
+        ``values`` can be any iterable of datetimes, such as a
+        ``values_list()`` queryset of a ``DateTimeField``. Aware datetimes in
+        any timezone are accepted, naive datetimes are taken to be UTC, and
+        None values are returned as None. A list is returned.
+        
+        ``values`` can also be a NumPy ``datetime64`` array, taken to be UTC.
+        A ``datetime64`` array of the same shape is returned, with NaT values
+        remaining NaT.
+        """
+        
+        return self._convert(values, False)
+    
+    def get_dates(self, values):
+        """
+        Return the local dates of the given UTC instants. As per
+        get_wall_times(), except returning a list of dates, or a
+        ``datetime64[D]`` array.
+        """
+        
+        return self._convert(values, True)
+    
     def __str__(self):
         
         return self.name
@@ -61,21 +733,95 @@ def get_tz_helper(value):
     """
     Return an instance of TimeZoneHelper based on the given value.
     Valid values are:
-     - A timezone string (accepted by pytz.timezone())
+     - A timezone string (accepted by pytz.timezone() or zoneinfo.ZoneInfo())
      - An instance of pytz.tzinfo.BaseTzInfo
      - The pytz.UTC singleton
+     - An instance of zoneinfo.ZoneInfo
+    
+    The same instance is returned for all values representing the same named
+    timezone, using the timezone backend in use (see get_tz_backend()).
     
     Return None if the value is None or the empty string.
-    Raise ValidationError if the value cannot be converted into a pytz timezone.
+    Raise ValidationError if the value cannot be converted into a timezone.
     """
     
+    backend = get_tz_backend()
+    helpers = backend.helpers
+    
+    # Fast path for timezone names, e.g. when loading values from the database
+    try:
+        return helpers[value]
+    except (KeyError, TypeError):
+        pass
+    
     if value in (None, ''):
         return None
     
-    if isinstance(value, TimeZoneHelper):
+    if isinstance(value, TimeZoneHelper) and value._backend is backend:
         return value
     
+    if isinstance(value, TimeZoneHelper):
+        # A helper created using another backend
+        value = value.name
+    
     try:
-        return TimeZoneHelper(value)
-    except pytz.UnknownTimeZoneError:
+        helper = TimeZoneHelper(value)
+    except backend.unknown_timezone_errors:
         raise ValidationError('Invalid timezone "{0}".'.format(value))
+    
+    name = helper.name
+    if name is None:
+        # A timezone without a name (e.g. a pytz.FixedOffset), which cannot
+        # be shared
+        return helper
+    
+    # Use setdefault() so concurrent callers receive the same instance
+    return helpers.setdefault(name, helper)
+
+
+def _convert_pairs(pairs, method):
+    
+    pairs = list(pairs)
+    results = [None] * len(pairs)
+    
+    # Group values by timezone, so each timezone is converted in one batch
+    groups = {}
+    for i, (helper, value) in enumerate(pairs):
+        if helper is None:
+            continue
+        
+        try:
+            indices, values = groups[helper]
+        except KeyError:
+            indices, values = groups[helper] = ([], [])
+        
+        indices.append(i)
+        values.append(value)
+    
+    for helper, (indices, values) in groups.items():
+        for i, result in zip(indices, getattr(helper, method)(values)):
+            results[i] = result
+    
+    return results
+
+
+def get_wall_times(pairs):
+    """
+    Return a list of the local wall times of the given (TimeZoneHelper, UTC
+    datetime) pairs, e.g. those of a queryset such as
+    ``User.objects.values_list('timezone', 'last_login')``, where ``timezone``
+    is a ``TimeZoneField``. Values are converted in one batch per timezone
+    (see TimeZoneHelper.get_wall_times()). The results of pairs with a None
+    helper or datetime are None.
+    """
+    
+    return _convert_pairs(pairs, 'get_wall_times')
+
+
+def get_dates(pairs):
+    """
+    Return a list of the local dates of the given (TimeZoneHelper, UTC
+    datetime) pairs. As per get_wall_times().
+    """
+    
+    return _convert_pairs(pairs, 'get_dates')
@@ -3,14 +3,100 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import inspect as inspector
 import pprint
 import types
+import weakref
 
-from django.db.models import FieldDoesNotExist, Manager, Model, QuerySet
+from django.apps import apps
+from django.db import connections
+from django.db.models import (
+    Count, FieldDoesNotExist, IntegerField, Manager, Model, QuerySet, Subquery
+)
 from django.db.models.fields import NOT_PROVIDED
+from django.db.models.fields.related_descriptors import (
+    ForwardManyToOneDescriptor, ManyToManyDescriptor,
+    ReverseManyToOneDescriptor, ReverseOneToOneDescriptor
+)
+from django.db.models.query_utils import DeferredAttribute
 from django.utils import six
 from django.utils.encoding import force_text
 
 from djem.utils.table import Table
 
+# The default maximum number of rows/items pp() will print for a QuerySet or
+# other potentially unbounded iterable, and the number of rows to fetch from
+# the database at a time when streaming a QuerySet
+PP_ROW_LIMIT = 100
+PP_CHUNK_SIZE = 2000
+
+
+class ClassIndex(object):
+    """
+    An index of the attributes defined directly on a class and each of its
+    parents, built once from the ``__dict__`` of each class in its MRO. Use
+    get_class_index() to obtain a cached instance for a given class.
+    """
+    
+    def __init__(self, cls):
+        
+        self.cls = cls
+        self.mro = inspector.getmro(cls)
+        
+        # Map attribute names to the classes that define them, in reverse MRO
+        # order (i.e. the class that originally defined the attribute first)
+        definers = {}
+        for parent in reversed(self.mro):
+            for attr in vars(parent):
+                definers.setdefault(attr, []).append(parent)
+        
+        self._definers = definers
+    
+    def get_defined_by(self, attr, default=None):
+        """
+        Return the class that originally defined the given attribute, or
+        ``default`` if no class in the MRO defines it.
+        """
+        
+        try:
+            return self._definers[attr][0]
+        except KeyError:
+            return default
+    
+    def get_definers(self, attr):
+        """
+        Return a tuple of all classes in the MRO that define the given
+        attribute directly, in reverse MRO order.
+        """
+        
+        return tuple(self._definers.get(attr, ()))
+    
+    def get_static(self, attr):
+        """
+        Return the raw value of the given attribute, as found in the
+        ``__dict__`` of the first class in the MRO that defines it, without
+        invoking any descriptors. Raise AttributeError if no class in the MRO
+        defines it.
+        """
+        
+        try:
+            return vars(self._definers[attr][-1])[attr]
+        except KeyError:
+            raise AttributeError(attr)
+
+
+_class_index_cache = weakref.WeakKeyDictionary()
+
+
+def get_class_index(cls):
+    """
+    Return a ClassIndex for the given class. Indexes are built on first use and
+    cached for the lifetime of the class.
+    """
+    
+    try:
+        return _class_index_cache[cls]
+    except KeyError:
+        index = _class_index_cache[cls] = ClassIndex(cls)
+        return index
+
 
 def get_defined_by(obj, attr):
     """
@@ -23,13 +109,7 @@ def get_defined_by(obj, attr):
     else:
         cls = obj.__class__
     
-    for parent in reversed(cls.mro()):
-        if hasattr(parent, attr):
-            return parent
-    
-    defined_by = cls
-    
-    return defined_by
+    return get_class_index(cls).get_defined_by(attr, cls)
 
 
 def inspectf(func):
@@ -144,13 +224,24 @@ class InspectTable(object):
 
 class ObjectTable(InspectTable):
     
+    # Descriptor types that are safe to evaluate in lazy mode, as doing so does
+    # not execute any arbitrary code
+    SAFE_DESCRIPTOR_TYPES = (
+        types.FunctionType,
+        types.BuiltinFunctionType,
+        staticmethod,
+        classmethod
+    )
+    
     def __init__(
             self,
             obj,
             ignore_methods=False,
             ignore_inherited=False,
             ignore_private=True,
-            ignore_magic=True):
+            ignore_magic=True,
+            lazy=False,
+            count_relations=False):
         
         super(ObjectTable, self).__init__()
         
@@ -159,6 +250,17 @@ class ObjectTable(InspectTable):
         self.ignore_inherited = ignore_inherited
         self.ignore_private = ignore_private
         self.ignore_magic = ignore_magic
+        self.lazy = lazy
+        
+        if isinstance(obj, Model):
+            self._relations = self._get_relations()
+        else:
+            self._relations = {}
+        
+        if count_relations:
+            self._relation_counts = self._get_relation_counts()
+        else:
+            self._relation_counts = {}
         
         magic, methods, other = self._inspect_obj()
         num_inspected = 0
@@ -179,6 +281,167 @@ class ObjectTable(InspectTable):
         self.num_inspected = num_inspected
         self.data_groups = data_groups
     
+    def _get_relations(self):
+        """
+        Return a dictionary mapping the accessor names of the relations on the
+        inspected model instance to their fields.
+        """
+        
+        relations = {}
+        
+        for field in self.obj._meta.get_fields():
+            if not field.is_relation:
+                continue
+            
+            if field.auto_created and not field.concrete:
+                # A reverse relation. Hidden reverse relations have no accessor.
+                accessor = field.get_accessor_name()
+            else:
+                accessor = field.name
+            
+            if accessor:
+                relations[accessor] = field
+        
+        return relations
+    
+    def _get_relation_counts(self):
+        """
+        Return a dictionary mapping the accessor names of the multi-valued
+        relations on the inspected model instance (reverse ForeignKeys and
+        ManyToManyFields) to the number of records they reference. All counts
+        are retrieved in a single query, using a subquery per relation.
+        """
+        
+        obj = self.obj
+        
+        if not self._relations or obj.pk is None:
+            return {}
+        
+        base_qs = obj.__class__._base_manager.filter(pk=obj.pk).order_by()
+        
+        accessors = {}
+        annotations = {}
+        
+        for accessor, field in self._relations.items():
+            if not (field.one_to_many or field.many_to_many):
+                continue
+            
+            if field.related_model is None:
+                # A generic relation, which cannot be counted via a join
+                continue
+            
+            alias = 'djem_count_{0}'.format(len(annotations))
+            accessors[alias] = accessor
+            annotations[alias] = Subquery(
+                base_qs.values('pk').annotate(n=Count(field.name)).values('n'),
+                output_field=IntegerField()
+            )
+        
+        if not annotations:
+            return {}
+        
+        row = base_qs.annotate(**annotations).values(*annotations.keys())[0]
+        
+        return dict((accessors[alias], count) for alias, count in row.items())
+    
+    def _describe_relation(self, attr, descriptor):
+        """
+        Return a tuple of a description of the given related object descriptor
+        and the name of the type it provides access to, without querying for
+        the related object/s.
+        """
+        
+        obj = self.obj
+        field = self._relations[attr]
+        
+        if field.related_model is None:
+            # A GenericForeignKey, whose related model depends on the instance
+            ct_field = obj._meta.get_field(field.ct_field)
+            v = 'Generic relation (content_type_id={0}, object_id={1}, not fetched)'.format(
+                obj.__dict__.get(ct_field.attname),
+                obj.__dict__.get(field.fk_field)
+            )
+            
+            return v, type(field).__name__
+        
+        related_name = field.related_model.__name__
+        
+        if isinstance(descriptor, ReverseManyToOneDescriptor):
+            count = self._relation_counts.get(attr)
+            if count is None:
+                v = 'Referencing {0} records (not counted)'.format(related_name)
+            else:
+                v = 'Referencing {0} {1} records'.format(count, related_name)
+            
+            if isinstance(descriptor, ManyToManyDescriptor):
+                t = 'ManyRelatedManager'
+            else:
+                t = 'RelatedManager'
+        elif isinstance(descriptor, ForwardManyToOneDescriptor):
+            v = '{0} (pk={1}, not fetched)'.format(
+                related_name,
+                obj.__dict__.get(descriptor.field.attname)
+            )
+            t = related_name
+        else:
+            v = '{0} (not fetched)'.format(related_name)
+            t = related_name
+        
+        return v, t
+    
+    def _get_lazy_attr(self, attr):
+        """
+        Return a tuple of a description of the given attribute and the name of
+        its type, if evaluating the attribute could execute arbitrary code or
+        database queries (e.g. properties and related object descriptors).
+        Return None if it is safe to evaluate the attribute.
+        """
+        
+        obj = self.obj
+        
+        if inspector.isclass(obj) or attr in getattr(obj, '__dict__', ()):
+            return None
+        
+        try:
+            value = get_class_index(obj.__class__).get_static(attr)
+        except AttributeError:
+            # Dynamic attribute, e.g. provided by __getattr__
+            return None
+        
+        if not hasattr(value, '__get__') or isinstance(value, self.SAFE_DESCRIPTOR_TYPES):
+            return None
+        
+        related_descriptors = (ForwardManyToOneDescriptor, ReverseOneToOneDescriptor)
+        if isinstance(value, related_descriptors) and value.is_cached(obj):
+            # The related object is already cached, no query necessary
+            return None
+        
+        if attr in self._relations:
+            return self._describe_relation(attr, value)
+        elif isinstance(value, DeferredAttribute):
+            return '<deferred, not fetched>', 'deferred field'
+        
+        return '<not evaluated>', type(value).__name__
+    
+    def _get_attr(self, attr):
+        """
+        Return a tuple of the value of the given attribute on the inspected
+        object and the name of its type. In lazy mode, attributes that are
+        unsafe to evaluate are described rather than evaluated.
+        """
+        
+        if self.lazy:
+            lazy_attr = self._get_lazy_attr(attr)
+            if lazy_attr is not None:
+                return lazy_attr
+        
+        try:
+            v = getattr(self.obj, attr)
+        except Exception as e:
+            return 'Error accessing attribute: {0}'.format(e), 'unknown'
+        
+        return v, type(v).__name__
+    
     def _get_inspect_value(self, v, obj, attr):
         """
         Return the given value in a format suitable for output in the table.
@@ -195,8 +458,12 @@ class ObjectTable(InspectTable):
             except FieldDoesNotExist:
                 v = 'Manager on {0} model'.format(cls.__name__)
             else:
+                count = self._relation_counts.get(attr)
+                if count is None:
+                    count = v.count()
+                
                 v = 'Referencing {0} {1} records'.format(
-                    v.count(),
+                    count,
                     model_field.related_model.__name__
                 )
         elif isinstance(v, types.MethodType):
@@ -211,6 +478,13 @@ class ObjectTable(InspectTable):
         obj = self.obj
         cls = obj.__class__
         
+        if inspector.isclass(obj):
+            index = get_class_index(obj)
+            default_defined_by = obj
+        else:
+            index = get_class_index(cls)
+            default_defined_by = cls
+        
         ignore_methods = self.ignore_methods
         ignore_inherited = self.ignore_inherited
         ignore_private = self.ignore_private
@@ -228,17 +502,11 @@ class ObjectTable(InspectTable):
             elif attr.startswith('_') and not is_magic and ignore_private:
                 continue
             
-            defined_by = get_defined_by(obj, attr).__name__
+            defined_by = index.get_defined_by(attr, default_defined_by).__name__
             if defined_by != cls.__name__ and ignore_inherited:
                 continue
             
-            try:
-                v = getattr(obj, attr)
-            except Exception as e:
-                v = 'Error accessing attribute: {0}'.format(e)
-                t = 'unknown'
-            else:
-                t = type(v).__name__
+            v, t = self._get_attr(attr)
             
             if isinstance(v, types.MethodType):
                 if ignore_methods:
@@ -288,6 +556,9 @@ class ObjectTable(InspectTable):
         else:
             description.append('Ignoring: Nothing')
         
+        if self.lazy:
+            description.append('Lazy: Properties and relations not evaluated')
+        
         try:
             mro = self.obj.mro()
         except AttributeError:
@@ -330,6 +601,11 @@ class ModelTable(InspectTable):
         'ManyToOne': 'M2O'
     }
     
+    # Discovered model metadata, cached per model class and value of
+    # concrete_only. Only populated once the app registry is ready, as fields
+    # may still be added to models before then.
+    _metadata_cache = weakref.WeakKeyDictionary()
+    
     def __init__(self, model, *field_filters, **kwargs):
         
         super(ModelTable, self).__init__()
@@ -338,48 +614,79 @@ class ModelTable(InspectTable):
         self.field_filters = [f.lower() for f in field_filters]
         self.concrete_only = kwargs.pop('concrete_only', True)
         
-        hierarchy, pk_hierarchy = self._get_hierarchies()
+        hierarchy, pk_hierarchy, discovered_fields = self._get_metadata()
+        
+        # Copy the (potentially cached) hierarchy so it can be annotated with
+        # the fields matching this table's filters
+        hierarchy = [dict(config) for config in hierarchy]
         
         self.hierarchy = hierarchy
         self.pk_hierarchy = pk_hierarchy
         
-        self._discover_fields()
+        self._filter_fields(discovered_fields)
         
         self.total_discovered_fields = sum([c['num_discovered_fields'] for c in hierarchy])
         self.total_discovered_fields += 1  # add the pk
         
         self.total_matching_fields = sum([len(c['matching_fields']) for c in hierarchy])
     
+    @classmethod
+    def clear_cache(cls):
+        """
+        Clear the cached metadata of all models.
+        """
+        
+        cls._metadata_cache.clear()
+    
+    def _get_metadata(self):
+        """
+        Return a tuple of the model hierarchy, the primary key hierarchy, and
+        the fields discovered on each model in the hierarchy. Use the cached
+        values for the model, if any.
+        """
+        
+        model = self.model
+        concrete_only = self.concrete_only
+        
+        try:
+            return self._metadata_cache[model][concrete_only]
+        except KeyError:
+            pass
+        
+        hierarchy, pk_hierarchy = self._get_hierarchies()
+        discovered_fields = self._discover_fields(hierarchy)
+        
+        metadata = (tuple(hierarchy), tuple(pk_hierarchy), discovered_fields)
+        
+        if apps.ready:
+            self._metadata_cache.setdefault(model, {})[concrete_only] = metadata
+        
+        return metadata
+    
     def _get_hierarchies(self):
         
         hierarchy = []
         pk_hierarchy = []
         
-        for cls in reversed(self.model.mro()):
-            try:
-                meta = cls._meta
-            except AttributeError:
-                # This parent class is not a Model
-                pass
+        # Each Model class in the MRO defines its own _meta
+        for cls in get_class_index(self.model).get_definers('_meta'):
+            meta = cls._meta
+            model_name = cls.__name__
+            
+            if meta.abstract:
+                model_name += ' [Abstract]'
             else:
-                model_name = cls.__name__
-                
-                if meta.abstract:
-                    model_name += ' [Abstract]'
-                else:
-                    pk_hierarchy.append(meta.pk.name)
-                
-                hierarchy.append({
-                    'display_name': model_name,
-                    'class': cls,
-                    'meta': meta
-                })
+                pk_hierarchy.append(meta.pk.name)
+            
+            hierarchy.append({
+                'display_name': model_name,
+                'class': cls,
+                'meta': meta
+            })
         
         return hierarchy, pk_hierarchy
     
-    def _check_field_match(self, field):
-        
-        field_name = field.name.lower()
+    def _check_field_match(self, field_name):
         
         for f in self.field_filters:
             if f in field_name:
@@ -471,14 +778,20 @@ class ModelTable(InspectTable):
         
         return '{0}{1}'.format(prefix, field.name)
     
-    def _discover_fields(self):
+    def _discover_fields(self, hierarchy):
+        """
+        Return a tuple containing, for each model in the given hierarchy, a
+        tuple of the fields discovered on that model. Each field is represented
+        by a tuple of its lowercase name (for filtering) and its row of data
+        for the table.
+        """
         
         # Track fields considered valid
         valid_fields = set()
+        discovered_fields = []
         
-        for config in self.hierarchy:
-            num_discovered_fields = 0
-            matching_fields = []
+        for config in hierarchy:
+            fields = []
             
             all_fields = config['meta'].get_fields(include_parents=False)
             
@@ -500,30 +813,35 @@ class ModelTable(InspectTable):
                     # abstract parents should also be excluded.
                     continue
                 
-                # Consider "valid" before filtering out
                 valid_fields.add(field.name)
                 
-                # Count against total before filtering out
-                num_discovered_fields += 1
-                
-                # Apply field filters, if any
-                if self.field_filters and not self._check_field_match(field):
-                    continue
-                
                 field_type = self._get_field_type(field)
                 default_value = self._get_field_default(field)
                 flags = self._get_field_flags(field)
                 
-                matching_fields.append((
+                fields.append((field.name.lower(), (
                     field.name,
                     field_type,
                     field.null,
                     default_value,
                     ', '.join(flags)
-                ))
+                )))
+            
+            discovered_fields.append(tuple(fields))
+        
+        return tuple(discovered_fields)
+    
+    def _filter_fields(self, discovered_fields):
+        
+        for config, fields in zip(self.hierarchy, discovered_fields):
+            # Apply field filters, if any
+            if self.field_filters:
+                matching_fields = [row for name, row in fields if self._check_field_match(name)]
+            else:
+                matching_fields = [row for name, row in fields]
             
             config['matching_fields'] = matching_fields
-            config['num_discovered_fields'] = num_discovered_fields
+            config['num_discovered_fields'] = len(fields)
     
     def _get_model_row(self, config):
         
@@ -625,13 +943,113 @@ class ModelTable(InspectTable):
                 table.add_rows(matching_fields)
 
 
+def get_count_estimate(queryset):
+    """
+    Return a tuple of the number of rows matched by the given QuerySet and a
+    flag indicating whether that number is an estimate. Avoid evaluating the
+    QuerySet itself. For unfiltered QuerySets on PostgreSQL, use the planner's
+    row estimate for the table rather than performing a (potentially slow)
+    full COUNT.
+    """
+    
+    if queryset._result_cache is not None:
+        return len(queryset._result_cache), False
+    
+    query = queryset.query
+    connection = connections[queryset.db]
+    
+    unfiltered = not query.where and query.low_mark == 0 and query.high_mark is None
+    
+    if unfiltered and connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        
+        # The estimate is unavailable (or -1) for tables never analysed
+        if row and row[0] is not None and row[0] >= 0:
+            return int(row[0]), True
+    
+    return queryset.count(), False
+
+
+def _iter_queryset(queryset, limit, chunk_size):
+    
+    if queryset._result_cache is not None:
+        # Already evaluated, no need to query the database again
+        return iter(queryset._result_cache)
+    
+    if limit is not None and queryset.query.high_mark is None:
+        # Fetch one more row than will be printed, to detect if there are more
+        queryset = queryset[queryset.query.low_mark:queryset.query.low_mark + limit + 1]
+    
+    try:
+        return queryset.iterator(chunk_size=chunk_size)
+    except TypeError:  # pragma: no cover
+        # Django < 2.0 does not support chunk_size
+        return queryset.iterator()
+
+
+def pp_iterable(iterable, limit=PP_ROW_LIMIT, chunk_size=PP_CHUNK_SIZE, **kwargs):
+    """
+    Pretty-print the items of a QuerySet or other (potentially unbounded)
+    iterable, one at a time, as they are retrieved. QuerySets are streamed from
+    the database in chunks of ``chunk_size`` rows rather than being loaded into
+    memory in their entirety. Stop after ``limit`` items and print a summary
+    of how many more remain. Pass ``limit=None`` to print all items.
+    Additional kwargs are passed through to pprint.pprint().
+    """
+    
+    is_queryset = isinstance(iterable, QuerySet)
+    
+    if is_queryset:
+        items = _iter_queryset(iterable, limit, chunk_size)
+    else:
+        items = iter(iterable)
+    
+    num_printed = 0
+    truncated = False
+    
+    for item in items:
+        if limit is not None and num_printed >= limit:
+            truncated = True
+            break
+        
+        pprint.pprint(item, **kwargs)
+        num_printed += 1
+    
+    if not truncated:
+        if not num_printed:
+            print('No results.')
+        
+        return
+    
+    if not is_queryset:
+        print('... more items not shown (limit: {0})'.format(limit))
+        return
+    
+    count, is_estimate = get_count_estimate(iterable)
+    remaining = max(count - num_printed, 0)
+    
+    print('... {0}{1} more row{2} (limit: {3})'.format(
+        'approx. ' if is_estimate else '',
+        remaining,
+        's' if remaining != 1 else '',
+        limit
+    ))
+
+
 def pp(obj, *args, **kwargs):
     """
     Catch-all pretty-print/inspection function. Takes any object and tries to
     print the most useful representation of it. Additional args/kwargs depend
     on the type of object. Accepted types:
-      - dictionaries, lists, tuples, sets and Django QuerySets: print using
-        Python's pprint library. Accepts all args/kwargs of pprint.pprint().
+      - Django QuerySets and generators: print each item as it is retrieved,
+        up to a limit, using pp_iterable. Accepts all args/kwargs of pp_iterable.
+      - dictionaries, lists, tuples and sets: print using Python's pprint
+        library. Accepts all args/kwargs of pprint.pprint().
       - functions/methods: print using inspectf. Accepts all args/kwargs of inspectf.
       - Django Model classes: print in a ModelTable. Accepts all constructor
         args/kwargs of ModelTable.
@@ -639,9 +1057,11 @@ def pp(obj, *args, **kwargs):
         args/kwargs of ObjectTable.
     """
     
-    # Force QuerySets to lists for pretty-printing
-    if isinstance(obj, QuerySet):
-        obj = list(obj)
+    # Stream QuerySets and generators rather than forcing them to lists, as
+    # they may be very large (or infinite)
+    if isinstance(obj, (QuerySet, types.GeneratorType)):
+        pp_iterable(obj, *args, **kwargs)
+        return
     
     if isinstance(obj, (dict, list, tuple, set)):
         pprint.pprint(obj, *args, **kwargs)
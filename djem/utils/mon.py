@@ -1,27 +1,694 @@
-from __future__ import division, print_function
+from __future__ import absolute_import, division, print_function
 
+import atexit
+import cProfile
 import datetime
+import functools
+import inspect
+import itertools
+import linecache
 import logging
+import math
+import os
+import pstats
+import re
 import resource
+import sys
+import tempfile
+import threading
+import time
+import timeit
 
-from django.db import connection
+import django
+from django.db import connection, connections
 
 from djem.utils.table import Table
 
+try:
+    from contextvars import ContextVar
+except ImportError:  # pragma: no cover
+    # Python < 3.7
+    ContextVar = None
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    # Python 2
+    tracemalloc = None
+
+if sys.version_info >= (3, 5):
+    from djem.utils import _mon_async
+else:  # pragma: no cover
+    _mon_async = None
+
+logger = logging.getLogger('djem.mon')
+
+# Use a high-resolution, monotonic clock for wall time. Fall back on the best
+# available timer for the platform on Python versions without perf_counter_ns.
+try:
+    _get_wall_ns = time.perf_counter_ns
+except AttributeError:  # pragma: no cover
+    def _get_wall_ns():
+        
+        return int(timeit.default_timer() * 1e9)
+
+
+def _get_cpu_clock(name):
+    """
+    Return a function returning the CPU time, in nanoseconds, consumed by
+    either the current process ("process") or the current thread ("thread").
+    Return None if the clock is not available on the current platform or
+    Python version.
+    """
+    
+    try:
+        return getattr(time, '{0}_time_ns'.format(name))
+    except AttributeError:  # pragma: no cover
+        pass
+    
+    # Python < 3.7
+    clock = getattr(time, '{0}_time'.format(name), None)
+    if clock is None:  # pragma: no cover
+        return None
+    
+    return lambda: int(clock() * 1e9)  # pragma: no cover
+
+
+CPU_CLOCKS = {
+    'process': _get_cpu_clock('process'),
+    'thread': _get_cpu_clock('thread')
+}
+
+# The names of the statistics tracked by M, and the format used to output each
+STAT_FORMATS = {
+    'time': '{0:.4f}',
+    'cpu': '{0:.4f}',
+    'queries': '{0}',
+    'query_time': '{0:.4f}',
+    'mem': '{0:.3f}',
+    'peak_mem': '{0:.3f}'
+}
+
+
+# The keys under which the aggregates of each statistic are stored, built
+# once rather than on every update
+_STAT_KEYS = dict(
+    (stat, ('min_' + stat, 'max_' + stat, 'avg_' + stat, 'total_' + stat))
+    for stat in STAT_FORMATS
+)
+
+# The statistics for which M keeps a histogram, allowing percentiles to be
+# reported, and the divisor to convert the recorded integer values to the
+# units of the statistic (nanoseconds to seconds for time), if any
+HISTOGRAM_STATS = {
+    'time': 1e9,
+    'queries': None
+}
+
+# The percentiles reported for statistics with histograms
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class Histogram(object):
+    """
+    A compact histogram of non-negative integers, using log-linear buckets:
+    values are bucketed exactly up to ``2 ** precision``, after which each
+    power of two is divided into ``2 ** precision`` equal buckets. This bounds
+    the relative error of reported percentiles to ``2 ** -precision`` and
+    the number of buckets to a few thousand, regardless of how many values
+    are recorded. Only non-empty buckets are stored.
+    
+    Histograms with the same precision can be merged, e.g. to combine the
+    statistics of multiple threads or processes.
+    """
+    
+    __slots__ = ('precision', 'count', 'buckets')
+    
+    def __init__(self, precision=6):
+        
+        self.precision = precision
+        self.count = 0
+        self.buckets = {}
+    
+    def _get_index(self, value):
+        
+        precision = self.precision
+        
+        exponent = value.bit_length() - precision - 1
+        if exponent < 0:
+            return value
+        
+        # The top precision + 1 bits of the value identify the bucket within
+        # the power of two
+        return ((exponent + 1) << precision) + (value >> exponent) - (1 << precision)
+    
+    def _get_value(self, index):
+        """
+        Return the midpoint of the range of values in the bucket with the
+        given index.
+        """
+        
+        precision = self.precision
+        
+        exponent = (index >> precision) - 1
+        if exponent < 0:
+            return index
+        
+        lower = ((index & ((1 << precision) - 1)) | (1 << precision)) << exponent
+        
+        return lower + ((1 << exponent) - 1) // 2
+    
+    def add(self, value):
+        
+        index = self._get_index(int(value))
+        buckets = self.buckets
+        
+        buckets[index] = buckets.get(index, 0) + 1
+        self.count += 1
+    
+    def merge(self, other):
+        
+        if other.precision != self.precision:
+            raise ValueError('Cannot merge histograms of different precisions.')
+        
+        buckets = self.buckets
+        for index, count in other.buckets.items():
+            buckets[index] = buckets.get(index, 0) + count
+        
+        self.count += other.count
+    
+    def to_dict(self):
+        """
+        Return a JSON-serialisable representation of the histogram, which can
+        be restored with from_dict().
+        """
+        
+        return {
+            'precision': self.precision,
+            'buckets': sorted(self.buckets.items())
+        }
+    
+    @classmethod
+    def from_dict(cls, data):
+        
+        histogram = cls(data['precision'])
+        
+        for index, count in data['buckets']:
+            histogram.buckets[index] = count
+            histogram.count += count
+        
+        return histogram
+    
+    def get_percentile(self, percentile):
+        """
+        Return the approximate value at the given percentile (0-100) of the
+        recorded values, or None if there are none.
+        """
+        
+        if not self.count:
+            return None
+        
+        # The 1-based rank of the value at the percentile
+        rank = max(1, int(math.ceil(percentile / 100 * self.count)))
+        seen = 0
+        
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                break
+        
+        return self._get_value(index)
+
 
 def _get_mem_mb():
     
     return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1000
 
 
-def _get_query_count():
+class MemoryProbe(object):
+    """
+    Base class for memory probes, which measure memory usage, in MB, for
+    monitors.
+    """
+    
+    # The name of the probe in MEMORY_PROBES
+    name = None
+    
+    # Whether the probe can measure peak memory usage within a block
+    has_peak = False
+    
+    def read(self):
+        """
+        Return the current memory usage.
+        """
+        
+        raise NotImplementedError()
+    
+    def start(self):
+        """
+        Begin measuring a block of code. Return the memory usage at the start
+        of the block.
+        """
+        
+        return self.read()
+    
+    def stop(self):
+        """
+        Finish measuring the most recently started block of code. Return a
+        tuple of the memory usage at the end of the block and the peak memory
+        usage within the block, or None if peaks are not supported.
+        """
+        
+        return self.read(), None
+
+
+class MaxRSSProbe(MemoryProbe):
+    """
+    Measure the peak resident set size of the process. As this never
+    decreases, it only detects blocks of code that increase the peak.
+    """
+    
+    name = 'maxrss'
+    
+    def read(self):
+        
+        return _get_mem_mb()
+
+
+class RSSProbe(MemoryProbe):
+    """
+    Measure the current resident set size of the process, as reported by
+    /proc/self/statm. Fall back on the peak resident set size on platforms
+    without /proc.
+    """
+    
+    name = 'rss'
+    STATM_PATH = '/proc/self/statm'
+    
+    def __init__(self):
+        
+        self.page_size = resource.getpagesize()
+        
+        try:
+            self.read()
+        except (IOError, OSError, IndexError, ValueError):  # pragma: no cover
+            self.read = _get_mem_mb
+    
+    def read(self):
+        
+        # Use the low-level file API, as this is read twice per monitor run.
+        # The file cannot be kept open, as /proc/self would continue to refer
+        # to the original process after a fork.
+        fd = os.open(self.STATM_PATH, os.O_RDONLY)
+        try:
+            pages = int(os.read(fd, 128).split()[1])
+        finally:
+            os.close(fd)
+        
+        return pages * self.page_size / 1e6
+
+
+class TracemallocProbe(MemoryProbe):
+    """
+    Measure memory allocated by Python, using tracemalloc. Tracing is started
+    on first use, if not already started, and is not stopped again. It adds
+    significant overhead to all allocations while running.
+    
+    On Python 3.9+, also measure the peak allocated memory within each block,
+    taking into account nested blocks.
+    """
+    
+    name = 'tracemalloc'
+    
+    def __init__(self, nframes=1):
+        
+        if tracemalloc is None:  # pragma: no cover
+            raise RuntimeError('TracemallocProbe requires the tracemalloc module.')
+        
+        self.nframes = nframes
+        self.has_peak = hasattr(tracemalloc, 'reset_peak')
+        
+        # Track the highest peak seen by each running block, as the peak
+        # counter is reset at the start of every block
+        self._peaks = []
+    
+    def read(self):
+        
+        return tracemalloc.get_traced_memory()[0] / 1e6
+    
+    def start(self):
+        
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.nframes)
+        
+        current, peak = tracemalloc.get_traced_memory()
+        
+        if self.has_peak:
+            # Record the peak reached by the enclosing block so far, before
+            # resetting the counter
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+            
+            self._peaks.append(current)
+            tracemalloc.reset_peak()
+        
+        return current / 1e6
+    
+    def stop(self):
+        
+        current, peak = tracemalloc.get_traced_memory()
+        
+        if not self.has_peak or not self._peaks:
+            return current / 1e6, None
+        
+        peak = max(self._peaks.pop(), peak)
+        
+        if self._peaks:
+            self._peaks[-1] = max(self._peaks[-1], peak)
+        
+        return current / 1e6, peak / 1e6
+    
+    def take_snapshot(self):
+        
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.nframes)
+        
+        return tracemalloc.take_snapshot()
+    
+    def compare_snapshots(self, start_snapshot, end_snapshot):
+        """
+        Return a list of (call site, size difference in bytes, count
+        difference) tuples describing the allocations made between the two
+        snapshots, largest first.
+        """
+        
+        sites = []
+        
+        for stat in end_snapshot.compare_to(start_snapshot, 'lineno'):
+            if stat.size_diff <= 0:
+                continue
+            
+            frame = stat.traceback[0]
+            line = linecache.getline(frame.filename, frame.lineno).strip()
+            site = '{0}:{1} {2}'.format(frame.filename, frame.lineno, line)
+            
+            sites.append((site, stat.size_diff, stat.count_diff))
+        
+        return sites
+
+
+MEMORY_PROBES = {
+    'maxrss': MaxRSSProbe,
+    'rss': RSSProbe,
+    'tracemalloc': TracemallocProbe
+}
+
+_probe_instances = {}
+
+
+def get_memory_probe(probe):
+    """
+    Return a MemoryProbe instance for the given probe name (a key of
+    MEMORY_PROBES). Instances are shared, as some probes track state across
+    nested blocks. MemoryProbe instances are returned as-is.
+    """
+    
+    if isinstance(probe, MemoryProbe):
+        return probe
+    
+    try:
+        return _probe_instances[probe]
+    except KeyError:
+        pass
+    
+    try:
+        probe_class = MEMORY_PROBES[probe]
+    except KeyError:
+        raise TypeError('Unknown memory probe "{0}".'.format(probe))
+    
+    instance = _probe_instances[probe] = probe_class()
+    
+    return instance
+
+
+# Substitutions normalising SQL statements into fingerprints: literal and
+# placeholder parameters become "?", and lists of them (e.g. in IN clauses)
+# collapse to "?, ...", so statements differing only in their parameters
+# share a fingerprint
+_FINGERPRINT_SUBS = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\?(?:\s*,\s*\?)+'), '?, ...'),
+    (re.compile(r'\s+'), ' '),
+)
+
+_fingerprints = {}
+
+
+def get_sql_fingerprint(sql):
+    """
+    Return the fingerprint of the given SQL statement: the statement with its
+    parameters normalised, such that statements differing only in their
+    parameters (including the number of values in an IN clause) share a
+    fingerprint.
+    """
+    
+    try:
+        return _fingerprints[sql]
+    except KeyError:
+        pass
+    
+    fingerprint = sql
+    for pattern, replacement in _FINGERPRINT_SUBS:
+        fingerprint = pattern.sub(replacement, fingerprint)
+    
+    fingerprint = fingerprint.strip()
+    
+    if len(_fingerprints) >= 1000:
+        _fingerprints.clear()
+    
+    _fingerprints[sql] = fingerprint
+    
+    return fingerprint
+
+
+# Frames in these files are skipped when locating the code that issued a
+# query, as are frames in Django itself
+_LOCATION_SKIP_FILES = set((
+    __file__.rstrip('co'),  # mon.py, not mon.pyc
+    os.path.join(os.path.dirname(__file__), '_mon_async.py'),
+))
+_LOCATION_SKIP_DIR = os.path.dirname(django.__file__) + os.sep
+
+_skip_location_cache = {}
+
+
+def _skip_location(filename):
+    
+    try:
+        return _skip_location_cache[filename]
+    except KeyError:
+        skip = _skip_location_cache[filename] = (
+            filename in _LOCATION_SKIP_FILES or filename.startswith(_LOCATION_SKIP_DIR)
+        )
+        return skip
+
+
+def _get_query_location():
+    """
+    Return a "filename:line (function)" string identifying the innermost frame
+    on the stack outside of Django and this module, i.e. the code that issued
+    the query currently being executed, or None if there is no such frame.
+    """
+    
+    frame = sys._getframe(1)
+    
+    while frame is not None:
+        code = frame.f_code
+        if not _skip_location(code.co_filename):
+            return '{0}:{1} ({2})'.format(code.co_filename, frame.f_lineno, code.co_name)
+        
+        frame = frame.f_back
+    
+    return None
+
+
+class _LocalVar(object):
+    """
+    A minimal stand-in for ContextVar on Python versions without it, storing
+    a value per thread.
+    """
+    
+    def __init__(self, name, default):
+        
+        self.name = name
+        self._default = default
+        self._local = threading.local()
     
-    return len(connection.queries)
+    def get(self):
+        
+        return getattr(self._local, 'value', self._default)
+    
+    def set(self, value):
+        
+        self._local.value = value
+
 
+if ContextVar is None:  # pragma: no cover
+    ContextVar = _LocalVar
 
-def _get_stat_table_data(monitor, stat):
+
+class QueryLog(object):
+    """
+    Capture the database queries executed on all connections while any
+    monitor is running. Queries are captured using execute wrappers, so they
+    are recorded regardless of the ``DEBUG`` setting. On Django versions
+    without execute wrappers, only the number of queries is available, using
+    ``connection.queries``, which requires ``DEBUG`` to be enabled.
+    
+    Individual queries are not retained. Instead, each is passed to the
+    monitors running in the current context as it is executed, to be folded
+    into their statistics, so memory use does not grow with the number of
+    queries. As for Mon, the running monitors are tracked per thread and
+    asyncio task, so concurrent tasks do not record each other's queries.
+    
+    As database connections are per-thread, so are query logs. Use
+    get_query_log() to access the log for the current thread.
+    """
+    
+    # The monitors capturing queries in the current context, as an immutable
+    # tuple, so asyncio tasks inherit their creator's monitors without
+    # sharing later changes with it (see Mon._running)
+    _monitors = ContextVar('djem_query_monitors', default=())
+    
+    def __init__(self):
+        
+        self._users = 0
+        self._wrapped = []
+    
+    @property
+    def supported(self):
+        
+        return hasattr(connection, 'execute_wrappers')
     
-    if stat not in ('time', 'queries', 'mem'):
+    @property
+    def monitors(self):
+        
+        return self._monitors.get()
+    
+    def __call__(self, execute, sql, params, many, context):
+        
+        start = _get_wall_ns()
+        
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = _get_wall_ns() - start
+            
+            # The location is only determined if a monitor needs it, as
+            # walking the stack is comparatively expensive
+            fingerprint = get_sql_fingerprint(sql)
+            location = None
+            for m in self._monitors.get():
+                location = m._record_query(sql, fingerprint, duration, location)
+    
+    def install(self, monitor):
+        """
+        Start capturing queries for the given monitor, in the current
+        context. Install the execute wrappers, if not already installed for
+        another monitor in the current thread.
+        """
+        
+        self._monitors.set(self._monitors.get() + (monitor, ))
+        self._users += 1
+        
+        if self._users > 1 or not self.supported:
+            return
+        
+        for conn in connections.all():
+            conn.execute_wrappers.append(self)
+            self._wrapped.append(conn)
+    
+    def uninstall(self, monitor):
+        """
+        Stop capturing queries for the given monitor, and remove the execute
+        wrappers if no other monitors in the current thread remain.
+        """
+        
+        self._monitors.set(tuple(m for m in self._monitors.get() if m is not monitor))
+        self._users -= 1
+        
+        if self._users > 0:
+            return
+        
+        for conn in self._wrapped:
+            conn.execute_wrappers.remove(self)
+        
+        self._users = 0
+        self._wrapped = []
+    
+    def get_count(self, monitor):
+        """
+        Return the number of queries recorded by the given monitor during its
+        current run, or the total number of queries recorded by Django if
+        execute wrappers are not supported.
+        """
+        
+        if not self.supported:
+            return len(connection.queries)
+        
+        return monitor._run_queries
+    
+    def get_total_ns(self, monitor):
+        """
+        Return the total time, in nanoseconds, of the queries recorded by the
+        given monitor during its current run.
+        """
+        
+        return monitor._run_query_ns
+
+
+_query_logs = threading.local()
+
+
+def get_query_log():
+    """
+    Return the QueryLog for the current thread.
+    """
+    
+    try:
+        return _query_logs.log
+    except AttributeError:
+        log = _query_logs.log = QueryLog()
+        return log
+
+
+STAT_TABLE_HEADINGS = (
+    ('Name', 'Minimum', 'Maximum', 'Average')
+    + tuple('p{0:g}'.format(p) for p in PERCENTILES)
+    + ('Total', 'Count', '%')
+)
+
+
+def _get_percentile_cells(m, stat):
+    
+    try:
+        histogram = m.histograms[stat]
+    except KeyError:
+        return ('-', ) * len(PERCENTILES)
+    
+    if not histogram.count:
+        return ('-', ) * len(PERCENTILES)
+    
+    stat_format = STAT_FORMATS[stat]
+    
+    return tuple(stat_format.format(m.get_percentile(stat, p)) for p in PERCENTILES)
+
+
+def _get_stat_table_data(monitor, stat, machine_readable=False):
+    
+    if stat not in STAT_FORMATS:
         raise TypeError('Unknown statistic "{0}".'.format(stat))
     
     total_key = 'total_{0}'.format(stat)
@@ -30,17 +697,31 @@ def _get_stat_table_data(monitor, stat):
     avg_key = 'avg_{0}'.format(stat)
     
     # Each statistic should be formatted slightly differently
-    stat_format_map = {
-        'time': '{0:.4f}',
-        'queries': '{0}',
-        'mem': '{0:.3f}'
-    }
-    
-    stat_format = stat_format_map[stat]
+    stat_format = STAT_FORMATS[stat]
     
     data = []
     
-    def build_data(parent, _indent=0):
+    def add_row(m, name, pc, indent=''):
+        
+        row = (
+            name,
+            stat_format.format(m.stats[min_key]),
+            stat_format.format(m.stats[max_key]),
+            stat_format.format(m.stats[avg_key])
+        ) + _get_percentile_cells(m, stat) + (
+            stat_format.format(m.stats[total_key]),
+            m.stats['count'],
+            '{0}{1:.2f}%'.format(indent, pc),
+        )
+        
+        if machine_readable:
+            # Include the statistic, so the data for all statistics can be
+            # combined into a single set of rows
+            row = (stat, ) + row
+        
+        data.append(row)
+    
+    def build_data(parent, _indent=0, _path=''):
         
         parent_total = parent.stats[total_key]
         
@@ -55,33 +736,52 @@ def _get_stat_table_data(monitor, stat):
             else:
                 pc = 0
             
-            data.append((
-                '{0}{1}'.format(' ' * _indent, child.name),
-                stat_format.format(child.stats[min_key]),
-                stat_format.format(child.stats[max_key]),
-                stat_format.format(child.stats[avg_key]),
-                stat_format.format(total),
-                child.stats['count'],
-                '{0}{1:.2f}%'.format(' ' * _indent, pc),
-            ))
+            if machine_readable:
+                # Identify monitors by their full path rather than indentation
+                path = '{0}/{1}'.format(_path, child.name)
+                add_row(child, path, pc)
+            else:
+                path = None
+                add_row(child, '{0}{1}'.format(' ' * _indent, child.name), pc, ' ' * _indent)
             
             if child.children:
-                build_data(child, _indent=_indent + 1)
+                build_data(child, _indent=_indent + 1, _path=path)
     
-    build_data(monitor)
+    if machine_readable:
+        # Include the root monitor itself, as there are no totals in the footer
+        add_row(monitor, monitor.name, 100)
+    
+    build_data(monitor, _path=monitor.name)
     
     return data
 
 
-def _get_stat_table(monitor, title, stats):
+def _get_machine_readable_stat_table(monitors, stats, format):
+    
+    t = Table(('Statistic', ) + STAT_TABLE_HEADINGS)
+    
+    for monitor in monitors:
+        for stat in stats:
+            t.add_rows(_get_stat_table_data(monitor, stat, machine_readable=True))
+    
+    return '\n'.join(t.iter_format(format))
+
+
+def _get_stat_table(monitor, title, stats, format='text'):
+    
+    if format != 'text':
+        return _get_machine_readable_stat_table((monitor, ), stats, format)
     
     # Include a separator between the output for each statistic, using a
     # combination of blank rows and a row to act as a title for the statistic
     include_separator = len(stats) > 1
     stat_heading_map = {
         'time': 'Timing',
+        'cpu': 'CPU Time',
         'queries': 'Queries',
-        'mem': 'Memory'
+        'query_time': 'Query Time',
+        'mem': 'Memory',
+        'peak_mem': 'Peak Memory'
     }
     
     footer = 'Totals: {0}'.format(monitor.get_total_string(include_name=False))
@@ -93,7 +793,7 @@ def _get_stat_table(monitor, title, stats):
     
     # Add headings manually, as standard row, to avoid doubling the HRs used
     # in the stat titles below
-    t.add_row(['Name', 'Minimum', 'Maximum', 'Average', 'Total', 'Count', '%'])
+    t.add_row(STAT_TABLE_HEADINGS)
     
     if not include_separator:
         t.add_row(Table.HR)
@@ -109,264 +809,1262 @@ def _get_stat_table(monitor, title, stats):
     return t.build_table()
 
 
+def _measure_overhead(start, stop, get_cpu_ns, iterations, repeat):
+    """
+    Return the best wall and CPU time, in nanoseconds, of ``repeat`` batches
+    of ``iterations`` calls of ``start()`` and ``stop()``, per iteration,
+    along with the monitor returned by ``stop()``.
+    """
+    
+    wall_ns = cpu_ns = None
+    
+    for i in range(repeat):
+        start_wall = _get_wall_ns()
+        start_cpu = get_cpu_ns()
+        
+        for j in range(iterations):
+            start()
+            m = stop()
+        
+        batch_wall = _get_wall_ns() - start_wall
+        batch_cpu = get_cpu_ns() - start_cpu
+        
+        if wall_ns is None or batch_wall < wall_ns:
+            wall_ns = batch_wall
+        
+        if cpu_ns is None or batch_cpu < cpu_ns:
+            cpu_ns = batch_cpu
+    
+    return wall_ns / iterations, cpu_ns / iterations, m
+
+
+def _set_overhead(wall_ns, cpu_ns, m):
+    
+    # The time measured by the monitor itself is attributed to it, not to its
+    # parent, so is not overhead
+    stats = m.stats
+    M.overhead_ns = max(0, int(wall_ns - stats['min_time'] * 1e9))
+    M.overhead_cpu_ns = max(0, int(cpu_ns - stats['min_cpu'] * 1e9))
+    
+    return M.overhead_ns, M.overhead_cpu_ns
+
+
+def calibrate(iterations=1000, repeat=5, cpu_clock='process', mem_probe='rss'):
+    """
+    Measure the fixed wall and CPU time that starting and stopping a monitor
+    adds to the run of its parent, on the current machine, with the given
+    monitor configuration. Store the results as M.overhead_ns and
+    M.overhead_cpu_ns, to be excluded from the times of parent monitors, and
+    return them. The best of ``repeat`` batches of ``iterations`` runs of an
+    empty monitor is used. See also Mon.calibrate().
+    """
+    
+    M.overhead_ns = M.overhead_cpu_ns = 0
+    
+    # Run within a parent, as nested monitors are, to include the cost of
+    # maintaining the parent's counters and exclude that of installing the
+    # query log, which only the outermost monitor pays
+    parent = M('calibration', cpu_clock=None, mem_probe=mem_probe)
+    m = M('calibration', parent, cpu_clock=cpu_clock, mem_probe=mem_probe)
+    
+    def start():
+        
+        m.reset()
+        m.start()
+    
+    def stop():
+        
+        m.stop()
+        return m
+    
+    get_cpu_ns = CPU_CLOCKS.get(cpu_clock) or (lambda: 0)
+    
+    parent.start()
+    wall_ns, cpu_ns, m = _measure_overhead(start, stop, get_cpu_ns, iterations, repeat)
+    parent.stop()
+    
+    return _set_overhead(wall_ns, cpu_ns, m)
+
+
+def get_aggregate_stats(monitors, format='text'):
+    """
+    Return the aggregated statistics of the given top-level monitors, slowest
+    first. By default, return a text table per monitor. Alternatively,
+    ``format`` can be 'csv', 'json' or 'markdown' to return a single
+    machine-readable table.
+    """
+    
+    monitors = sorted(monitors, key=lambda m: m.stats['total_time'], reverse=True)
+    
+    if not monitors:
+        return ''
+    
+    if format != 'text':
+        return _get_machine_readable_stat_table(monitors, monitors[0]._get_all_stats(), format)
+    
+    tables = []
+    for m in monitors:
+        title = 'Aggregated Results: {0}'.format(m.name)
+        tables.append(_get_stat_table(m, title, m._get_all_stats()))
+    
+    return '\n\n'.join(tables)
+
+
+def _get_func_label(func):
+    
+    filename, line, name = func
+    
+    return '{0}:{1}({2})'.format(os.path.basename(filename), line, name).replace(';', ':')
+
+
+def _get_collapsed_stacks(stats):
+    """
+    Return a dictionary mapping semicolon-separated call stacks to the time,
+    in microseconds, spent in the last function of each, derived from the
+    given pstats.Stats. This is the "collapsed stack" format used to render
+    flame graphs. As cProfile only records the time of each caller/callee
+    pair, the time of deeper calls is apportioned between the paths leading
+    to them according to the time of each path.
+    """
+    
+    entries = stats.stats
+    callees = {}
+    
+    for func, (cc, nc, tt, ct, callers) in entries.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge))
+    
+    stacks = {}
+    
+    def visit(func, stack, tt, ct):
+        
+        stack = stack + (_get_func_label(func), )
+        
+        time = int(tt * 1e6)
+        if time > 0:
+            key = ';'.join(stack)
+            stacks[key] = stacks.get(key, 0) + time
+        
+        total_ct = entries[func][3]
+        if not total_ct:
+            return
+        
+        ratio = ct / total_ct
+        
+        for callee, edge in callees.get(func, ()):
+            # Do not follow recursive calls
+            if _get_func_label(callee) not in stack:
+                visit(callee, stack, edge[2] * ratio, edge[3] * ratio)
+    
+    for func, (cc, nc, tt, ct, callers) in entries.items():
+        if not callers:
+            visit(func, (), tt, ct)
+    
+    return stacks
+
+
 class M(object):
+    """
+    A monitor, measuring the wall time, CPU time, database queries and memory
+    usage of a block of code, and aggregating statistics for them across
+    multiple runs. ``cpu_clock`` can be "process" to measure the CPU time of
+    the whole process, "thread" to measure that of the current thread only, or
+    None to not measure CPU time.
+    
+    Histograms of the wall time and number of queries of each run are kept,
+    to report percentiles (see PERCENTILES).
+    
+    ``mem_probe`` is the name of the memory probe to use (a key of
+    MEMORY_PROBES) or a MemoryProbe instance. When using the "tracemalloc"
+    probe, ``trace_allocations`` can be given as the number of top
+    allocating call sites to record for each run, and report in
+    get_top_allocations().
+    
+    Queries are captured on all database connections (see QueryLog), and the
+    number and total time of queries for each distinct SQL statement are
+    recorded, up to ``MAX_SQL_STATEMENTS`` statements per monitor, for
+    reporting the slowest and most repeated queries.
+    
+    Statements are also grouped by fingerprint (see get_sql_fingerprint()),
+    recording the most times each fingerprint was executed in a single run,
+    and the location of the code that issued it. A fingerprint executed more
+    than ``REPEATED_QUERY_THRESHOLD`` times in a single run of a top-level
+    monitor, typically the result of an N+1 query problem, is logged as a
+    warning. Set it to None to disable the warnings.
+    
+    The wall and CPU time of each run excludes the overhead of starting and
+    stopping any nested monitors, as measured by calibrate(). This is 0 until
+    calibrate() is called.
+    
+    Runs can be profiled with cProfile by passing ``profile=True`` to
+    start(). The profiles of all profiled runs are combined in memory, and
+    saved to ``profile_dir`` by save_profiles(), which is called when the
+    process exits. Each is saved as a pstats file and as collapsed stacks for
+    rendering flame graphs, named after the path of the monitor and the
+    process ID. Monitors nested within a profiled monitor are included in its
+    profile, rather than being profiled separately.
+    """
     
-    def __init__(self, name, parent=None):
+    MAX_SQL_STATEMENTS = 1000
+    REPEATED_QUERY_THRESHOLD = 10
+    
+    # The fixed wall and CPU time, in nanoseconds, added to a parent
+    # monitor's run by each run of a nested monitor (see calibrate())
+    overhead_ns = 0
+    overhead_cpu_ns = 0
+    
+    # The directory in which to save the profiles of profiled monitors
+    profile_dir = os.path.join(tempfile.gettempdir(), 'djem_profiles')
+    
+    # The combined profiles of all profiled runs in this process, keyed by
+    # profile path, so runs of different instances of the same monitor (e.g.
+    # via Mon or the mon decorator) are combined. Also track those with runs
+    # not yet saved, and the process they belong to, so those inherited by a
+    # forked process are discarded rather than saved again.
+    _profiles = {}
+    _unsaved_profiles = set()
+    _profiles_pid = None
+    _profiles_lock = threading.Lock()
+    
+    def __init__(self, name, parent=None, cpu_clock='process', mem_probe='rss', trace_allocations=0):
+        
+        self.name = name
+        
+        self.parent = parent
+        self.children = {}
+        self.active_children = 0
+        
+        # The number of runs of nested monitors during the current run
+        self.nested_runs = 0
+        
+        if parent:
+            parent.children[name] = self
+        
+        if cpu_clock is not None and cpu_clock not in CPU_CLOCKS:
+            raise TypeError('Unknown CPU clock "{0}".'.format(cpu_clock))
+        
+        self.cpu_clock = cpu_clock
+        self._get_cpu_ns = CPU_CLOCKS.get(cpu_clock)
+        
+        self.mem_probe = get_memory_probe(mem_probe)
+        self.trace_allocations = trace_allocations
+        self.allocation_sites = {}
+        self._start_snapshot = None
+        
+        self.profile_stats = None
+        self._profiler = None
+        
+        self.errors = 0
+        self.histograms = dict((stat, Histogram()) for stat in HISTOGRAM_STATS)
+        
+        self.sql_stats = {}
+        self.fingerprint_stats = {}
+        self._run_fingerprints = {}
+        self._run_queries = 0
+        self._run_query_ns = 0
+        self._query_log = None
+        
+        self.stats = None
+        
+        self.start_time = None
+        self.end_time = None
+        self.start_cpu = None
+        self.end_cpu = None
+        self.start_mem = None
+        self.end_mem = None
+        self.peak_mem = None
+        self.start_queries = None
+        self.end_queries = None
+        self.start_query_ns = None
+        self.end_query_ns = None
+    
+    def _update_stats(self):
+        
+        if self.end_time is None:
+            raise Exception('Monitor not started or still running.')
+        
+        values = {
+            'time': self.get_seconds(),
+            'cpu': self.get_cpu_seconds(),
+            'mem': self.get_mem_usage(),
+            'peak_mem': self.get_peak_mem_usage(),
+            'queries': self.get_query_count(),
+            'query_time': self.get_query_seconds()
+        }
+        
+        histograms = self.histograms
+        histograms['time'].add(self.get_nanoseconds())
+        histograms['queries'].add(values['queries'])
+        
+        stats = self.stats
+        
+        if stats is None:
+            stats = self.stats = {'count': 1}
+            
+            for stat, value in values.items():
+                for key in _STAT_KEYS[stat]:
+                    stats[key] = value
+            
+            return
+        
+        count = stats['count'] = stats['count'] + 1
+        
+        for stat, value in values.items():
+            min_key, max_key, avg_key, total_key = _STAT_KEYS[stat]
+            
+            total = stats[total_key] = stats[total_key] + value
+            stats[avg_key] = total / count
+            
+            if value < stats[min_key]:
+                stats[min_key] = value
+            
+            if value > stats[max_key]:
+                stats[max_key] = value
+    
+    def _read_cpu_ns(self):
+        
+        get_cpu_ns = self._get_cpu_ns
+        if get_cpu_ns is None:
+            return 0
+        
+        return get_cpu_ns()
+    
+    def start(self, profile=False):
+        """
+        Start the monitor. If ``profile`` is True, profile the run, unless
+        a parent monitor is already being profiled.
+        """
+        
+        if self.parent:
+            self.parent.active_children += 1
+        
+        self.nested_runs = 0
+        
+        self._run_fingerprints = {}
+        self._run_queries = 0
+        self._run_query_ns = 0
+        
+        query_log = self._query_log = get_query_log()
+        query_log.install(self)
+        self.start_queries = query_log.get_count(self)
+        self.start_query_ns = query_log.get_total_ns(self)
+        
+        if self.trace_allocations:
+            self._start_snapshot = self.mem_probe.take_snapshot()
+        
+        self.start_mem = self.mem_probe.start()
+        self.start_cpu = self._read_cpu_ns()
+        self.start_time = _get_wall_ns()
+        
+        if profile and not self._is_profiled():
+            self._start_profiler()
+    
+    def stop(self, error=False):
+        """
+        Stop the monitor and update its statistics. If ``error`` is True,
+        the monitored block of code raised an exception, and is counted in
+        ``errors``.
+        """
+        
+        profiler = self._profiler
+        if profiler is not None:
+            profiler.disable()
+        
+        self.end_time = _get_wall_ns()
+        self.end_cpu = self._read_cpu_ns()
+        self.end_mem, self.peak_mem = self.mem_probe.stop()
+        
+        if profiler is not None:
+            self._profiler = None
+            self._add_profile(profiler)
+        
+        if self.trace_allocations:
+            self._record_allocations()
+        
+        query_log = self._query_log
+        self.end_queries = query_log.get_count(self)
+        self.end_query_ns = query_log.get_total_ns(self)
+        query_log.uninstall(self)
+        self._record_fingerprints()
+        
+        if error:
+            self.errors += 1
+        
+        self._update_stats()
+        
+        parent = self.parent
+        if parent:
+            parent.active_children -= 1
+            parent.nested_runs += self.nested_runs + 1
+        
+        if self.active_children > 0:
+            raise Exception('Cannot end a monitor with running children.')
+    
+    def _is_profiled(self):
+        
+        m = self
+        while m is not None:
+            if m._profiler is not None:
+                return True
+            
+            m = m.parent
+        
+        return False
+    
+    def _start_profiler(self):
+        
+        profiler = cProfile.Profile()
+        
+        try:
+            profiler.enable()
+        except ValueError:  # pragma: no cover
+            # Another profiler is already active (Python 3.12+)
+            return
+        
+        self._profiler = profiler
+    
+    def get_path(self):
+        """
+        Return the names of this monitor and its ancestors, from the top-level
+        monitor down, separated by slashes.
+        """
+        
+        names = []
+        
+        m = self
+        while m is not None:
+            names.append(m.name)
+            m = m.parent
+        
+        return '/'.join(reversed(names))
+    
+    def get_profile_path(self, extension):
+        """
+        Return the path of the file to which the profile of the monitor is
+        saved, with the given extension ("pstats" or "collapsed"). The path
+        includes the current process ID, so multiple processes sharing
+        ``profile_dir`` do not overwrite each other's profiles.
+        """
+        
+        names = self.get_path().split('/')
+        filename = '.'.join(re.sub(r'[^\w-]+', '_', name) for name in names)
+        
+        return os.path.join(self.profile_dir, '{0}.{1}.{2}'.format(filename, os.getpid(), extension))
+    
+    def _add_profile(self, profiler):
+        
+        path = self.get_profile_path('pstats')
+        pid = os.getpid()
+        cls = M
+        
+        with cls._profiles_lock:
+            if cls._profiles_pid != pid:
+                if cls._profiles_pid is None:
+                    atexit.register(cls.save_profiles)
+                
+                cls._profiles_pid = pid
+                cls._profiles.clear()
+                cls._unsaved_profiles.clear()
+            
+            stats = cls._profiles.get(path)
+            if stats is None:
+                stats = cls._profiles[path] = pstats.Stats(profiler)
+            else:
+                stats.add(profiler)
+            
+            cls._unsaved_profiles.add(path)
+            self.profile_stats = stats
+    
+    @classmethod
+    def save_profiles(cls):
+        """
+        Save the combined profiles of all monitors profiled in this process
+        that have been run since they were last saved, as both pstats files
+        and collapsed stacks. Return the paths of the saved pstats files.
+        """
+        
+        with cls._profiles_lock:
+            if cls._profiles_pid != os.getpid():
+                # Inherited from the parent of a forked process
+                return []
+            
+            paths = sorted(cls._unsaved_profiles)
+            cls._unsaved_profiles.clear()
+            
+            for path in paths:
+                stats = cls._profiles[path]
+                
+                try:
+                    os.makedirs(os.path.dirname(path))
+                except OSError:
+                    # Already exists
+                    pass
+                
+                stats.dump_stats(path)
+                
+                stacks = _get_collapsed_stacks(stats)
+                collapsed_path = '{0}.collapsed'.format(os.path.splitext(path)[0])
+                with open(collapsed_path, 'w') as f:
+                    for stack in sorted(stacks):
+                        f.write('{0} {1}\n'.format(stack, stacks[stack]))
+        
+        return paths
+    
+    def get_mem_usage(self):
+        
+        if self.start_mem is None:
+            raise Exception('Monitor not started.')
+        
+        end_mem = self.end_mem
+        if end_mem is None:
+            end_mem = self.mem_probe.read()
+        
+        return end_mem - self.start_mem
+    
+    def get_peak_mem_usage(self):
+        """
+        Return the peak memory usage within the monitored block, relative to
+        the usage at the start of the block. For memory probes that cannot
+        measure peaks, this is the same as get_mem_usage().
+        """
+        
+        if self.peak_mem is None:
+            return self.get_mem_usage()
+        
+        return self.peak_mem - self.start_mem
+    
+    def _record_allocations(self):
+        
+        probe = self.mem_probe
+        end_snapshot = probe.take_snapshot()
+        
+        sites = probe.compare_snapshots(self._start_snapshot, end_snapshot)
+        self._start_snapshot = None
+        
+        # Aggregate the allocations of the top call sites across runs
+        allocation_sites = self.allocation_sites
+        for site, size, count in sites[:self.trace_allocations]:
+            total_size, total_count = allocation_sites.get(site, (0, 0))
+            allocation_sites[site] = (total_size + size, total_count + count)
+    
+    def get_top_allocations(self, limit=10):
+        """
+        Return a list of up to ``limit`` (call site, size in bytes, count)
+        tuples describing the call sites that allocated the most memory
+        across all runs of the monitor, largest first. Only available when
+        using ``trace_allocations``.
+        """
+        
+        sites = sorted(self.allocation_sites.items(), key=lambda s: s[1][0], reverse=True)
+        
+        return [(site, size, count) for site, (size, count) in sites[:limit]]
+    
+    def get_query_count(self):
+        
+        if self.start_queries is None:
+            raise Exception('Monitor not started.')
+        
+        end_queries = self.end_queries
+        if end_queries is None:
+            end_queries = self._query_log.get_count(self)
+        
+        return end_queries - self.start_queries
+    
+    def get_query_seconds(self):
+        """
+        Return the total time, in seconds, spent executing database queries,
+        either between the start and end of the monitor or since it was
+        started, if still running.
+        """
+        
+        if self.start_query_ns is None:
+            raise Exception('Monitor not started.')
+        
+        end_query_ns = self.end_query_ns
+        if end_query_ns is None:
+            end_query_ns = self._query_log.get_total_ns(self)
+        
+        return (end_query_ns - self.start_query_ns) / 1e9
+    
+    def _record_query(self, sql, fingerprint, duration, location):
+        """
+        Record a query executed during the current run, as captured by the
+        QueryLog. ``location`` is the location of the code that issued the
+        query, or None if it has not yet been determined. Return the
+        location, determining it if necessary, for reuse by other monitors.
+        Both per-statement and per-fingerprint statistics are limited to
+        ``MAX_SQL_STATEMENTS`` entries, keeping memory use bounded.
+        """
+        
+        self._run_queries += 1
+        self._run_query_ns += duration
+        
+        max_statements = self.MAX_SQL_STATEMENTS
+        
+        run_fingerprints = self._run_fingerprints
+        try:
+            run_fingerprints[fingerprint][0] += 1
+        except KeyError:
+            if len(run_fingerprints) < max_statements:
+                if location is None:
+                    location = _get_query_location()
+                
+                run_fingerprints[fingerprint] = [1, location]
+        
+        sql_stats = self.sql_stats
+        try:
+            stat = sql_stats[sql]
+        except KeyError:
+            if len(sql_stats) >= max_statements:
+                return location
+            
+            stat = sql_stats[sql] = [0, 0, 0]
+        
+        stat[0] += 1
+        stat[1] += duration
+        if duration > stat[2]:
+            stat[2] = duration
+        
+        return location
+    
+    def _record_fingerprints(self):
+        
+        run_fingerprints = self._run_fingerprints
+        self._run_fingerprints = {}
+        
+        self._merge_fingerprint_stats(run_fingerprints)
+        self._warn_repeated_queries(run_fingerprints)
+    
+    def _warn_repeated_queries(self, run_fingerprints):
+        
+        # Only warn for top-level monitors, as nested monitors record the
+        # same queries as their parents
+        threshold = self.REPEATED_QUERY_THRESHOLD
+        if threshold is None or self.parent is not None:
+            return
+        
+        for fingerprint, (count, location) in run_fingerprints.items():
+            if count > threshold:
+                logger.warning(
+                    'Query executed %s times in a single run of "%s", issued by %s: %s',
+                    count, self.name, location, fingerprint
+                )
+    
+    def _merge_fingerprint_stats(self, other_stats):
+        
+        fingerprint_stats = self.fingerprint_stats
+        
+        for fingerprint, (count, location) in other_stats.items():
+            try:
+                stat = fingerprint_stats[fingerprint]
+            except KeyError:
+                if len(fingerprint_stats) < self.MAX_SQL_STATEMENTS:
+                    fingerprint_stats[fingerprint] = [count, location]
+            else:
+                if count > stat[0]:
+                    stat[0] = count
+                    stat[1] = location
+    
+    def _get_sql_stats(self, key, limit):
+        
+        stats = sorted(self.sql_stats.items(), key=key, reverse=True)[:limit]
+        
+        return [(sql, count, total / 1e9, longest / 1e9) for sql, (count, total, longest) in stats]
+    
+    def get_slowest_queries(self, limit=5):
+        """
+        Return a list of up to ``limit`` (SQL, count, total seconds, maximum
+        seconds) tuples for the SQL statements with the longest single
+        execution time across all runs of the monitor, slowest first.
+        """
+        
+        return self._get_sql_stats(lambda s: s[1][2], limit)
+    
+    def get_repeated_queries(self, limit=5):
+        """
+        Return a list of up to ``limit`` (SQL, count, total seconds, maximum
+        seconds) tuples for the SQL statements executed the most times across
+        all runs of the monitor, most repeated first.
+        """
+        
+        return self._get_sql_stats(lambda s: s[1][0], limit)
+    
+    def get_repeated_fingerprints(self, threshold=None):
+        """
+        Return a list of (fingerprint, count, location) tuples for the SQL
+        fingerprints executed more than ``threshold`` times in a single run
+        of the monitor, most repeated first. ``count`` is the most times the
+        fingerprint was executed in a single run, and ``location`` identifies
+        the code that issued it in that run. ``threshold`` defaults to
+        ``REPEATED_QUERY_THRESHOLD``.
+        """
+        
+        if threshold is None:
+            threshold = self.REPEATED_QUERY_THRESHOLD or 0
+        
+        repeated = [
+            (fingerprint, count, location)
+            for fingerprint, (count, location) in self.fingerprint_stats.items()
+            if count > threshold
+        ]
+        
+        return sorted(repeated, key=lambda r: r[1], reverse=True)
+    
+    def get_nanoseconds(self):
+        """
+        Return the wall time elapsed, in nanoseconds, either between the start
+        and end of the monitor or since it was started, if still running. The
+        overhead of any nested monitors is excluded.
+        """
+        
+        if self.start_time is None:
+            raise Exception('Monitor not started.')
+        
+        end_time = self.end_time
+        if end_time is None:
+            end_time = _get_wall_ns()
+        
+        return max(0, end_time - self.start_time - self.nested_runs * self.overhead_ns)
+    
+    def get_cpu_nanoseconds(self):
+        """
+        Return the CPU time consumed, in nanoseconds, either between the start
+        and end of the monitor or since it was started, if still running.
+        Always 0 if the monitor does not measure CPU time. The overhead of any
+        nested monitors is excluded.
+        """
+        
+        if self.start_cpu is None:
+            raise Exception('Monitor not started.')
         
-        self.name = name
+        if self._get_cpu_ns is None:
+            return 0
         
-        self.parent = parent
-        self.children = {}
-        self.active_children = 0
+        end_cpu = self.end_cpu
+        if end_cpu is None:
+            end_cpu = self._read_cpu_ns()
         
-        if parent:
-            parent.children[name] = self
+        return max(0, end_cpu - self.start_cpu - self.nested_runs * self.overhead_cpu_ns)
+    
+    def get_runtime(self):
         
-        self.stats = None
+        return datetime.timedelta(microseconds=self.get_nanoseconds() / 1000)
+    
+    def get_seconds(self):
+        
+        return self.get_nanoseconds() / 1e9
+    
+    def get_cpu_seconds(self):
+        
+        return self.get_cpu_nanoseconds() / 1e9
+    
+    def reset(self):
+        """
+        Reset the start and end times to allow reuse.
+        Do not clear statistics.
+        """
         
-        self.start_time = None
-        self.end_time = None
         self.start_mem = None
         self.end_mem = None
+        self.peak_mem = None
+        self.start_time = None
+        self.end_time = None
+        self.start_cpu = None
+        self.end_cpu = None
         self.start_queries = None
         self.end_queries = None
+        self.start_query_ns = None
+        self.end_query_ns = None
     
-    def _update_stats(self):
-        
-        if not self.end_time:
-            raise Exception('Monitor not started or still running.')
+    def _merge_stats(self, other_stats):
         
         stats = self.stats
-        runtime = self.get_seconds()
-        mem_usage = self.get_mem_usage()
-        query_count = self.get_query_count()
         
         if stats is None:
-            self.stats = {
-                'count': 1,
-                
-                'min_time': runtime,
-                'max_time': runtime,
-                'avg_time': runtime,
-                'total_time': runtime,
-                
-                'min_mem': mem_usage,
-                'max_mem': mem_usage,
-                'avg_mem': mem_usage,
-                'total_mem': mem_usage,
-                
-                'min_queries': query_count,
-                'max_queries': query_count,
-                'avg_queries': query_count,
-                'total_queries': query_count
-            }
-            
+            self.stats = dict(other_stats)
             return
         
-        stats['count'] += 1
+        stats['count'] += other_stats['count']
         
-        stats['total_time'] += runtime
-        stats['total_mem'] += mem_usage
-        stats['total_queries'] += query_count
+        for key, value in other_stats.items():
+            if key.startswith('min_'):
+                stats[key] = min(stats[key], value)
+            elif key.startswith('max_'):
+                stats[key] = max(stats[key], value)
+            elif key.startswith('total_'):
+                stats[key] += value
+                stats['avg_{0}'.format(key[6:])] = stats[key] / stats['count']
+    
+    def _merge_sql_stats(self, other):
         
-        stats['avg_time'] = stats['total_time'] / stats['count']
-        stats['avg_mem'] = stats['total_mem'] / stats['count']
-        stats['avg_queries'] = stats['total_queries'] / stats['count']
+        sql_stats = self.sql_stats
         
-        if runtime < stats['min_time']:
-            stats['min_time'] = runtime
+        for sql, (count, total, longest) in other.sql_stats.items():
+            try:
+                stat = sql_stats[sql]
+            except KeyError:
+                if len(sql_stats) < self.MAX_SQL_STATEMENTS:
+                    sql_stats[sql] = [count, total, longest]
+            else:
+                stat[0] += count
+                stat[1] += total
+                stat[2] = max(stat[2], longest)
+    
+    def merge(self, other):
+        """
+        Merge the aggregated statistics of another monitor, and those of its
+        children, recursively, into this monitor. Children missing from this
+        monitor are created.
+        """
         
-        if mem_usage < stats['min_mem']:
-            stats['min_mem'] = mem_usage
+        if other.stats is not None:
+            self._merge_stats(other.stats)
         
-        if query_count < stats['min_queries']:
-            stats['min_queries'] = query_count
+        self.errors += other.errors
         
-        if runtime > stats['max_time']:
-            stats['max_time'] = runtime
+        for stat, histogram in other.histograms.items():
+            self.histograms[stat].merge(histogram)
         
-        if mem_usage > stats['max_mem']:
-            stats['max_mem'] = mem_usage
+        self._merge_sql_stats(other)
+        self._merge_fingerprint_stats(other.fingerprint_stats)
         
-        if query_count > stats['max_queries']:
-            stats['max_queries'] = query_count
-    
-    def start(self):
+        allocation_sites = self.allocation_sites
         
-        if self.parent:
-            self.parent.active_children += 1
+        for site, (size, count) in other.allocation_sites.items():
+            total_size, total_count = allocation_sites.get(site, (0, 0))
+            allocation_sites[site] = (total_size + size, total_count + count)
         
-        self.start_time = datetime.datetime.now()
-        self.start_queries = _get_query_count()
-        self.start_mem = _get_mem_mb()
+        for name, other_child in other.children.items():
+            try:
+                child = self.children[name]
+            except KeyError:
+                child = M(name, self, cpu_clock=other_child.cpu_clock, mem_probe=other_child.mem_probe)
+            
+            child.merge(other_child)
     
-    def stop(self):
+    def get_percentile(self, stat, percentile):
+        """
+        Return the approximate value of the given statistic ("time" or
+        "queries") at the given percentile (0-100) across all runs of the
+        monitor, or None if it has not been run.
+        """
         
-        self.end_mem = _get_mem_mb()
-        self.end_time = datetime.datetime.now()
-        self.end_queries = _get_query_count()
-        self._update_stats()
+        value = self.histograms[stat].get_percentile(percentile)
+        divisor = HISTOGRAM_STATS[stat]
         
-        if self.parent:
-            self.parent.active_children -= 1
+        if value is None or divisor is None:
+            return value
         
-        if self.active_children > 0:
-            raise Exception('Cannot end a monitor with running children.')
+        return value / divisor
     
-    def get_mem_usage(self):
-        
-        if self.start_mem is None:
-            raise Exception('Monitor not started.')
-        
-        end_mem = self.end_mem
-        if not end_mem:
-            end_mem = _get_mem_mb()
+    def to_dict(self):
+        """
+        Return a JSON-serialisable representation of the aggregated
+        statistics of the monitor and its children, recursively, which can be
+        restored with from_dict(). The state of any current run is not
+        included.
+        """
         
-        return end_mem - self.start_mem
+        return {
+            'name': self.name,
+            'cpu_clock': self.cpu_clock,
+            'mem_probe': self.mem_probe.name,
+            'stats': self.stats,
+            'errors': self.errors,
+            'histograms': dict((stat, h.to_dict()) for stat, h in self.histograms.items()),
+            'sql_stats': self.sql_stats,
+            'fingerprint_stats': self.fingerprint_stats,
+            'allocation_sites': self.allocation_sites,
+            'children': [child.to_dict() for child in self.children.values()]
+        }
     
-    def get_query_count(self):
-        
-        if self.start_queries is None:
-            raise Exception('Monitor not started.')
+    @classmethod
+    def from_dict(cls, data, parent=None):
         
-        end_queries = self.end_queries
-        if not end_queries:
-            end_queries = _get_query_count()
+        mem_probe = data['mem_probe']
+        if mem_probe not in MEMORY_PROBES:
+            # A custom probe, which cannot be restored
+            mem_probe = 'rss'
         
-        return end_queries - self.start_queries
-    
-    def get_runtime(self):
+        m = cls(data['name'], parent, cpu_clock=data['cpu_clock'], mem_probe=mem_probe)
         
-        if self.start_time is None:
-            raise Exception('Monitor not started.')
+        m.stats = data['stats']
+        m.errors = data['errors']
+        m.sql_stats = dict((sql, list(stat)) for sql, stat in data['sql_stats'].items())
+        m.fingerprint_stats = dict((f, list(stat)) for f, stat in data['fingerprint_stats'].items())
+        m.allocation_sites = dict((site, tuple(a)) for site, a in data['allocation_sites'].items())
         
-        end_time = self.end_time
-        if not end_time:
-            end_time = datetime.datetime.now()
+        for stat, histogram in data['histograms'].items():
+            m.histograms[stat] = Histogram.from_dict(histogram)
         
-        return end_time - self.start_time
-    
-    def get_seconds(self):
+        for child in data['children']:
+            cls.from_dict(child, m)
         
-        return self.get_runtime().total_seconds()
+        return m
     
-    def reset(self):
+    def get_total_string(self, include_name=True):
         """
-        Reset the start and end times to allow reuse.
-        Do not clear statistics.
+        Return a summary of the most recent run of the monitor. For monitors
+        that have not been run themselves, but have had statistics merged
+        into them (e.g. aggregates), summarise the totals across all runs.
         """
         
-        self.start_mem = None
-        self.end_mem = None
-        self.start_time = None
-        self.end_time = None
-    
-    def get_total_string(self, include_name=True):
+        template = '{0:.4f} seconds ({1:.4f} CPU), {2} queries, {3:.3f}MB of RAM'
         
-        totals = '{0:.4f} seconds, {1} queries, {2:.3f}MB of RAM'.format(
-            self.get_seconds(),
-            self.get_query_count(),
-            self.get_mem_usage()
-        )
+        if self.start_time is None and self.stats is not None:
+            stats = self.stats
+            totals = template.format(
+                stats['total_time'],
+                stats['total_cpu'],
+                stats['total_queries'],
+                stats['total_mem']
+            )
+        else:
+            totals = template.format(
+                self.get_seconds(),
+                self.get_cpu_seconds(),
+                self.get_query_count(),
+                self.get_mem_usage()
+            )
+        
+        if self.errors:
+            totals = '{0}, {1} error(s)'.format(totals, self.errors)
         
         if include_name:
             totals = '{0}: {1}'.format(self.name, totals)
         
         return totals
     
-    def print_mem_stats(self):
+    def _get_time_stats(self):
+        
+        if self.cpu_clock is None:
+            return ('time', )
+        
+        return ('time', 'cpu')
+    
+    def _get_mem_stats(self):
+        
+        if not self.mem_probe.has_peak:
+            return ('mem', )
+        
+        return ('mem', 'peak_mem')
+    
+    def _get_all_stats(self):
+        
+        return self._get_time_stats() + ('queries', 'query_time') + self._get_mem_stats()
+    
+    def print_allocation_stats(self, limit=10):
+        
+        t = Table(['Call site', 'Size (KB)', 'Count'], title='Top Allocations: {0}'.format(self.name))
+        
+        for site, size, count in self.get_top_allocations(limit):
+            t.add_row((site, '{0:.1f}'.format(size / 1000), count))
+        
+        print(t.build_table())
+    
+    def print_mem_stats(self, format='text'):
         
-        if not self.children:
+        if not self.children and format == 'text':
             print('{0}: {1:.3f}MB of RAM'.format(
                 self.name,
                 self.get_mem_usage()
             ))
             return
         
-        print(_get_stat_table(self, 'Memory Usage Results', ('mem',)))
+        print(_get_stat_table(self, 'Memory Usage Results', self._get_mem_stats(), format))
     
-    def print_query_stats(self):
+    def print_query_stats(self, format='text'):
         
-        if not self.children:
-            print('{0}: {1} queries'.format(
+        if not self.children and format == 'text':
+            print('{0}: {1} queries ({2:.4f} seconds)'.format(
                 self.name,
-                self.get_query_count()
+                self.get_query_count(),
+                self.get_query_seconds()
             ))
             return
         
-        print(_get_stat_table(self, 'Query Results', ('queries',)))
+        print(_get_stat_table(self, 'Query Results', ('queries', 'query_time'), format))
+    
+    def print_sql_stats(self, limit=5):
+        """
+        Print tables of the slowest and most repeated SQL statements executed
+        across all runs of the monitor, and of any SQL fingerprints repeated
+        more than ``REPEATED_QUERY_THRESHOLD`` times in a single run.
+        """
+        
+        headings = ['SQL', 'Count', 'Total Time', 'Maximum Time']
+        tables = (
+            ('Slowest Queries', self.get_slowest_queries(limit)),
+            ('Most Repeated Queries', self.get_repeated_queries(limit))
+        )
+        
+        for title, rows in tables:
+            t = Table(headings, title='{0}: {1}'.format(title, self.name))
+            
+            for sql, count, total, longest in rows:
+                t.add_row((sql, count, '{0:.4f}'.format(total), '{0:.4f}'.format(longest)))
+            
+            print(t.build_table())
+        
+        repeated = self.get_repeated_fingerprints()[:limit]
+        if repeated:
+            t = Table(
+                ['Fingerprint', 'Count Per Run', 'Location'],
+                title='Repeated Fingerprints: {0}'.format(self.name)
+            )
+            t.add_rows(repeated)
+            
+            print(t.build_table())
     
-    def print_time_stats(self):
+    def print_time_stats(self, format='text'):
         
-        if not self.children:
-            print('{0}: {1:.4f} seconds'.format(
+        if not self.children and format == 'text':
+            print('{0}: {1:.4f} seconds ({2:.4f} CPU)'.format(
                 self.name,
-                self.get_seconds()
+                self.get_seconds(),
+                self.get_cpu_seconds()
             ))
             return
         
-        print(_get_stat_table(self, 'Timing Results', ('time',)))
+        print(_get_stat_table(self, 'Timing Results', self._get_time_stats(), format))
     
-    def print_stats(self):
+    def print_stats(self, format='text'):
+        """
+        Print statistics for this monitor and its children. By default, print
+        a text table. Alternatively, ``format`` can be 'csv', 'json' or
+        'markdown' to print machine-readable output.
+        """
         
-        if not self.children:
+        if not self.children and format == 'text':
             print(self.get_total_string())
             return
         
-        print(_get_stat_table(self, 'Monitor Results', ('time', 'queries', 'mem')))
+        print(_get_stat_table(self, 'Monitor Results', self._get_all_stats(), format))
     
     def __str__(self):
         
-        if not self.end_time:
+        if self.end_time is None:
             return '{0}: Running'.format(self.name)
         
         return self.get_total_string()
 
 
-class Mon(object):
+_MonBase = _mon_async.AsyncMonMixin if _mon_async else object
+
+
+class Mon(_MonBase):
+    """
+    A registry of running monitors. Monitors are tracked per thread and per
+    asyncio task, so monitors started concurrently do not become children of
+    each other. When a top-level monitor is stopped, its tree is merged into
+    an aggregated tree of the same name, shared by all threads and tasks.
+    
+    Instances monitor a block of code as a context manager, including with
+    ``async with`` on Python 3.5+::
+    
+        with Mon('name'):
+            ...
+    """
+    
+    # The monitors running in the current context, as an immutable tuple of
+    # (name, monitor) pairs in the order they were started. Being immutable,
+    # asyncio tasks inherit their creator's running monitors without sharing
+    # later changes with it.
+    _running = ContextVar('djem_mon_running', default=())
+    
+    # Aggregated trees of all stopped top-level monitors, by name. If
+    # max_aggregates is set, top-level monitors with new names are merged
+    # into a single OVERFLOW_NAME tree once that many trees exist.
+    aggregate = {}
+    max_aggregates = None
+    OVERFLOW_NAME = '(other)'
+    _aggregate_lock = threading.Lock()
+    
+    # The CPU clock and memory probe used by new monitors (see M)
+    cpu_clock = 'process'
+    mem_probe = 'rss'
+    
+    def __init__(self, name, profile=False):
+        
+        self.name = name
+        self.profile = profile
+    
+    def __enter__(self):
+        
+        self.start(self.name, profile=self.profile)
+        
+        return self.get_last()
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        
+        self.stop(self.name, error=exc_type is not None)
+    
+    @classmethod
+    def calibrate(cls, iterations=1000, repeat=5):
+        """
+        As for calibrate(), but measure the overhead of monitors started and
+        stopped via Mon, as by the ``mon`` decorator and Mon context
+        managers. Call it before starting any monitors.
+        """
+        
+        M.overhead_ns = M.overhead_cpu_ns = 0
+        
+        get_cpu_ns = CPU_CLOCKS.get(cls.cpu_clock) or (lambda: 0)
+        
+        cls.start('calibration')
+        wall_ns, cpu_ns, m = _measure_overhead(
+            functools.partial(cls.start, 'calibration_child'),
+            functools.partial(cls.stop, 'calibration_child'),
+            get_cpu_ns, iterations, repeat
+        )
+        cls.stop('calibration')
+        cls.pop_aggregate('calibration')
+        
+        return _set_overhead(wall_ns, cpu_ns, m)
     
-    monitors = {}
+    @classmethod
+    def get_monitors(cls):
+        """
+        Return a dictionary of the monitors running in the current context,
+        by name.
+        """
+        
+        return dict(cls._running.get())
     
-    last_m = None
+    @classmethod
+    def get_last(cls):
+        """
+        Return the most recently started monitor still running in the current
+        context, or None.
+        """
+        
+        running = cls._running.get()
+        if not running:
+            return None
+        
+        return running[-1][1]
     
     @classmethod
-    def start(cls, name):
+    def start(cls, name, profile=False, cpu_clock=None):
+        """
+        Start a monitor with the given name, nested within the most recently
+        started monitor still running in the current context, if any. If
+        ``profile`` is True, profile the run (see M).
+        
+        ``cpu_clock`` is the CPU clock of the monitor, if it is newly created
+        (see M). By default, it is that of the parent monitor, if any, or
+        ``Mon.cpu_clock``.
+        """
+        
+        running = cls._running.get()
+        last_m = running[-1][1] if running else None
         
-        if name in cls.monitors:
+        if any(n == name for n, m in running):
             print('Warning: Starting a monitor which has not been ended ({0})'.format(name))
         
         # Re-use an existing monitor with the same name on the same parent, if
         # there is one (this allows the same monitor object to build up stats).
         try:
-            m = cls.last_m.children[name]
+            m = last_m.children[name]
         except (AttributeError, KeyError):
-            m = M(name, cls.last_m)
+            if cpu_clock is None:
+                cpu_clock = cls.cpu_clock if last_m is None else last_m.cpu_clock
+            
+            m = M(name, last_m, cpu_clock=cpu_clock, mem_probe=cls.mem_probe)
         else:
             m.reset()  # for re-use
         
-        cls.monitors[name] = m
-        
         # Remember this monitor as the most recently started. It will become
         # the parent of the next monitor that is started.
-        cls.last_m = m
+        cls._running.set(running + ((name, m), ))
         
-        m.start()
+        m.start(profile)
     
     @classmethod
-    def stop(cls, name):
+    def stop(cls, name, error=False):
         
-        try:
-            m = cls.monitors[name]
-        except KeyError:
+        running = cls._running.get()
+        
+        # Find the most recently started monitor with the given name
+        for i in range(len(running) - 1, -1, -1):
+            if running[i][0] == name:
+                break
+        else:
             raise Exception('Attempted to end a monitor that was never started!')
         
-        m.stop()
+        m = running[i][1]
+        
+        try:
+            m.stop(error)
+        finally:
+            # Always forget the monitor, even if it could not be stopped
+            # cleanly, so it does not affect subsequent monitors
+            cls._running.set(running[:i] + running[i + 1:])
         
-        cls.last_m = m.parent
-        del cls.monitors[name]
+        if not m.parent:
+            cls._aggregate(m)
         
         return m
     
+    @classmethod
+    def _aggregate(cls, m):
+        
+        name = m.name
+        max_aggregates = cls.max_aggregates
+        
+        with cls._aggregate_lock:
+            if max_aggregates is not None and name not in cls.aggregate and len(cls.aggregate) >= max_aggregates:
+                name = cls.OVERFLOW_NAME
+            
+            try:
+                aggregate = cls.aggregate[name]
+            except KeyError:
+                aggregate = cls.aggregate[name] = M(name, cpu_clock=m.cpu_clock, mem_probe=m.mem_probe)
+            
+            aggregate.merge(m)
+    
+    @classmethod
+    def print_aggregate_stats(cls, name, format='text'):
+        """
+        Print the aggregated statistics of all runs, across all threads and
+        tasks, of the top-level monitor with the given name.
+        """
+        
+        with cls._aggregate_lock:
+            m = cls.aggregate[name]
+            print(_get_stat_table(m, 'Aggregated Results', m._get_all_stats(), format))
+    
+    @classmethod
+    def get_aggregate_stats(cls, format='text'):
+        """
+        Return the aggregated statistics of all top-level monitors in the
+        current process. See get_aggregate_stats().
+        """
+        
+        with cls._aggregate_lock:
+            return get_aggregate_stats(cls.aggregate.values(), format)
+    
+    @classmethod
+    def export_aggregates(cls):
+        """
+        Return a list of the aggregated trees of all top-level monitors, as
+        JSON-serialisable dictionaries (see M.to_dict()).
+        """
+        
+        with cls._aggregate_lock:
+            return [m.to_dict() for m in cls.aggregate.values()]
+    
+    @classmethod
+    def pop_aggregate(cls, name):
+        """
+        Remove and return the aggregated tree of the top-level monitor with
+        the given name, or None if there is none. Subsequent runs of the
+        monitor start a new aggregated tree.
+        """
+        
+        with cls._aggregate_lock:
+            return cls.aggregate.pop(name, None)
+    
     @classmethod
     def start_qlog(cls):
         
@@ -390,34 +2088,227 @@ class Mon(object):
     @classmethod
     def reset(cls):
         
-        cls.monitors.clear()
-        cls.last_m = None
+        cls._running.set(())
+        
+        with cls._aggregate_lock:
+            cls.aggregate.clear()
 
 
-def mon(name, allow_recursion=False):
+def _wrap_function(fn, start, stop, sample=None):
     
-    def decorator(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
         
-        def wrapper(*args, **kwargs):
-            
-            n = name
-            
-            if allow_recursion:
-                i = 1
-                while n in Mon.monitors:
-                    n = '_'.join((n, str(i)))
-                    i += 1
-            
-            Mon.start(n)
+        if sample is not None and not sample():
+            return fn(*args, **kwargs)
+        
+        n = start()
+        error = True
+        
+        try:
             result = fn(*args, **kwargs)
-            m = Mon.stop(n)
+            error = False
+            return result
+        finally:
+            stop(n, error)
+    
+    return wrapper
+
+
+def _wrap_generator_function(fn, start, stop, sample=None):  # pragma: no cover
+    
+    # Python 2 only, where generators cannot be delegated to with
+    # "yield from". Values passed to send() and throw() are not passed
+    # through to the wrapped generator.
+    
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        
+        if sample is not None and not sample():
+            for value in fn(*args, **kwargs):
+                yield value
             
-            # Only print stats if there is not a parent monitor - this monitor's
-            # stats will be reported in its output if there is
-            if not m.parent:
-                m.print_stats()
+            return
+        
+        n = start()
+        error = True
+        
+        try:
+            for value in fn(*args, **kwargs):
+                yield value
             
-            return result
+            error = False
+        except GeneratorExit:
+            # Closed before being exhausted, not an error
+            error = False
+            raise
+        finally:
+            stop(n, error)
+    
+    return wrapper
+
+
+def _wrap(fn, start, stop, sample):
+    
+    if _mon_async and _mon_async.iscoroutinefunction(fn):
+        return _mon_async.wrap_coroutine_function(fn, start, stop, sample)
+    
+    if inspect.isgeneratorfunction(fn):
+        if _mon_async:
+            return _mon_async.wrap_generator_function(fn, start, stop, sample)
+        
+        return _wrap_generator_function(fn, start, stop, sample)  # pragma: no cover
+    
+    return _wrap_function(fn, start, stop, sample)
+
+
+def log_stats(m):
+    """
+    Log a table of the statistics of the given monitor to the "djem.mon"
+    logger, at INFO level. The default reporter of Sampler.
+    """
+    
+    logger.info('%s', _get_stat_table(m, 'Monitor Results', m._get_all_stats()))
+
+
+class Sampler(object):
+    """
+    Decide which calls of a function decorated with ``mon`` are monitored,
+    and periodically report the aggregated statistics of those that are.
+    
+    If ``rate`` is given, 1 in every ``rate`` calls is monitored. If
+    ``interval`` is given, at most one call every ``interval`` seconds is
+    monitored. Otherwise, every call is monitored.
+    
+    Monitored calls that are not nested within another monitor are
+    aggregated in ``Mon.aggregate``, which is passed to ``reporter``, and
+    then discarded, at most every ``flush_interval`` seconds. Nested calls
+    are reported as part of their parent monitor. Any statistics not yet
+    reported are flushed when the process exits.
+    """
+    
+    def __init__(self, name, rate=None, interval=None, flush_interval=60, reporter=log_stats):
+        
+        self.name = name
+        self.reporter = reporter
+        self.flush_interval_ns = int(flush_interval * 1e9)
+        self._next_flush = _get_wall_ns() + self.flush_interval_ns
+        
+        # Flushes are otherwise only triggered by monitored calls, so the
+        # final calls of the process would never be reported
+        atexit.register(self.flush)
+        
+        # Bind the cheapest possible check for the configured sampling mode,
+        # to keep unsampled calls close to the cost of a plain function call
+        if rate is not None:
+            self.rate = rate
+            self._calls = itertools.count(1)
+            self.sample = self._sample_rate
+        elif interval is not None:
+            self.interval_ns = int(interval * 1e9)
+            self._next_sample = 0
+            self.sample = self._sample_interval
+        else:
+            self.sample = None
+    
+    def _sample_rate(self):
+        
+        return not next(self._calls) % self.rate
+    
+    def _sample_interval(self):
+        
+        now = _get_wall_ns()
+        if now < self._next_sample:
+            return False
+        
+        self._next_sample = now + self.interval_ns
+        
+        return True
+    
+    def record(self):
+        """
+        Record that a top-level monitor has stopped, flushing the aggregated
+        statistics if they are due to be reported.
+        """
+        
+        if _get_wall_ns() >= self._next_flush:
+            self.flush()
+    
+    def flush(self):
+        """
+        Report and discard the aggregated statistics, if there are any, and
+        save any profiles of monitored calls (see M.save_profiles()).
+        """
+        
+        self._next_flush = _get_wall_ns() + self.flush_interval_ns
+        
+        m = Mon.pop_aggregate(self.name)
+        if m is not None:
+            self.reporter(m)
+        
+        M.save_profiles()
+
+
+def mon(name, allow_recursion=False, sample_rate=None, sample_interval=None,
+        flush_interval=60, reporter=None, profile=False):
+    """
+    Decorator to monitor each call of the decorated function with Mon,
+    printing the statistics of top-level monitors when they are stopped.
+    Supports regular functions, generator functions (monitoring the whole
+    iteration) and coroutine functions. Calls that raise an exception are
+    counted in the monitor's ``errors``.
+    
+    For use in production code, a sampling mode is enabled by any of
+    ``sample_rate``, ``sample_interval`` or ``reporter``. Only sampled calls
+    are monitored, and statistics are aggregated and passed to ``reporter``
+    periodically rather than printed. See Sampler. The Sampler is available
+    as the ``sampler`` attribute of the decorated function.
+    
+    If ``profile`` is True, each monitored call is profiled (see M).
+    """
+    
+    if sample_rate is not None or sample_interval is not None or reporter is not None:
+        sampler = Sampler(
+            name,
+            rate=sample_rate,
+            interval=sample_interval,
+            flush_interval=flush_interval,
+            reporter=reporter or log_stats
+        )
+    else:
+        sampler = None
+    
+    def start():
+        
+        n = name
+        
+        if allow_recursion:
+            i = 1
+            running = Mon.get_monitors()
+            while n in running:
+                n = '_'.join((n, str(i)))
+                i += 1
+        
+        Mon.start(n, profile=profile)
+        
+        return n
+    
+    def stop(n, error):
+        
+        m = Mon.stop(n, error=error)
+        
+        # Only report stats if there is not a parent monitor - this monitor's
+        # stats will be reported in its output if there is
+        if not m.parent:
+            if sampler:
+                sampler.record()
+            else:
+                m.print_stats()
+    
+    def decorator(fn):
+        
+        wrapper = _wrap(fn, start, stop, sampler.sample if sampler else None)
+        wrapper.sampler = sampler
         
         return wrapper
     
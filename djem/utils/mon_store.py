@@ -0,0 +1,189 @@
+"""
+Shared storage of the aggregated statistics collected by ``Mon``, allowing
+the statistics of multiple processes, e.g. the workers of an application
+server, to be combined and to outlive the processes that collected them.
+"""
+
+from __future__ import absolute_import
+
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+
+from djem.utils.mon import M, Mon
+
+
+class SQLiteStore(object):
+    """
+    Store the aggregated monitor trees of each process in a SQLite database
+    file, shared by all processes on the same machine.
+    """
+    
+    def __init__(self, path, timeout=10):
+        
+        self.path = path
+        self.timeout = timeout
+    
+    def _connect(self):
+        
+        conn = sqlite3.connect(self.path, timeout=self.timeout)
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS djem_mon_trees '
+            '(process TEXT PRIMARY KEY, updated REAL, data TEXT)'
+        )
+        
+        return conn
+    
+    def write(self, process, trees):
+        """
+        Replace the stored trees of the given process with ``trees``, a list
+        of dictionaries as returned by M.to_dict().
+        """
+        
+        data = json.dumps(trees)
+        
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO djem_mon_trees (process, updated, data) VALUES (?, ?, ?)',
+                (process, time.time(), data)
+            )
+    
+    def read(self):
+        """
+        Return a dictionary of monitors, by name, combining the stored trees
+        of all processes.
+        """
+        
+        monitors = {}
+        
+        with closing(self._connect()) as conn:
+            rows = conn.execute('SELECT data FROM djem_mon_trees').fetchall()
+        
+        for data, in rows:
+            for tree in json.loads(data):
+                m = M.from_dict(tree)
+                
+                try:
+                    monitors[m.name].merge(m)
+                except KeyError:
+                    monitors[m.name] = m
+        
+        return monitors
+    
+    def clear(self):
+        
+        with closing(self._connect()) as conn, conn:
+            conn.execute('DELETE FROM djem_mon_trees')
+
+
+class Exporter(object):
+    """
+    Periodically write the aggregated monitor trees of the current process
+    (see ``Mon.aggregate``) to ``store``, every ``interval`` seconds, from a
+    background thread. The trees are also written when the process exits.
+    
+    Each process writes under a unique identifier, so processes forked after
+    the exporter is created, and processes replacing those that have exited,
+    do not overwrite each other's trees. Threads do not survive a fork, so the
+    background thread is restarted in forked processes, e.g. the workers of an
+    application server that loads the application before forking them. The
+    aggregated trees inherited from the parent process are discarded when it
+    is, as they are exported by the parent.
+    """
+    
+    def __init__(self, store, interval=60):
+        
+        self.store = store
+        self.interval = interval
+        
+        self._pid = None
+        self._process_id = None
+        self._thread = None
+        self._thread_pid = None
+        self._stopped = threading.Event()
+        self._fork_hook_registered = False
+    
+    @property
+    def process_id(self):
+        
+        pid = os.getpid()
+        
+        if pid != self._pid:
+            self._pid = pid
+            self._process_id = '{0}:{1}'.format(pid, uuid.uuid4().hex)
+        
+        return self._process_id
+    
+    def export(self):
+        
+        trees = Mon.export_aggregates()
+        
+        if trees:
+            self.store.write(self.process_id, trees)
+    
+    def _run(self):
+        
+        while not self._stopped.wait(self.interval):
+            self.export()
+    
+    def _after_fork(self):
+        
+        # Only restart the thread if it was running in the parent process
+        if self._thread is not None:
+            self.start()
+    
+    def start(self):
+        """
+        Start the background thread, if it is not already running in the
+        current process.
+        """
+        
+        pid = os.getpid()
+        
+        if self._thread is not None:
+            if self._thread_pid == pid:
+                return
+            
+            # The process has been forked since the thread was started, so
+            # the thread (and the state of the event) belong to the parent.
+            # So do the aggregated statistics inherited from it, which the
+            # parent exports itself. Discard them, so they are not exported
+            # again by every forked process. The lock may also have been
+            # held by another thread at the time of the fork.
+            self._stopped = threading.Event()
+            Mon._aggregate_lock = threading.Lock()
+            Mon.aggregate.clear()
+        
+        self._thread = threading.Thread(target=self._run, name='djem-mon-exporter')
+        self._thread.daemon = True
+        self._thread_pid = pid
+        self._thread.start()
+        
+        if not self._fork_hook_registered:
+            self._fork_hook_registered = True
+            atexit.register(self.export)
+            
+            # Python 3.7+ only. Without it, forked processes need to call
+            # start() themselves.
+            if hasattr(os, 'register_at_fork'):
+                os.register_at_fork(after_in_child=self._after_fork)
+    
+    def stop(self):
+        """
+        Stop the background thread, and write the trees a final time.
+        """
+        
+        self._stopped.set()
+        
+        if self._thread is not None:
+            if self._thread_pid == os.getpid():
+                self._thread.join()
+            
+            self._thread = None
+        
+        self.export()
@@ -1,15 +1,128 @@
 from __future__ import division
 
+import json
 import os
+import signal
+import struct
+import sys
 import textwrap
+from collections import OrderedDict
+from itertools import chain, islice
 
+from django.utils import six
 from django.utils.encoding import force_text
 
+try:
+    from shutil import get_terminal_size
+except ImportError:  # pragma: no cover
+    # Python 2
+    get_terminal_size = None
+
+# The width used when it cannot be detected, e.g. when output is not attached
+# to a terminal, such as in web or task queue workers
+DEFAULT_TERMINAL_WIDTH = 80
+
+_terminal_width = None
+_resize_handler_installed = False
+
 
 class NOT_PROVIDED:
     pass
 
 
+def _ioctl_terminal_width():  # pragma: no cover
+    
+    # Only used under Python 2, which lacks shutil.get_terminal_size()
+    try:
+        import fcntl
+        import termios
+        
+        packed = fcntl.ioctl(sys.__stdout__.fileno(), termios.TIOCGWINSZ, b'\0' * 8)
+        columns = struct.unpack('hhhh', packed)[1]
+    except Exception:
+        return DEFAULT_TERMINAL_WIDTH
+    
+    return columns or DEFAULT_TERMINAL_WIDTH
+
+
+def _detect_terminal_width():
+    
+    # An explicit COLUMNS environment variable takes precedence
+    try:
+        columns = int(os.environ['COLUMNS'])
+    except (KeyError, ValueError):
+        columns = 0
+    
+    if columns > 0:
+        return columns
+    
+    if get_terminal_size is None:  # pragma: no cover
+        return _ioctl_terminal_width()
+    
+    return get_terminal_size((DEFAULT_TERMINAL_WIDTH, 24)).columns
+
+
+def _install_resize_handler():
+    """
+    Clear the cached terminal width whenever the terminal is resized, chaining
+    to any previously installed SIGWINCH handler. Signal handlers can only be
+    installed from the main thread, and SIGWINCH is not available on all
+    platforms, in which case the width is simply never invalidated.
+    """
+    
+    global _resize_handler_installed
+    
+    _resize_handler_installed = True
+    
+    if not hasattr(signal, 'SIGWINCH'):  # pragma: no cover
+        return
+    
+    previous_handler = signal.getsignal(signal.SIGWINCH)
+    
+    def handler(signum, frame):
+        
+        clear_terminal_width()
+        
+        if callable(previous_handler):
+            previous_handler(signum, frame)
+    
+    try:
+        signal.signal(signal.SIGWINCH, handler)
+    except ValueError:
+        # Not called from the main thread
+        pass
+
+
+def get_terminal_width():
+    """
+    Return the width of the terminal, in columns. The width is detected
+    in-process (without spawning a subprocess) and cached until the terminal
+    is resized. If output is not attached to a terminal, return
+    DEFAULT_TERMINAL_WIDTH.
+    """
+    
+    global _terminal_width
+    
+    if _terminal_width is None:
+        if not _resize_handler_installed:
+            _install_resize_handler()
+        
+        _terminal_width = _detect_terminal_width()
+    
+    return _terminal_width
+
+
+def clear_terminal_width():
+    """
+    Clear the cached terminal width, forcing it to be detected again on next
+    use.
+    """
+    
+    global _terminal_width
+    
+    _terminal_width = None
+
+
 class RowWrapper(object):
     """
     Helper class for formatting full-width rows such as titles, descriptions and
@@ -77,17 +190,49 @@ class Table(object):
         
         pass
     
+    class _DATA:
+        """
+        Internal row constant marking the position of a data row. The values
+        of data rows are stored by column.
+        """
+        
+        pass
+    
     MIN_COLUMN_WIDTH = 4  # allows for a single character and "..." to indicate truncation
     
+    # The default number of streamed rows used to determine column widths
+    STREAM_SAMPLE_SIZE = 100
+    
+    # The number of added rows to buffer before formatting their values and
+    # transferring them into column storage
+    ROW_BUFFER_SIZE = 1000
+    
+    # Supported output formats and the methods that render them
+    FORMATS = OrderedDict((
+        ('text', 'iter_table'),
+        ('csv', 'iter_csv'),
+        ('json', 'iter_json'),
+        ('markdown', 'iter_markdown')
+    ))
+    
     def __init__(self, headings=None, title=None, footer=None, max_width=FULL_WIDTH):
         
-        self._rows = []
+        # The sequence of rows, with data rows represented by _DATA. The data
+        # rows are kept as given, for the machine-readable output formats,
+        # and their values are also stored per column, pre-formatted as text.
+        # Rows are formatted in batches, once ROW_BUFFER_SIZE rows have been
+        # added since the last batch, or when they are needed.
+        self._layout = []
         self._columns = []
+        self._cells = []
+        self._raw_rows = []
+        self._num_formatted = 0
         
         if headings:
             self.add_headings(headings)
         else:
             self._headings = None
+            self._raw_headings = None
         
         if title:
             self.set_title(title)
@@ -104,9 +249,9 @@ class Table(object):
     def _update_col_metadata(self, col_data, value=NOT_PROVIDED, heading=NOT_PROVIDED):
         
         if value is not NOT_PROVIDED:
-            width = len(force_text(value))
+            width = len(value)
         elif heading is not NOT_PROVIDED:
-            heading = force_text(heading)
+            heading = self._format_value(heading)
             width = 0
             
             col_data['heading'] = heading
@@ -183,55 +328,213 @@ class Table(object):
         cols = self._columns
         
         if not cols:
-            self._columns = [self._update_col_metadata({}, heading=h) for h in headings]
+            for heading in headings:
+                self._update_col_metadata(self._add_column(), heading=heading)
         elif len(cols) != len(headings):
             raise Exception('Number of headings does not match previously given number of columns.')
         else:
             for i, heading in enumerate(headings):
                 self._update_col_metadata(cols[i], heading=heading)
         
-        self._headings = headings
+        self._headings = [c['heading'] for c in self._columns]
+        self._raw_headings = [force_text(h) for h in headings]
     
-    def add_row(self, row):
+    def _format_value(self, value):
         
-        if row is self.BR or row is self.HR:
-            self._rows.append(row)
-            return
+        return force_text(value).replace('\n', '\\n').replace('\r', '\\r')
+    
+    def _add_column(self):
+        
+        col_data = {}
+        
+        self._columns.append(col_data)
+        self._cells.append([])
+        
+        return col_data
+    
+    def _format_row(self, row):
+        """
+        Return the given row with each of its values converted to escaped
+        text, ready for rendering. Each value is stringified only once.
+        Full-width rows and row constants are returned unaltered.
+        """
+        
+        if row is self.BR or row is self.HR or isinstance(row, RowWrapper):
+            return row
         
         if self._columns and len(self._columns) != len(row):
             raise Exception('Number of columns in row does not match previously given rows.')
         
-        for i, value in enumerate(row):
-            try:
-                col_data = self._columns[i]
-            except IndexError:
-                self._columns.append({})
-                col_data = self._columns[i]
-            
+        # Equivalent to calling _format_value() on each value, inlined as this
+        # is called for every row. Most values are already text, so avoid
+        # the comparatively expensive call to force_text() for them.
+        text_type = six.text_type
+        return [
+            (v if type(v) is text_type else force_text(v)).replace('\n', '\\n').replace('\r', '\\r')
+            for v in row
+        ]
+    
+    def _update_widths(self, formatted_row):
+        
+        if not isinstance(formatted_row, list):
+            # Full-width row or row constant
+            return
+        
+        if not self._columns:
+            for value in formatted_row:
+                self._add_column()
+        
+        for col_data, value in zip(self._columns, formatted_row):
             self._update_col_metadata(col_data, value=value)
+    
+    def _truncate(self, value, width):
+        
+        if width > 3:
+            return '{0}...'.format(value[:width - 3])
+        
+        # Too narrow to indicate truncation
+        return value[:width]
+    
+    def _render_row(self, row, table_width, br, hr):
+        """
+        Return a list of the rendered lines for the given formatted row.
+        """
+        
+        if row is self.BR:
+            return [br]
+        elif row is self.HR:
+            return [hr]
+        elif isinstance(row, RowWrapper):
+            return row.get_rows(table_width)
+        
+        row_str = []
+        for i, col in enumerate(self._columns):
+            value = row[i]
+            width = col['render_width']
+            
+            if len(value) > width:
+                value = self._truncate(value, width)
+            
+            row_str.append(value.ljust(width))
+        
+        return ['| {0} |'.format(' | '.join(row_str))]
+    
+    def _iter_data_rows(self):
+        """
+        Generate the rendered lines of the stored data rows. Padding and
+        truncation are applied per column, after which the lines are simply
+        joined.
+        """
+        
+        padded_columns = []
+        
+        for col, values in zip(self._columns, self._cells):
+            width = col['render_width']
+            
+            if col.get('raw_width', 0) <= width:
+                # No values require truncation
+                padded = [v.ljust(width) for v in values]
+            else:
+                truncate = self._truncate
+                padded = [truncate(v, width) if len(v) > width else v.ljust(width) for v in values]
+            
+            padded_columns.append(padded)
+        
+        for row in zip(*padded_columns):
+            yield '| {0} |'.format(' | '.join(row))
+    
+    def _flush_row_buffer(self):
+        """
+        Format the values of buffered data rows as escaped text, transfer them
+        into column storage, and update the raw width of each column.
+        """
+        
+        raw_rows = self._raw_rows
+        start = self._num_formatted
+        
+        if start == len(raw_rows):
+            return
+        
+        text_type = six.text_type
+        
+        # Format a column of values at a time, as most columns are entirely
+        # text, without any values requiring escaping. Both can be determined
+        # for the whole column without looping over its values in Python.
+        for col_data, cells, values in zip(self._columns, self._cells, zip(*raw_rows[start:])):
+            if set(map(type, values)) != {text_type}:
+                values = [v if type(v) is text_type else force_text(v) for v in values]
+            
+            joined = ''.join(values)
+            if '\n' in joined or '\r' in joined:
+                values = [v.replace('\n', '\\n').replace('\r', '\\r') for v in values]
+            
+            cells.extend(values)
+            
+            width = max(map(len, values))
+            if width > col_data.get('raw_width', 0):
+                col_data['raw_width'] = width
+        
+        self._num_formatted = len(raw_rows)
+    
+    def add_row(self, row):
         
-        self._rows.append(row)
+        self.add_rows((row, ))
     
     def add_full_width_row(self, value, alignment='left'):
         
         row = RowWrapper(value, alignment)
         
-        self._rows.append(row)
+        self._layout.append(row)
     
     def add_rows(self, rows):
         
+        # Bind everything used per row up front, as this is called for every
+        # row added to the table
+        BR, HR, DATA = self.BR, self.HR, self._DATA
+        layout = self._layout
+        raw_rows = self._raw_rows
+        buffer_size = self.ROW_BUFFER_SIZE
+        num_columns = len(self._columns)
+        
         for row in rows:
-            self.add_row(row)
+            if row is BR or row is HR or isinstance(row, RowWrapper):
+                layout.append(row)
+                continue
+            
+            # Copy the row, as it is not formatted until later
+            row = tuple(row)
+            
+            if not num_columns:
+                for value in row:
+                    self._add_column()
+                
+                num_columns = len(self._columns)
+            elif len(row) != num_columns:
+                raise Exception('Number of columns in row does not match previously given rows.')
+            
+            layout.append(DATA)
+            raw_rows.append(row)
+            
+            if len(raw_rows) - self._num_formatted >= buffer_size:
+                self._flush_row_buffer()
     
     def get_rows(self):
         
+        self._flush_row_buffer()
+        
         rows = [self.HR]
         
         if self._headings:
             rows.append(self._headings)
             rows.append(self.HR)
         
-        rows.extend(self._rows)
+        data_rows = iter(zip(*self._cells))
+        for row in self._layout:
+            if row is self._DATA:
+                row = list(next(data_rows))
+            
+            rows.append(row)
+        
         rows.append(self.HR)
         
         return rows
@@ -241,8 +544,7 @@ class Table(object):
         outer_max_width = self._raw_max_width
         
         if outer_max_width is self.FULL_WIDTH:
-            term_rows, term_columns = os.popen('stty size', 'r').read().split()
-            outer_max_width = int(term_columns)
+            outer_max_width = get_terminal_width()
         
         # The max width of actual data in the table is the outer max less the
         # space required for formatting the table itself
@@ -257,6 +559,8 @@ class Table(object):
     
     def calculate_render_widths(self):
         
+        self._flush_row_buffer()
+        
         total_width = 0
         min_width = 0
         width_map = {}
@@ -295,7 +599,34 @@ class Table(object):
         
         return total_width
     
-    def build_table(self):
+    def iter_table(self, rows=(), sample_size=None, widths=None):
+        """
+        Generate the lines of the table one at a time, rendering any rows
+        already added to the table, followed by the rows of the given
+        iterable. Rows from the iterable are not retained, allowing tables
+        with a very large number of rows to be rendered in constant memory.
+        
+        Column widths must be determined before any rows can be rendered. If
+        ``widths`` is given, it should be a sequence of raw column widths to
+        use. Otherwise, widths are based on the rows already added to the
+        table, plus a sample of the first ``sample_size`` rows of the iterable
+        (default: STREAM_SAMPLE_SIZE). Values in later rows that do not fit
+        within these widths are truncated.
+        """
+        
+        if sample_size is None:
+            sample_size = self.STREAM_SAMPLE_SIZE
+        
+        rows = iter(rows)
+        
+        if widths is not None:
+            sample = []
+            self.set_column_widths(widths)
+        else:
+            sample = [self._format_row(row) for row in islice(rows, sample_size)]
+            
+            for row in sample:
+                self._update_widths(row)
         
         formatting_buffer = 4 + ((len(self._columns) - 1) * 3)
         
@@ -305,34 +636,199 @@ class Table(object):
         br = '|{0}|'.format(' ' * (table_width - 2))
         hr = '+{0}+'.format('-' * (table_width - 2))
         
-        output = []
-        
+        # Surround the stored and streamed rows with the title, headings and
+        # footer, and the appropriate horizontal rules
+        head_rows = [self.HR]
         if self.title:
-            output.append(hr)
-            output.extend(self.title.get_rows(table_width))
-        
-        for row in self.get_rows():
-            if row is self.BR:
-                output.append(br)
-            elif row is self.HR:
-                output.append(hr)
+            head_rows = [self.HR, self.title, self.HR]
+        
+        if self._headings:
+            head_rows.extend((self._headings, self.HR))
+        
+        tail_rows = [self.HR]
+        if self.footer:
+            tail_rows.extend((self.footer, self.HR))
+        
+        streamed_rows = (self._format_row(row) for row in rows)
+        all_rows = chain(head_rows, self._layout, sample, streamed_rows, tail_rows)
+        
+        data_rows = self._iter_data_rows()
+        
+        for row in all_rows:
+            if row is self._DATA:
+                yield next(data_rows)
+            else:
+                for line in self._render_row(row, table_width, br, hr):
+                    yield line
+    
+    def _iter_records(self, rows=()):
+        """
+        Generate the data rows and full-width rows of the table, followed by
+        those of the given iterable. Data rows are generated as lists of their
+        original, unformatted values. Row constants are skipped.
+        """
+        
+        self._flush_row_buffer()
+        
+        data_rows = iter(self._raw_rows)
+        
+        for row in self._layout:
+            if row is self._DATA:
+                yield list(next(data_rows))
             elif isinstance(row, RowWrapper):
-                output.extend(row.get_rows(table_width))
+                yield row
+        
+        num_columns = len(self._columns)
+        
+        for row in rows:
+            if row is self.BR or row is self.HR:
+                continue
+            elif isinstance(row, RowWrapper):
+                yield row
+                continue
+            
+            row = list(row)
+            if num_columns and len(row) != num_columns:
+                raise Exception('Number of columns in row does not match previously given rows.')
+            
+            yield row
+    
+    def iter_csv(self, rows=()):
+        """
+        Generate the lines of the table in CSV format, one at a time. The
+        headings, if any, form the first line. Full-width rows are output as a
+        single value. Titles and footers are not included. Values are output
+        unescaped, with None output as an empty field.
+        """
+        
+        def quote(value):
+            
+            if value is None:
+                return ''
+            
+            value = force_text(value)
+            
+            if any(c in value for c in (',', '"', '\n', '\r')):
+                value = '"{0}"'.format(value.replace('"', '""'))
+            
+            return value
+        
+        if self._raw_headings:
+            yield ','.join(quote(v) for v in self._raw_headings)
+        
+        for row in self._iter_records(rows):
+            if isinstance(row, RowWrapper):
+                row = [row.raw_value]
+            
+            yield ','.join(quote(v) for v in row)
+    
+    def iter_json(self, rows=()):
+        """
+        Generate the lines of the table in JSON lines format, one at a time.
+        Data rows are output as objects keyed by heading, if the table has
+        headings, otherwise as arrays. Full-width rows are output as objects
+        with a single "section" key. Titles and footers are not included.
+        None, numbers and booleans are output as the equivalent JSON values,
+        and all other values as strings.
+        """
+        
+        json_types = (bool, float) + six.integer_types
+        headings = self._raw_headings
+        
+        for row in self._iter_records(rows):
+            if isinstance(row, RowWrapper):
+                row = {'section': row.raw_value}
             else:
-                row_str = []
-                for i, col in enumerate(self._columns):
-                    value = force_text(row[i]).replace('\n', '\\n').replace('\r', '\\r')
-                    width = col['render_width']
-                    
-                    if len(value) > width:
-                        value = '{0}...'.format(value[:width - 3])
-                    
-                    row_str.append(value.ljust(width))
+                row = [v if v is None or isinstance(v, json_types) else force_text(v) for v in row]
                 
-                output.append('| {0} |'.format(' | '.join(row_str)))
+                if headings:
+                    row = OrderedDict(zip(headings, row))
+            
+            yield json.dumps(row)
+    
+    def iter_markdown(self, rows=()):
+        """
+        Generate the lines of the table in Markdown format, one at a time.
+        Full-width rows are output in bold, in the first column. The title and
+        footer, if any, are output as paragraphs before and after the table.
+        """
+        
+        def md_row(values):
+            
+            return '| {0} |'.format(' | '.join(v.replace('|', '\\|') for v in values))
+        
+        num_columns = len(self._columns) or 1
+        
+        if self.title:
+            yield '**{0}**'.format(self.title.raw_value)
+            yield ''
+        
+        yield md_row(self._headings or [''] * num_columns)
+        yield md_row(['---'] * num_columns)
+        
+        format_value = self._format_value
+        
+        for row in self._iter_records(rows):
+            if isinstance(row, RowWrapper):
+                value = '**{0}**'.format(row.raw_value.replace('\n', '<br>'))
+                row = [value] + [''] * (num_columns - 1)
+            else:
+                row = [format_value(v) for v in row]
+            
+            yield md_row(row)
         
         if self.footer:
-            output.extend(self.footer.get_rows(table_width))
-            output.append(hr)
+            yield ''
+            yield self.footer.raw_value
+    
+    def iter_format(self, format, rows=()):
+        """
+        Generate the lines of the table in the given format, one at a time.
+        ``format`` should be one of the keys of FORMATS.
+        """
+        
+        try:
+            method = self.FORMATS[format]
+        except KeyError:
+            raise TypeError('Unknown format "{0}".'.format(format))
+        
+        return getattr(self, method)(rows)
+    
+    def write_table(self, out, rows=(), sample_size=None, widths=None, format='text'):
+        """
+        Write the table to the given file-like object, one line at a time, as
+        each is rendered, in the given format. See iter_table() for details of
+        the remaining arguments, which only apply to the text format.
+        """
+        
+        if format == 'text':
+            lines = self.iter_table(rows, sample_size, widths)
+        else:
+            lines = self.iter_format(format, rows)
+        
+        for line in lines:
+            out.write(line)
+            out.write('\n')
+    
+    def set_column_widths(self, widths):
+        """
+        Fix the raw widths of the table's columns. Values will be truncated to
+        fit these widths. Columns may still be reduced further to fit the
+        table's maximum width.
+        """
+        
+        self._flush_row_buffer()
+        
+        cols = self._columns
+        
+        if not cols:
+            cols = [self._add_column() for w in widths]
+        elif len(cols) != len(widths):
+            raise Exception('Number of widths does not match previously given number of columns.')
+        
+        for col_data, width in zip(cols, widths):
+            col_data['raw_width'] = width
+    
+    def build_table(self):
         
-        return '\n'.join(output)
+        return '\n'.join(self.iter_table())
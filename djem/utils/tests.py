@@ -5,6 +5,7 @@ from django.template import engines
 from django.test import RequestFactory
 
 from djem.middleware import MemoryStorage
+from djem.utils.mon import M, get_query_log
 
 BETWEEN_TAG_WHITESPACE_RE = re.compile(r'>\s+<')
 EXCESS_WHITESPACE_RE = re.compile(r'\s\s+')
@@ -137,3 +138,72 @@ class TemplateRendererMixin(object):
             output = re.sub(EXCESS_WHITESPACE_RE, ' ', output)
         
         return output.strip()  # remove unnecessary whitespace
+
+
+class _AssertMaxQueriesPerFingerprintContext(object):
+    
+    def __init__(self, test_case, num):
+        
+        self.test_case = test_case
+        self.num = num
+        self.monitor = None
+    
+    def __enter__(self):
+        
+        if not get_query_log().supported:
+            raise Exception('assertMaxQueriesPerFingerprint() requires Django 2.0 or later.')
+        
+        self.monitor = M('assertMaxQueriesPerFingerprint')
+        self.monitor.REPEATED_QUERY_THRESHOLD = None  # do not log warnings
+        self.monitor.start()
+        
+        return self.monitor
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        
+        self.monitor.stop(error=exc_type is not None)
+        
+        if exc_type is not None:
+            return
+        
+        repeated = self.monitor.get_repeated_fingerprints(self.num)
+        if repeated:
+            lines = ['SQL fingerprints executed more than {0} times:'.format(self.num)]
+            
+            for fingerprint, count, location in repeated:
+                lines.append('{0} times, issued by {1}: {2}'.format(count, location, fingerprint))
+            
+            self.test_case.fail('\n'.join(lines))
+
+
+class QueryAssertionsMixin(object):
+    """
+    A mixin for TestCase classes providing assertions on the database queries
+    executed by the code under test.
+    """
+    
+    def assertMaxQueriesPerFingerprint(self, num, func=None, *args, **kwargs):
+        """
+        Assert that no SQL fingerprint (see
+        ``djem.utils.mon.get_sql_fingerprint()``) is executed more than
+        ``num`` times when calling ``func`` with the given arguments. Catches
+        N+1 query problems, regardless of the total number of queries
+        executed. The failure message includes the location of the code that
+        issued each repeated query.
+        
+        If ``func`` is not given, return a context manager that makes the
+        assertion on the queries executed within its block, e.g.::
+        
+            with self.assertMaxQueriesPerFingerprint(1):
+                list(Book.objects.select_related('author'))
+        
+        Requires Django 2.0 or later.
+        """
+        
+        context = _AssertMaxQueriesPerFingerprintContext(self, num)
+        
+        if func is None:
+            return context
+        
+        with context:
+            func(*args, **kwargs)
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse, HttpResponseBadRequest
+
+from djem.utils.mon import Mon, get_aggregate_stats
+from djem.utils.mon_store import SQLiteStore
+from djem.utils.table import Table
+
+FORMAT_CONTENT_TYPES = {
+    'text': 'text/plain',
+    'csv': 'text/csv',
+    'json': 'application/x-ndjson',
+    'markdown': 'text/markdown'
+}
+
+
+def monitor_stats(request):
+    """
+    Staff-only view rendering the aggregated statistics of all top-level
+    monitors, e.g. those of each endpoint, as collected by
+    ``MonitorMiddleware``. If ``DJEM_MON_EXPORT_PATH`` is set, the statistics
+    exported by all processes are combined, otherwise only those of the
+    current process are rendered. The output is a plain text table by
+    default, or can be CSV, JSON lines or Markdown via the "format" query
+    string parameter.
+    """
+    
+    if not request.user.is_active or not request.user.is_staff:
+        raise PermissionDenied
+    
+    format = request.GET.get('format', 'text')
+    if format not in Table.FORMATS:
+        return HttpResponseBadRequest('Unknown format "{0}".'.format(format))
+    
+    export_path = getattr(settings, 'DJEM_MON_EXPORT_PATH', None)
+    
+    if export_path:
+        content = get_aggregate_stats(SQLiteStore(export_path).read().values(), format)
+    else:
+        content = Mon.get_aggregate_stats(format)
+    
+    return HttpResponse(content, content_type='{0}; charset=utf-8'.format(FORMAT_CONTENT_TYPES[format]))